@@ -1,7 +1,13 @@
+import os
+import sys
+
 import PySpin
 import numpy as np
 import PyNvCodec as nvc
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "nvenc", "samples"))
+from FormatNegotiation import negotiate_camera
+
 def capture_and_encode_spinnaker_camera(output_file, num_frames=60, fps=30):
     """
     Capture frames from the Spinnaker camera and directly encode to H.265 using PyNvVideoCodec.
@@ -24,6 +30,10 @@ def capture_and_encode_spinnaker_camera(output_file, num_frames=60, fps=30):
 
     try:
         camera.Init()
+        # This encoder only takes NV12; let the camera deliver the format that is cheapest to convert
+        # (e.g. on-camera YUV 4:2:2 instead of BayerRG8 -> BGR -> NV12 on the host)
+        plan = negotiate_camera(camera, surface_formats=("NV12",))
+        print(plan.report())
         camera.BeginAcquisition()
         print("Capturing video from Spinnaker camera...")
 
@@ -34,6 +44,11 @@ def capture_and_encode_spinnaker_camera(output_file, num_frames=60, fps=30):
         print(f"Frame resolution: {frame_width}x{frame_height}")
         image_result.Release()
 
+        # Convert from the negotiated camera format to NV12, into one preallocated buffer
+        converter = plan.converter(frame_width, frame_height)
+        frame_nv12 = np.empty(converter.layout.frame_size, np.uint8)
+        converter.prepare(frame_nv12)
+
         # Initialize the encoder
         encoder = nvc.PyNvEncoder((frame_width, frame_height), 0, nvc.PixelFormat.NV12, nvc.EncoderPreset.Lossless, nvc.Profile.H265)
         
@@ -46,21 +61,12 @@ def capture_and_encode_spinnaker_camera(output_file, num_frames=60, fps=30):
             if image_result.IsIncomplete():
                 print(f"Image incomplete with image status {image_result.GetImageStatus()}")
             else:
-                # Convert Spinnaker image to NumPy array (BGR format for OpenCV)
-                image_data = image_result.GetNDArray()
-
-                # Handle the Bayer format to ensure the frame is correctly converted to BGR
-                if image_result.GetPixelFormatName() == "BayerRG8":
-                    frame = cv2.cvtColor(image_data, cv2.COLOR_BAYER_RG2BGR)
-                else:
-                    frame = image_data  # If already in BGR or another format
-
                 # Verify that the frame size is correct before sending it to the encoder
-                assert frame.shape[0] == frame_height and frame.shape[1] == frame_width, \
-                    f"Frame size mismatch! Expected: {frame_width}x{frame_height}, Got: {frame.shape[1]}x{frame.shape[0]}"
+                assert image_result.GetHeight() == frame_height and image_result.GetWidth() == frame_width, \
+                    f"Frame size mismatch! Expected: {frame_width}x{frame_height}, Got: {image_result.GetWidth()}x{image_result.GetHeight()}"
 
-                # Convert frame to NV12 format for the encoder
-                frame_nv12 = cv2.cvtColor(frame, cv2.COLOR_BGR2NV12)
+                # Convert the raw image to NV12 format for the encoder
+                converter(image_result.GetData(), frame_nv12)
 
                 # Send frame to encoder
                 encoder.EncodeSingleFrame(frame_nv12, 0)
@@ -69,6 +75,7 @@ def capture_and_encode_spinnaker_camera(output_file, num_frames=60, fps=30):
 
         # Finalize the encoding process
         encoder.Flush()
+        converter.close()
 
         print(f"Video saved to {output_file}.")
 
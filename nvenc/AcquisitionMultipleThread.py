@@ -23,17 +23,38 @@
 # except that loop and vectors are used to allow for simultaneous acquisitions.
 
 import os
+import sys
+import time
+import queue
 import PySpin
 import threading
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples"))
+from FrameSync import FrameSynchroniser
+from CameraStartup import CameraProfile, StartupTimer, start_cameras
+from AsyncLog import get_logger, hot
+from PipelineTrace import Tracer
+
 NUM_IMAGES = 10  # number of images to grab
+SYNC_TOLERANCE_NS = 5_000_000  # frames from different cameras received within 5 ms belong together
+CAMERA_PROFILE = CameraProfile([('AcquisitionMode', 'Continuous')])  # node settings of every camera, see CameraStartup.py
+SAVE_PROFILE_TO_CAMERA = False  # True saves the profile to each camera's UserSet1 once and restores it with one UserSetLoad afterwards
+TRACE_FILE = None  # e.g. 'AcquisitionMultipleThread_trace.json' to see every camera thread's grab / convert / save in Perfetto
+
+logger = get_logger("AcquisitionMultipleThread")
+tracer = Tracer() if TRACE_FILE else None
 
 
-def acquire_images(cam):
+def acquire_images(cam, cam_index=0, synchroniser=None, timer=None, started=False):
     """
     This function acquires and saves 10 images from a device.
 
     :param cam: Camera to acquire images from.
+    :param cam_index: Id the camera pushes its frames to the synchroniser with.
+    :param synchroniser: Optional FrameSynchroniser grouping frames of all cameras.
+    :param timer: Optional StartupTimer marking when this camera delivered its first frame.
+    :param started: True when the camera is already initialised, configured and acquiring
+        (CameraStartup.start_cameras); otherwise this function does it.
     :param nodemap: Device nodemap.
     :param nodemap_tldevice: Transport layer device nodemap.
     :type cam: CameraPtr
@@ -49,65 +70,66 @@ def acquire_images(cam):
 
         nodemap_tldevice = cam.GetTLDeviceNodeMap()
 
-        cam.Init()
-
-        nodemap = cam.GetNodeMap()
-
-        # Set acquisition mode to continuous
-        #
-        #  *** NOTES ***
-        #  Because the example acquires and saves 10 images, setting acquisition
-        #  mode to continuous lets the example finish. If set to single frame
-        #  or multiframe (at a lower number of images), the example would just
-        #  hang. This would happen because the example has been written to
-        #  acquire 10 images while the camera would have been programmed to
-        #  retrieve less than that.
-        #
-        #  Setting the value of an enumeration node is slightly more complicated
-        #  than other node types. Two nodes must be retrieved: first, the
-        #  enumeration node is retrieved from the nodemap; and second, the entry
-        #  node is retrieved from the enumeration node. The integer value of the
-        #  entry node is then set as the new value of the enumeration node.
-        #
-        #  Notice that both the enumeration and the entry nodes are checked for
-        #  availability and readability/writability. Enumeration nodes are
-        #  generally readable and writable whereas their entry nodes are only
-        #  ever readable.
-        #
-        #  Retrieve enumeration node from nodemap
-
-        # In order to access the node entries, they have to be casted to a pointer type (CEnumerationPtr here)
-        node_acquisition_mode = PySpin.CEnumerationPtr(nodemap.GetNode('AcquisitionMode'))
-        if not PySpin.IsAvailable(node_acquisition_mode) or not PySpin.IsWritable(node_acquisition_mode):
-            print('Unable to set acquisition mode to continuous (enum retrieval). Aborting...')
-            return False
+        if not started:
+            cam.Init()
+
+            nodemap = cam.GetNodeMap()
+
+            # Set acquisition mode to continuous
+            #
+            #  *** NOTES ***
+            #  Because the example acquires and saves 10 images, setting acquisition
+            #  mode to continuous lets the example finish. If set to single frame
+            #  or multiframe (at a lower number of images), the example would just
+            #  hang. This would happen because the example has been written to
+            #  acquire 10 images while the camera would have been programmed to
+            #  retrieve less than that.
+            #
+            #  Setting the value of an enumeration node is slightly more complicated
+            #  than other node types. Two nodes must be retrieved: first, the
+            #  enumeration node is retrieved from the nodemap; and second, the entry
+            #  node is retrieved from the enumeration node. The integer value of the
+            #  entry node is then set as the new value of the enumeration node.
+            #
+            #  Notice that both the enumeration and the entry nodes are checked for
+            #  availability and readability/writability. Enumeration nodes are
+            #  generally readable and writable whereas their entry nodes are only
+            #  ever readable.
+            #
+            #  Retrieve enumeration node from nodemap
+
+            # In order to access the node entries, they have to be casted to a pointer type (CEnumerationPtr here)
+            node_acquisition_mode = PySpin.CEnumerationPtr(nodemap.GetNode('AcquisitionMode'))
+            if not PySpin.IsAvailable(node_acquisition_mode) or not PySpin.IsWritable(node_acquisition_mode):
+                print('Unable to set acquisition mode to continuous (enum retrieval). Aborting...')
+                return False
 
-        # Retrieve entry node from enumeration node
-        node_acquisition_mode_continuous = node_acquisition_mode.GetEntryByName('Continuous')
-        if not PySpin.IsAvailable(node_acquisition_mode_continuous) or not PySpin.IsReadable(node_acquisition_mode_continuous):
-            print('Unable to set acquisition mode to continuous (entry retrieval). Aborting...')
-            return False
+            # Retrieve entry node from enumeration node
+            node_acquisition_mode_continuous = node_acquisition_mode.GetEntryByName('Continuous')
+            if not PySpin.IsAvailable(node_acquisition_mode_continuous) or not PySpin.IsReadable(node_acquisition_mode_continuous):
+                print('Unable to set acquisition mode to continuous (entry retrieval). Aborting...')
+                return False
 
-        # Retrieve integer value from entry node
-        acquisition_mode_continuous = node_acquisition_mode_continuous.GetValue()
+            # Retrieve integer value from entry node
+            acquisition_mode_continuous = node_acquisition_mode_continuous.GetValue()
 
-        # Set integer value from entry node as new value of enumeration node
-        node_acquisition_mode.SetIntValue(acquisition_mode_continuous)
+            # Set integer value from entry node as new value of enumeration node
+            node_acquisition_mode.SetIntValue(acquisition_mode_continuous)
 
-        print('Acquisition mode set to continuous...')
+            print('Acquisition mode set to continuous...')
 
-        #  Begin acquiring images
-        #
-        #  *** NOTES ***
-        #  What happens when the camera begins acquiring images depends on the
-        #  acquisition mode. Single frame captures only a single image, multi
-        #  frame catures a set number of images, and continuous captures a
-        #  continuous stream of images. Because the example calls for the
-        #  retrieval of 10 images, continuous mode has been set.
-        #
-        #  *** LATER ***
-        #  Image acquisition must be ended when no more images are needed.
-        cam.BeginAcquisition()
+            #  Begin acquiring images
+            #
+            #  *** NOTES ***
+            #  What happens when the camera begins acquiring images depends on the
+            #  acquisition mode. Single frame captures only a single image, multi
+            #  frame catures a set number of images, and continuous captures a
+            #  continuous stream of images. Because the example calls for the
+            #  retrieval of 10 images, continuous mode has been set.
+            #
+            #  *** LATER ***
+            #  Image acquisition must be ended when no more images are needed.
+            cam.BeginAcquisition()
 
         print('Acquiring images...')
 
@@ -123,6 +145,10 @@ def acquire_images(cam):
             device_serial_number = node_device_serial_number.GetValue()
             print('Device serial number retrieved as %s...' % device_serial_number)
 
+        # Per-frame lines go through the background log writer, at most one per second each
+        grabbed_log = hot(logger)
+        saved_log = hot(logger)
+
         # Retrieve, convert, and save images
         for i in range(NUM_IMAGES):
             try:
@@ -137,7 +163,14 @@ def acquire_images(cam):
                 #  Once an image from the buffer is saved and/or no longer
                 #  needed, the image must be released in order to keep the
                 #  buffer from filling up.
+                span_start = time.perf_counter_ns()
                 image_result = cam.GetNextImage()
+                # host receive time is the one clock every camera shares without PTP or triggers
+                receive_time = time.perf_counter_ns()
+                if tracer is not None:
+                    tracer.span('grab', span_start, receive_time, frame=i)
+                if timer is not None and i == 0:
+                    timer.mark('camera %d first frame' % cam_index)
 
                 #  Ensure image completion
                 #
@@ -159,7 +192,7 @@ def acquire_images(cam):
                     #  name a few.
                     width = image_result.GetWidth()
                     height = image_result.GetHeight()
-                    print('Device:%s Grabbed Image %d, width = %d, height = %d' % (device_serial_number, i, width, height))
+                    grabbed_log.info('Device:%s Grabbed Image %d', device_serial_number, i, width=width, height=height)
 
                     #  Convert image to mono 8
                     #
@@ -171,7 +204,15 @@ def acquire_images(cam):
                     #
                     #  When converting images, color processing algorithm is an
                     #  optional parameter.
+                    span_start = time.perf_counter_ns()
                     image_converted = image_result.Convert(PySpin.PixelFormat_Mono8, PySpin.HQ_LINEAR)
+                    if tracer is not None:
+                        tracer.span('convert', span_start, frame=i)
+
+                    if synchroniser is not None:
+                        # GetNDArray() is a view of the converted image's buffer; the synchroniser
+                        # keeps frames after image_converted is released, so it gets its own copy
+                        synchroniser.push(cam_index, receive_time, image_converted.GetNDArray().copy())
 
                     # Create a unique filename
                     if device_serial_number:
@@ -185,8 +226,11 @@ def acquire_images(cam):
                     #  The standard practice of the examples is to use device
                     #  serial numbers to keep images of one device from
                     #  overwriting those of another.
+                    span_start = time.perf_counter_ns()
                     image_converted.Save(filename)
-                    print('Device:%s Image saved at %s' % (device_serial_number, filename))
+                    if tracer is not None:
+                        tracer.span('save', span_start, frame=i)
+                    saved_log.info('Device:%s Image saved at %s', device_serial_number, filename)
 
                     #  Release image
                     #
@@ -195,12 +239,15 @@ def acquire_images(cam):
                     #  images) need to be released in order to keep from filling the
                     #  buffer.
                     image_result.Release()
-                    print('')
 
             except PySpin.SpinnakerException as ex:
                 print('Error: %s' % ex)
                 return False
 
+        # Write the last throttled lines and how many were skipped since the previous ones
+        grabbed_log.flush()
+        saved_log.flush()
+
         #  End acquisition
         #
         #  *** NOTES ***
@@ -252,6 +299,23 @@ def print_device_info(nodemap, cam_num):
 
     return result
 
+def consume_frame_sets(frame_sets):
+    """
+    Placeholder consumer of the synchronised frame sets; a stereo / multi-view stage would run here.
+
+    :param frame_sets: Queue of FrameSet tuples, terminated by None.
+    :type frame_sets: queue.Queue
+    """
+    while True:
+        frame_set = frame_sets.get()
+        if frame_set is None:
+            break
+        spread_ms = (max(frame_set.timestamps.values()) - min(frame_set.timestamps.values())) / 1e6
+        if tracer is not None:
+            tracer.instant('frame set')
+        print('Frame set of %d cameras, spread %.2f ms' % (len(frame_set.frames), spread_ms))
+
+
 def run_multiple_cameras(cam_list):
     """
     This function acts as the body of the example; please see NodeMapInfo example
@@ -265,23 +329,6 @@ def run_multiple_cameras(cam_list):
     try:
         result = True
 
-        # Retrieve transport layer nodemaps and print device information for
-        # each camera
-        # *** NOTES ***
-        # This example retrieves information from the transport layer nodemap
-        # twice: once to print device information and once to grab the device
-        # serial number. Rather than caching the nodem#ap, each nodemap is
-        # retrieved both times as needed.
-        print('*** DEVICE INFORMATION ***\n')
-
-        for i, cam in enumerate(cam_list):
-
-            # Retrieve TL device nodemap
-            nodemap_tldevice = cam.GetTLDeviceNodeMap()
-
-            # Print device information
-            result &= print_device_info(nodemap_tldevice, i)
-
         # Initialize each camera
         #
         # *** NOTES ***
@@ -294,17 +341,52 @@ def run_multiple_cameras(cam_list):
         # Each camera needs to be deinitialized once all images have been
         # acquired.
 
+        # All cameras are initialised, configured from CAMERA_PROFILE and started in parallel
+        timer = StartupTimer()
+        started = start_cameras(cam_list, CAMERA_PROFILE, timer=timer, save_user_set=SAVE_PROFILE_TO_CAMERA)
+
+        # Matched frame sets from all cameras end up on frame_sets, ready for multi-view processing
+        frame_sets = queue.Queue()
+        synchroniser = FrameSynchroniser(range(len(started)), SYNC_TOLERANCE_NS, output=frame_sets)
+        consumer = threading.Thread(target=consume_frame_sets, args=(frame_sets,))
+        consumer.start()
+
+        # Acquisition threads run before anything else so that the (slow, serial) device information
+        # printing below overlaps with grabbing instead of delaying it
         threads = []
 
-        for i, cam in enumerate(cam_list):
-            t = threading.Thread(target=acquire_images, args = (cam,))
+        for camera in started:
+            t = threading.Thread(target=acquire_images, args = (camera.cam, camera.index, synchroniser, timer, True), name='camera %d' % camera.index)
             threads.append(t)
             t.start()
 
+        # Retrieve transport layer nodemaps and print device information for
+        # each camera
+        # *** NOTES ***
+        # This example retrieves information from the transport layer nodemap
+        # twice: once to print device information and once to grab the device
+        # serial number. Rather than caching the nodem#ap, each nodemap is
+        # retrieved both times as needed.
+        print('*** DEVICE INFORMATION ***\n')
+
+        for i, cam in enumerate(cam_list):
+
+            # Retrieve TL device nodemap
+            nodemap_tldevice = cam.GetTLDeviceNodeMap()
+
+            # Print device information
+            result &= print_device_info(nodemap_tldevice, i)
+
         for t in threads:
             t.join()
 
         print("Threads joined")
+        synchroniser.close()
+        consumer.join()
+        print('Frame synchroniser: %s' % synchroniser.report())
+        print('Time to first frame:\n%s' % timer.report())
+        if tracer is not None:
+            print('Trace with %d events written to %s' % (tracer.dump(TRACE_FILE), TRACE_FILE))
 
         # Release reference to camera
         # NOTE: Unlike the C++ examples, we cannot rely on pointer objects being automatically
@@ -1,3 +1,4 @@
+import os
 import sys
 import cv2
 from PyQt6.QtWidgets import QApplication, QLabel, QVBoxLayout, QWidget, QPushButton, QSlider, QHBoxLayout
@@ -7,6 +8,14 @@ import PySpin
 import numpy as np
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples"))
+from StandbyWriter import StandbyWriter
+from PreRoll import PreRollRecorder
+
+PREROLL_SECONDS = 0  # e.g. 2.0 to include the seconds before the Start click in each recording (costs that much RAM); 0 to disable
+FRAMERATE_APPLY_DELAY_MS = 300  # a new framerate is applied once the slider has been still this long
+PREROLL_HEADROOM_SECONDS = 1.0  # how far the background writer may fall behind before frames are dropped
+
 class CameraViewer(QWidget):
     def __init__(self):
         super().__init__()
@@ -29,6 +38,11 @@ class CameraViewer(QWidget):
         self.framerate_slider.setRange(5, 60)  # Framerate range from 5 to 60 FPS
         self.framerate_slider.setValue(30)
         self.framerate_slider.valueChanged.connect(self.update_framerate_label) # Update the label when the slider value changes
+        # Reopening the standby writer and pre-roll waits until the slider has stopped moving for a moment
+        self.framerate_apply_timer = QTimer()
+        self.framerate_apply_timer.setSingleShot(True)
+        self.framerate_apply_timer.setInterval(FRAMERATE_APPLY_DELAY_MS)
+        self.framerate_apply_timer.timeout.connect(self.apply_framerate)
 
         # Create a layout for the framerate slider and label
         framerate_layout = QHBoxLayout()
@@ -90,6 +104,15 @@ class CameraViewer(QWidget):
         print(f"Camera Resolution: {self.width}x{self.height}")
         print(f"Is Color: {self.IS_COLOR}")
 
+        # Keep a video writer open in the background so recording starts on the very next frame
+        self.standby_writer = StandbyWriter(self.open_video_writer, suffix=".mp4",
+                                            is_opened=lambda writer: writer.isOpened())
+        self.record_click_time = None  # used to report the click -> first written frame latency
+
+        # Every frame goes into a fixed size ring; Start writes the ring and then the live frames
+        # from a background thread, so the seconds before the click are part of the recording
+        self.preroll = self.create_preroll() if PREROLL_SECONDS > 0 else None
+
     def update_image(self):
         try:
             
@@ -115,17 +138,22 @@ class CameraViewer(QWidget):
             pixmap = QPixmap.fromImage(image)
             self.image_label.setPixmap(pixmap)
 
-            # Save the image to the video file if recording is enabled
-            if self.RECORDING and self.video_writer is not None:
-                if not self.IS_COLOR:
-                    # Convert grayscale to BGR before writing to the video
-                    image_bgr = cv2.cvtColor(image_data, cv2.COLOR_GRAY2BGR)
-                else:
-                    image_bgr = cv2.cvtColor(image_data, cv2.COLOR_RGB2BGR)  # Back to BGR for video writer
+            first_write_time = None
+            if self.preroll is not None:
+                # Keep the frame in the pre-roll ring (a copy into a preallocated slot, never blocks)
+                self.preroll.push(image_data)
+                first_write_time = self.preroll.first_write_time  # set by the pre-roll writer thread
 
+            # Save the image to the video file if recording is enabled
+            elif self.RECORDING and self.video_writer is not None:
                 # Write the frame to the video_writer object that will save to become a video
-                self.video_writer.write(image_bgr)
+                self.video_writer.write(self.to_bgr(image_data))
                 self.frame_count += 1  # Increment frame count
+                first_write_time = time.perf_counter()
+
+            if self.record_click_time is not None and first_write_time is not None:
+                print(f"First frame written {(first_write_time - self.record_click_time) * 1000:.1f} ms after start")
+                self.record_click_time = None
 
             # Release the image back to the camera
             image_result.Release()
@@ -133,11 +161,37 @@ class CameraViewer(QWidget):
         except PySpin.SpinnakerException as e:
             print(f"Error: {e}")
 
+    def to_bgr(self, image_data):
+        if not self.IS_COLOR:
+            # Convert grayscale to BGR before writing to the video
+            return cv2.cvtColor(image_data, cv2.COLOR_GRAY2BGR)
+        return cv2.cvtColor(image_data, cv2.COLOR_RGB2BGR)  # Back to BGR for video writer
+
+    def create_preroll(self):
+        frame_shape = (self.height, self.width, 3) if self.IS_COLOR else (self.height, self.width)
+        preroll = PreRollRecorder(frame_shape, np.uint8, self.FRAMERATE, PREROLL_SECONDS,
+                                  PREROLL_HEADROOM_SECONDS, transform=self.to_bgr)
+        print(f"Pre-roll: {PREROLL_SECONDS:.1f} s, {preroll.nbytes / 1e6:.1f} MB")
+        return preroll
+
     def update_framerate_label(self):
         # Update the label to reflect the current framerate slider value
         self.FRAMERATE = self.framerate_slider.value()
         self.TIME_INTERVAL = 1000 // self.FRAMERATE  # Calculate the time interval based on the framerate
         self.framerate_label.setText(f"Framerate: {self.FRAMERATE} FPS")
+        self.framerate_apply_timer.start()  # restarts while the slider keeps moving
+
+    def apply_framerate(self):
+        # The standby writer was opened for the old framerate, open a new one in the background
+        self.standby_writer.reconfigure(self.open_video_writer)
+        if self.preroll is not None and not self.preroll.recording:
+            self.preroll = self.create_preroll()  # pre-roll length is counted in frames
+
+    def open_video_writer(self, path):
+        # Create a video writer object to save the video with the selected framerate
+        # (called from a background thread by the standby writer, never on a button click)
+        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+        return cv2.VideoWriter(path, fourcc, self.FRAMERATE, (self.width, self.height), isColor=True)
 
     def update_elapsed_time(self):
         # Update the elapsed time label
@@ -147,15 +201,24 @@ class CameraViewer(QWidget):
 
     def start_recording(self):
         try:
-            # Create a video writer object to save the video with the selected framerate
-            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-            self.video_writer = cv2.VideoWriter("output.mp4", fourcc, self.FRAMERATE, (self.width, self.height), isColor=True)
-
-            if not self.video_writer.isOpened():
-                print("Error: Could not open video file for writing.")
+            if self.preroll is not None and self.preroll.recording:
+                print("Previous recording is still being written, try again in a moment.")
+                return
+            self.record_click_time = time.perf_counter()
+            # Swap in the writer that is already open; every trial gets its own file
+            output_name = time.strftime("output_%Y%m%d_%H%M%S.mp4")
+            try:
+                self.video_writer = self.standby_writer.start(output_name)
+            except (IOError, TimeoutError) as e:
+                print(f"Error: Could not open video file for writing. {e}")
                 return
 
-            print(f"Recording started at {self.FRAMERATE} FPS...")
+            if self.preroll is not None:
+                # The pre-roll and then the live frames are written from the pre-roll thread, which
+                # hands the writer back to the standby writer once stop_recording() has drained it
+                self.preroll.trigger(self.video_writer, on_done=lambda writer: self.standby_writer.stop())
+
+            print(f"Recording started at {self.FRAMERATE} FPS to {output_name}...")
             self.RECORDING = True
             self.frame_count = 0  # Reset frame count
             self.start_time = time.time()  # Start the timer
@@ -167,9 +230,14 @@ class CameraViewer(QWidget):
             print(f"Failed to start recording: {e}")
 
     def stop_recording(self):
-        # Release the video writer object
+        # Release the video writer object (in the background; the file gets its final name once it is closed)
+        self.RECORDING = False
+        if self.preroll is not None and self.preroll.recording:
+            self.preroll.stop()
+            self.frame_count = self.preroll.written
+            self.video_writer = None
         if self.video_writer is not None:
-            self.video_writer.release()
+            self.standby_writer.stop()
             self.video_writer = None
 
         print(f"Recording stopped... Total frames written: {self.frame_count}. Elapsed time: {time.time() - self.start_time:.1f} s")
@@ -183,8 +251,14 @@ class CameraViewer(QWidget):
         self.elapsed_time_label.setText("Elapsed Time: 0.0 s")  # Reset elapsed time display
 
     def closeEvent(self, event):
-        # Stop the timer
+        # Stop the timers
         self.timer.stop()
+        self.framerate_apply_timer.stop()
+
+        # Finish any recording and remove the unused standby file
+        if self.preroll is not None:
+            self.preroll.stop(wait=True)
+        self.standby_writer.close()
 
         # Clean up the camera and system resources when the window is closed
         self.camera.EndAcquisition()
@@ -23,7 +23,7 @@
 #  see the 2 camera version for better threading, frame triggering, and a TO DO list for improvements
 # =============================================================================
 
-import PySpin, time, threading, queue, os
+import PySpin, time, threading, os, sys
 from datetime import datetime
 import tkinter as tk
 from PIL import Image, ImageTk
@@ -31,6 +31,16 @@ import numpy as np
 import skvideo
 skvideo.setFFmpegPath("C:/Users/alifa/ffmpeg-7.1") #set path to ffmpeg installation before importing io
 import skvideo.io
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples"))
+from CameraStartup import CameraProfile, StartupTimer, start_cameras
+from ActivityGate import ActivityGate
+from FrameTransform import FrameTransform
+from ChunkedStore import ChunkedArrayWriter
+from FanOut import FanOut
+from FrameBus import FrameBusPublisher
+from StreamBuffers import StreamBufferController
+from StageTimer import StageTimer
+from PipelineTrace import Tracer
 
 #constants
 SAVE_FOLDER_ROOT = 'C:/Users/alifa/Documents/video'
@@ -43,6 +53,18 @@ IMAGE_HEIGHT = 240  #540 pixels default
 IMAGE_WIDTH = 320 #720 pixels default
 HEIGHT_OFFSET = round((540-IMAGE_HEIGHT)/2) # Y, to keep in middle of sensor
 WIDTH_OFFSET = round((720-IMAGE_WIDTH)/2) # X, to keep in middle of sensor
+SOFTWARE_ROI = None # (x, y, width, height) within the sensor ROI above, cropped in software; None keeps the whole image
+SOFTWARE_BINNING = 1 # 1, 2 (2x2) or 4 (4x4) binning in software before writing
+DECIMATION = 1 # write every n-th frame
+ACTIVITY_THRESHOLD = None # e.g. 4.0 (mean grey level change that counts as activity) records only around activity; None records every frame
+ACTIVITY_PRE_SEC = 1.0 # seconds kept before activity starts
+ACTIVITY_POST_SEC = 2.0 # seconds kept after activity ends
+LOSSLESS_STORE = False # True writes a lossless chunked .zarr directory (see ChunkedStore.py) instead of an H.264 .mp4
+ONLINE_TRACKER = None # optional function(frame, timestamp) run on its own thread; it gets the newest frames it can keep up with
+FRAME_BUS_NAME = None # e.g. 'rig1' to share live frames with other processes on this PC (see FrameBus.py); None to disable
+STAGE_TIMING = True # per-stage latency histograms and utilisation, saved next to the movie (see StageTimer.py); costs well under 1%
+TRACE_SESSION = False # True saves a Chrome/Perfetto timeline of every stage on every thread next to the movie (see PipelineTrace.py)
+SAVE_PROFILE_TO_CAMERA = False # True overwrites the camera's UserSet1 once and loads it on later starts (faster); leave off if other software uses UserSet1
 
 # generate output video directory and filename and make sure not overwriting
 now = datetime.now()
@@ -56,63 +78,103 @@ os.chdir(saveFolder)
 movieName = FILENAME_ROOT + timeStr + '_' + mouseStr + '.mp4'
 fullFilePath = [saveFolder + '/' + movieName]
 print('Video will be saved to: {}'.format(fullFilePath))
+startupTimer = StartupTimer() # time-to-first-recorded-frame is measured from here
 
 # SETUP FUNCTIONS #############################################################################################################
-def initCam(cam): #function to initialize camera parameters for synchronized capture
-    cam.Init()
-    # load default configuration
-    cam.UserSetSelector.SetValue(PySpin.UserSetSelector_Default)
-    cam.UserSetLoad()
-    # set acquisition. Continues acquisition. Auto exposure off. Set frame rate using exposure time. 
-    cam.AcquisitionMode.SetValue(PySpin.AcquisitionMode_Continuous)
-    cam.ExposureAuto.SetValue(PySpin.ExposureAuto_Off)
-    cam.ExposureMode.SetValue(PySpin.ExposureMode_Timed) #Timed or TriggerWidth (must comment out trigger parameters other that Line)
-    cam.ExposureTime.SetValue(EXPOSURE_TIME)
-    cam.AcquisitionFrameRateEnable.SetValue(False)
-    # set analog. Set Gain + Gamma. 
-    cam.GainAuto.SetValue(PySpin.GainAuto_Off)
-    cam.Gain.SetValue(GAIN_VALUE)
-    cam.GammaEnable.SetValue(True)
-    cam.Gamma.SetValue(GAMMA_VALUE)
+# camera settings, applied in this order (see CameraStartup.py). With SAVE_PROFILE_TO_CAMERA they are stored
+# on the camera in UserSet1 after the first run and restored with a single UserSetLoad instead of 20+ node writes.
+CAMERA_PROFILE = CameraProfile([
+    # set acquisition. Continues acquisition. Auto exposure off. Set frame rate using exposure time.
+    ('AcquisitionMode', 'Continuous'),
+    ('ExposureAuto', 'Off'),
+    ('ExposureMode', 'Timed'), #Timed or TriggerWidth (must comment out trigger parameters other that Line)
+    ('ExposureTime', EXPOSURE_TIME),
+    ('AcquisitionFrameRateEnable', False),
+    # set analog. Set Gain + Gamma.
+    ('GainAuto', 'Off'),
+    ('Gain', GAIN_VALUE),
+    ('GammaEnable', True),
+    ('Gamma', GAMMA_VALUE),
     # set ADC bit depth and image pixel depth, size
-    cam.AdcBitDepth.SetValue(PySpin.AdcBitDepth_Bit8)
-    cam.PixelFormat.SetValue(PySpin.PixelFormat_Mono8)
-    cam.Width.SetValue(IMAGE_WIDTH)
-    cam.Height.SetValue(IMAGE_HEIGHT)
-    cam.OffsetX.SetValue(WIDTH_OFFSET)
-    cam.OffsetY.SetValue(HEIGHT_OFFSET)
-    # setup FIFO buffer
-    camTransferLayerStream = cam.GetTLStreamNodeMap()
-    handling_mode1 = PySpin.CEnumerationPtr(camTransferLayerStream.GetNode('StreamBufferHandlingMode'))
-    handling_mode_entry = handling_mode1.GetEntryByName('OldestFirst')
-    handling_mode1.SetIntValue(handling_mode_entry.GetValue())
+    ('AdcBitDepth', 'Bit8'),
+    ('PixelFormat', 'Mono8'),
+    ('Width', IMAGE_WIDTH),
+    ('Height', IMAGE_HEIGHT),
+    ('OffsetX', WIDTH_OFFSET),
+    ('OffsetY', HEIGHT_OFFSET),
     # set trigger input to Line0 (the black wire) if desired - default is Trigger OFF to free-run as fast as possible
-#    cam.TriggerMode.SetValue(PySpin.TriggerMode_On)
-#    cam.TriggerOverlap.SetValue(PySpin.TriggerOverlap_ReadOut) #Off or ReadOut to speed up
-#    cam.TriggerSource.SetValue(PySpin.TriggerSource_Line0)
-#    cam.TriggerActivation.SetValue(PySpin.TriggerActivation_RisingEdge) #LevelHigh or RisingEdge
-#    cam.TriggerSelector.SetValue(PySpin.TriggerSelector_FrameStart) # require trigger for each frame
+#    ('TriggerMode', 'On'),
+#    ('TriggerOverlap', 'ReadOut'), #Off or ReadOut to speed up
+#    ('TriggerSource', 'Line0'),
+#    ('TriggerActivation', 'RisingEdge'), #LevelHigh or RisingEdge
+#    ('TriggerSelector', 'FrameStart'), # require trigger for each frame
     # optionally send exposure active signal on Line 2 (the white wire)
-    cam.LineSelector.SetValue(PySpin.LineSelector_Line1)
-    cam.LineMode.SetValue(PySpin.LineMode_Output) 
-    cam.LineSource.SetValue(PySpin.LineSource_ExposureActive) #route desired output to Line 1 (try Counter0Active or ExposureActive)
-    #cam.LineSelector.SetValue(PySpin.LineSelector_Line2)
-    #cam.V3_3Enable.SetValue(True) #enable 3.3V rail on Line 2 (red wire) to act as a pull up for ExposureActive - this does not seem to be necessary as long as a pull up resistor is installed between the physical lines, and actually degrades signal quality
-    
-def save_img(image_queue, writer, i): #function to save video frames from the queue in a separate thread
+    ('LineSelector', 'Line1'),
+    ('LineMode', 'Output'),
+    ('LineSource', 'ExposureActive'), #route desired output to Line 1 (try Counter0Active or ExposureActive)
+    #('LineSelector', 'Line2'),
+    #('V3_3Enable', True), #enable 3.3V rail on Line 2 (red wire) to act as a pull up for ExposureActive - this does not seem to be necessary as long as a pull up resistor is installed between the physical lines, and actually degrades signal quality
+], stream=[
+    # setup FIFO buffer
+    ('StreamBufferHandlingMode', 'OldestFirst'),
+])
+
+# software crop / binning / decimation (settings can be changed while running with transform.configure())
+transform = None
+if SOFTWARE_ROI is not None or SOFTWARE_BINNING != 1 or DECIMATION != 1:
+    # frames are held in the unbounded save queue, so binned frames must not share output buffers
+    transform = FrameTransform([SOFTWARE_ROI] if SOFTWARE_ROI else None, SOFTWARE_BINNING, DECIMATION, reuse_output=False)
+
+def openWriter(cam_index): #function to open the compressed video writer, runs while the camera is being configured
+    outHeight, outWidth = transform.settings.output_shapes((IMAGE_HEIGHT, IMAGE_WIDTH))[0] if transform else (IMAGE_HEIGHT, IMAGE_WIDTH)
+    if LOSSLESS_STORE:
+        # blocks of 32 frames are delta filtered and compressed on 4 threads; same writeFrame/close calls as skvideo
+        return ChunkedArrayWriter(movieName.replace('.mp4', '.zarr'), (outHeight, outWidth), np.uint8, chunk_frames=32, threads=4)
+    # setup output video file parameters (can try H265 in future for better compression):
+    # for some reason FFMPEG takes exponentially longer to write at nonstandard frame rates, so just use default 25fps and change elsewhere if needed
+    crfOut = 21 #controls tradeoff between quality and storage, see https://trac.ffmpeg.org/wiki/Encode/H.264
+    ffmpegThreads = 4 #this controls tradeoff between CPU usage and memory usage; video writes can take a long time if this value is low
+    #crfOut = 18 #this should look nearly lossless
+    #writer = skvideo.io.FFmpegWriter(movieName, outputdict={'-r': str(FRAME_RATE_OUT), '-vcodec': 'libx264', '-crf': str(crfOut)}) # with frame rate
+    writer = skvideo.io.FFmpegWriter(movieName, outputdict={'-vcodec': 'libx264', '-crf': str(crfOut), '-threads': str(ffmpegThreads)})
+    # skvideo launches ffmpeg on the first writeFrame; that happens on the save thread behind the unbounded
+    # recorder queue, so the grab loop never waits for it
+    return writer
+
+# where the time goes per frame: grab = GetNextImage, convert = numpy copy + software transform, publish = fan-out,
+# gui = screen update, write = gating + writeFrame on the save thread
+# with tracing on, every timed stage is also a slice on its thread's track, tagged with the frame number
+tracer = Tracer() if TRACE_SESSION else None
+timing = StageTimer(('grab', 'convert', 'publish', 'gui', 'write'), tracer=tracer) if STAGE_TIMING or TRACE_SESSION else None
+
+def save_img(recorder, writer, i): #function to save video frames from the fan-out in a separate thread
+    firstFrame = True
+    WRITE = timing.index['write'] if timing else None
+    frameNumber = -1 #frames arrive in publish order; equal to the grab index unless decimating
     while True:
-        dequeuedImage = image_queue.get() 
-        if dequeuedImage is None:
+        sharedImage = recorder.get() #blocks until the next frame; None once the fan-out is closed and drained
+        if sharedImage is None:
             break
-        else:
-            writer.writeFrame(dequeuedImage)
-            image_queue.task_done()
+        frameNumber += 1
+        with sharedImage: #released when done, the frame itself is never copied
+            t = time.perf_counter_ns()
+            keptImages = [(sharedImage.timestamp, sharedImage.array)] if gate is None else gate.update(sharedImage.array, sharedImage.timestamp) #static frames are held back or skipped
+            for _, dequeuedImage in keptImages:
+                writer.writeFrame(dequeuedImage)
+                if firstFrame:
+                    startupTimer.mark('first recorded frame')
+                    firstFrame = False
+            if timing:
+                timing.record(WRITE, t, frameNumber)
 
 # INITIALIZE CAMERA & COMPRESSION ###########################################################################################
 system = PySpin.System.GetInstance() # Get camera system
 cam_list = system.GetCameras() # Get camera list
 cam1 = cam_list[0]
-initCam(cam1) 
+# configure the camera and open the video writer concurrently
+started = start_cameras([cam1], CAMERA_PROFILE, encoder_factory=openWriter, timer=startupTimer, begin_acquisition=False,
+                        save_user_set=SAVE_PROFILE_TO_CAMERA)
+writer = started[0].encoder
 
 # get frame rate and query for video length based on this
 frameRate = cam1.AcquisitionResultingFrameRate()
@@ -120,13 +182,14 @@ print('frame rate = {:.2f} FPS'.format(frameRate))
 numImages = round(frameRate*SEC_TO_RECORD)
 print('# frames = {:d}'.format(numImages))
 
-# setup output video file parameters (can try H265 in future for better compression):  
-# for some reason FFMPEG takes exponentially longer to write at nonstandard frame rates, so just use default 25fps and change elsewhere if needed
-crfOut = 21 #controls tradeoff between quality and storage, see https://trac.ffmpeg.org/wiki/Encode/H.264 
-ffmpegThreads = 4 #this controls tradeoff between CPU usage and memory usage; video writes can take a long time if this value is low
-#crfOut = 18 #this should look nearly lossless
-#writer = skvideo.io.FFmpegWriter(movieName, outputdict={'-r': str(FRAME_RATE_OUT), '-vcodec': 'libx264', '-crf': str(crfOut)}) # with frame rate
-writer = skvideo.io.FFmpegWriter(movieName, outputdict={'-vcodec': 'libx264', '-crf': str(crfOut), '-threads': str(ffmpegThreads)})
+# stream buffer count sized from the grab-loop lag and lost frames of previous sessions (see StreamBuffers.py)
+bufferController = StreamBufferController(IMAGE_WIDTH*IMAGE_HEIGHT, frameRate, serial=started[0].serial)
+bufferController.configure(cam1) #must happen before BeginAcquisition
+
+# only frames with activity (plus padding) are sent to the writer; kept segments are saved next to the movie
+gate = None
+if ACTIVITY_THRESHOLD is not None:
+    gate = ActivityGate(ACTIVITY_THRESHOLD, pre_frames=round(frameRate*ACTIVITY_PRE_SEC), post_frames=round(frameRate*ACTIVITY_POST_SEC))
 
 #setup tkinter GUI (non-blocking, i.e. without mainloop) to output images to screen quickly
 window = tk.Tk()
@@ -147,18 +210,43 @@ window.update() #update TCL tasks to make window appear
 try:
     print('Press Ctrl-C to exit early and save video')
     cam1.BeginAcquisition()
+    bufferController.poll(cam1) #baseline of the lost frame counters
     tStart = time.time()
     i = 0
-    image_queue = queue.Queue() #create queue in memory to store images while asynchronously written to disk
+    # every frame goes to all subscribers at once: the recorder never drops (unbounded queue in memory while
+    # asynchronously written to disk), the optional tracker only ever drops its own frames
+    fanout = FanOut()
+    recorder = fanout.subscribe('recorder', depth=0, policy='block')
+    if ONLINE_TRACKER is not None:
+        fanout.subscribe('tracker', depth=2, policy='drop_oldest', callback=ONLINE_TRACKER)
+    frameBus = None
+    if FRAME_BUS_NAME is not None:
+        # external processes attach by name; publishing never waits for them
+        busShape = transform.settings.output_shapes((IMAGE_HEIGHT, IMAGE_WIDTH))[0] if transform else (IMAGE_HEIGHT, IMAGE_WIDTH)
+        frameBus = FrameBusPublisher(FRAME_BUS_NAME, busShape, np.uint8, slots=max(8, round(frameRate))) # about 1 s of frames
+        fanout.subscribe('frame bus', depth=2, policy='drop_oldest', callback=frameBus.publish)
     # setup another thread to accelerate saving, and start immediately:
-    save_thread = threading.Thread(target=save_img, args=(image_queue, writer, i,))
+    save_thread = threading.Thread(target=save_img, args=(recorder, writer, i,))
     save_thread.start()  
+    if timing:
+        timing.reset() #measure from the first grab, not from startup
+        GRAB, CONVERT, PUBLISH, GUI = (timing.index[name] for name in ('grab', 'convert', 'publish', 'gui'))
 
     for i in range(numImages):
 
+        t = time.perf_counter_ns()
         image = cam1.GetNextImage() #get pointer to next image in camera buffer; blocks until image arrives via USB; timeout=INF
+        if timing: t = timing.record(GRAB, t, i)
+        bufferController.observe_frame(image.GetTimeStamp()) #how long the frame waited in the stream buffers
         enqueuedImage = np.array(image.GetData(), dtype="uint8").reshape( (image.GetHeight(), image.GetWidth()) ); #convert PySpin ImagePtr into numpy array
-        image_queue.put(enqueuedImage) #put next image in queue
+        outImage = enqueuedImage
+        if transform is not None:
+            outImage = transform(enqueuedImage) #crop is a view, binning a vectorized reduction; None when decimated
+        if timing: t = timing.record(CONVERT, t, i)
+        if outImage is not None:
+            fanout.publish(outImage, image.GetTimeStamp()) #hand the same frame to the recorder and the tracker
+        if timing: t = timing.record(PUBLISH, t, i)
+        if tracer: tracer.counter('save queue', len(recorder)) #rising when the save thread falls behind
         
         if i%10 == 0: #update screen every 10 frames 
             timeElapsed = str(time.time() - tStart)
@@ -168,6 +256,8 @@ try:
             imglabel.configure(image=I)
             imglabel.image = I #keep reference to image
             window.update() #update on screen (this must be called from main thread)
+            bufferController.poll(cam1)
+            if timing: timing.record(GUI, t, i)
             
         image.Release() #release from camera buffer
 
@@ -179,14 +269,33 @@ except KeyboardInterrupt: #if user hits Ctrl-C, everything should end gracefully
         
 # NOTE that from the penultimate image grab until EndAcquisition to stop Line 1 will take a few milliseconds,
 # so the last AcquisitionActive edges can be discarded by the DAQ system
+bufferController.poll(cam1)
 cam1.EndAcquisition() 
 tEndAcq = time.time()
 print('Capture ends at: {:.2f}sec'.format(tEndAcq - tStart))
 #   print('calculated frame rate: {:.2f}FPS'.format(numImages/(t2 - t1)))
-image_queue.join() #wait until queue is done writing to disk
+fanout.close() #subscribers finish their queued frames
+save_thread.join() #wait until queue is done writing to disk
+print(fanout.report())
+if frameBus is not None:
+    print(frameBus.report())
+    frameBus.close()
+print('Startup timeline:\n' + startupTimer.report())
+if timing:
+    print('Stage timing:\n' + timing.report())
+    timing.export(movieName.replace('.mp4', '_timing.json')) #plus one .hgrm histogram per stage
+if tracer:
+    tracer.dump(movieName.replace('.mp4', '_trace.json')) #open in https://ui.perfetto.dev
+bufferController.end_session() #logs the lag / lost frames and saves the buffer count for the next session
+if gate is not None:
+    gate.close()
+    gate.save_timeline(movieName.replace('.mp4', '_segments.json'))
+    print('Activity gate kept {:d} of {:d} frames in {:d} segments'.format(gate.frames_kept, gate.frames_seen, len(gate.timeline)))
 tEndWrite = time.time()
 print('File written at: {:.2f}sec'.format(tEndWrite - tStart))
 writer.close()
+if LOSSLESS_STORE:
+    print('Lossless store: ' + writer.report())
 window.destroy()
     
 del image
@@ -1,8 +1,18 @@
+import os
+import sys
 import PySpin
 import PyNvVideoCodec as nvc
 import numpy as np
 import ffmpeg
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples"))
+from AsyncLog import get_logger, hot
+
+logger = get_logger("complete pipeline")
+# per-frame diagnostics: at most one line per second each, written off the acquisition thread
+acquired_log = hot(logger)
+compressed_log = hot(logger)
+processed_log = hot(logger)
 
 
 def acquire_images(cam):
@@ -19,7 +29,7 @@ def acquire_images(cam):
         else:
             # Convert image to NumPy array
             image_data = image_result.GetNDArray()
-            print(f"Acquired image, size: {image_data.shape}")
+            acquired_log.info("Acquired image", shape=image_data.shape)
 
         # Release image
         image_result.Release()
@@ -40,7 +50,7 @@ def compress_frame(frame, codec, width, height):
     enc_frame = codec.EncodeSingleFrame(frame)
     
     # Encoded frame is in the form of bytearray
-    print(f"Compressed frame size: {len(enc_frame)} bytes")
+    compressed_log.info("Compressed frame", bytes=len(enc_frame))
     
     return enc_frame
 
@@ -88,12 +98,14 @@ def acquire_and_compress_video(cam, codec, output_file, width, height, num_frame
             # Write the encoded frame to the ffmpeg process
             process.stdin.write(enc_frame)
 
-            print(f"Frame {i} compressed and processed")
+            processed_log.info("Frame %d compressed and processed", i, bytes=len(enc_frame))
 
             # Release the image
             image_result.Release()
 
     finally:
+        # Write the last throttled line and how many were skipped since the previous one
+        processed_log.flush()
         # End acquisition
         cam.EndAcquisition()
         # Close ffmpeg process
@@ -134,6 +146,8 @@ if __name__ == '__main__':
         acquire_and_compress_video(cam, codec, output_file, width, height, num_frames=100)
 
     finally:
+        acquired_log.flush()
+        compressed_log.flush()
         cam.DeInit()
         del cam
         cam_list.Clear()
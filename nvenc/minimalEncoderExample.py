@@ -1,10 +1,19 @@
+import os
+import sys
+
 import cv2
 import numpy as np
 import PyNvVideoCodec as nvc
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples"))
+from ColorConvert import ColorConverter
+from SurfacePool import SurfacePool
+from ReplaySource import ReplayCamera, ReplayClip
+
 
 VIDEO_PATH = 'test_files/random_noise_video.mp4'
 # VIDEO_PATH = 'test_files/random_noise_video.yuv'
+REPLAY_RATE = None  # e.g. 1.0 feeds frames at the video's own frame rate like a live camera (see ReplaySource.py)
 
 
 
@@ -27,6 +36,7 @@ bitrate = 4_000_000  # 4 Mbps
 # bitrate = 4_000_000  # 4 Mbps
 # fps = 30
 
+# ColorConverter writes NV12 (Y plane + interleaved UV) straight into the surface
 encoder = nvc.CreateEncoder(
     width,
     height,
@@ -34,41 +44,50 @@ encoder = nvc.CreateEncoder(
     True,
     codec='h264',
     )
+
+# Input frame and encoder surface are allocated once and reused for every frame
+frame = np.empty((height, width, 3), np.uint8)
+pool = SurfacePool(width, height, "NV12", count=1)
+surface = pool.acquire()
+converter = ColorConverter("BGR", "NV12", width, height)  # row stripes converted on a thread pool
+
+# paced replay: frames are decoded up front and released at their timestamps; lost frames mean encoding is too slow
+replay = ReplayCamera(ReplayClip.open(VIDEO_PATH), rate=REPLAY_RATE).start() if REPLAY_RATE is not None else None
+
 # Open a file to save the encoded video
 output_file = 'test_files/output_video.h264'
 with open(output_file, 'wb') as f:
     while True:
-        ret, frame = cap.read()
+        if replay is None:
+            ret, source = cap.read(frame)  # decodes into frame when it fits, else returns a new array
+        else:
+            replayed = replay.get_next()
+            ret = replayed is not None
+            source = replayed.data if ret else None
 
         if not ret:
             break  # End of video or error in reading frame
 
-        # Resize frame to match encoder dimensions
-        frame_resized = cv2.resize(frame, (width, height))
-        
-        # Convert frame to NV12 format
-        nv12_frame = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2YUV_I420)
+        # resize frame to match encoder dimensions (a replay clip or camera may deliver another size)
+        if source.shape != (height, width, 3):
+            source = cv2.resize(source, (width, height), dst=frame)
 
+        # Convert frame straight into the encoder surface
+        converter.convert(source, surface.data)
 
-        # resize frame to match encoder dimensions
-        nv12_frame = np.ravel(nv12_frame)
-        
         # Feed frame to encoder
-        encoded_frames = encoder.Encode(nv12_frame)
+        encoded_frames = encoder.Encode(surface.data)
 
         # Write encoded frames to output file
-        for encoded_frame in encoded_frames:
-            print('frame', encoded_frame)
-            f.write(encoded_frame)  # Save each encoded frame to the file
+        f.write(bytearray(encoded_frames))
 
     # After feeding all frames, flush the encoder to get any remaining output
-    final_frames = encoder.Flush()
-    
-    for encoded_frame in final_frames:
-        f.write(encoded_frame)  # Save the final encoded frames to the file
-
-    encoder.EndEncode()
+    f.write(bytearray(encoder.EndEncode()))
 
 # Release resources
+if replay is not None:
+    replay.stop()
+    print(replay.report())
+converter.close()
+pool.release(surface)
 cap.release()
-
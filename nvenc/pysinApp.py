@@ -1,7 +1,11 @@
-import pip 
+import os
+import sys
+
 import numpy as np
 import PySpin
-import PyNvVideoCodec as pynvcodec
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples"))
+from BatchEncode import BatchEncoder
 
 CHUNK_SIZE = 10  # Number of frames to encode at a time
 
@@ -53,32 +57,16 @@ def print_camera_settings(camera):
 
 
 def encode_frames(raw_frame_chunk, width, height, output_file):
-    encoder = pynvcodec.CreateEncoder(width, height, "NV12", usecpuinutbuffer=True)
-    
-    
-    
-    for i in range(CHUNK_SIZE):
-        chunk = raw_frame_chunk[i:i+10]
-        
-        bitstream = encoder.Encode(chunk)
-        # BUG: The bitstream is empty
-        with open(output_file, 'wb') as out_file:
-            print("Writing to file")
-            out_file.write(bitstream)
-            
-    
-    
-    
-    # # Create a file to write the output
-    # with open(output_file, 'wb') as out_file:
-    #     for frame in raw_frame_chunk:
-    #         # Convert raw frame to the required format if necessary
-    #         encoded_frame = encoder.Encode(frame)
-        
-        
-    #         out_file.write(encoded_frame)
+    # The whole (CHUNK_SIZE, height, width) Mono8 chunk is submitted in one call; packets that are
+    # still queued inside NVENC come out of flush()
+    encoder = BatchEncoder(width, height, "NV12", use_cpu_memory=True, max_batch=CHUNK_SIZE)
+
+    packets = encoder.encode_batch(raw_frame_chunk)
+    packets += encoder.flush()
 
-    # encoder.EndEncode()
+    with open(output_file, 'wb') as out_file:
+        print(f"Writing {len(packets)} packets to file")
+        encoder.write(out_file, packets)
 
 
 def main():
@@ -116,9 +104,12 @@ def main():
         output_file
         )
 
-    camera.EndAcquisition()
-    camera.DeInit()
-    del camera
+    del image_result
+    cam.EndAcquisition()
+    cam.DeInit()
+    del cam
+    cam_list.Clear()
+    system.ReleaseInstance()
 
 if __name__ == "__main__":
     main()
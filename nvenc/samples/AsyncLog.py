@@ -0,0 +1,281 @@
+"""
+Logging for hot paths: records are put on a queue by the calling thread and formatted and
+written by one background thread, so terminal or file I/O never sits in a grab or encode loop.
+
+    get_logger(name)             a logging.Logger whose handler only enqueues (QueueHandler style,
+                                 but without formatting the message on the caller's thread)
+    hot(logger, every_seconds=1.0, sample=None)
+                                 a per call site throttle: at most one record per interval and /
+                                 or every n-th call; a suppressed call is one clock read and a
+                                 compare, and the next record that passes says how many were skipped;
+                                 flush() after the loop writes the last suppressed call, so a
+                                 count that no later record reported is not lost
+    json_format=True             one JSON object per line (time, level, logger, message, file, line,
+                                 thread and any structured fields) instead of text
+
+Structured fields are passed as keyword arguments to the throttled call site, or as
+extra={"fields": {...}} to the plain logger methods. Message arguments are kept as they are and
+only interpolated on the writer thread, so pass values that are not mutated afterwards (ints,
+strings, shapes), not buffers that are reused for the next frame.
+
+All loggers writing to the same stream share one writer thread; flush() waits until everything
+queued so far is written and runs automatically at exit.
+
+Usage:
+    log = get_logger("acquisition")
+    grabbed = hot(log, every_seconds=1.0)                 # create once, outside the loop
+    for i in range(n):
+        ...
+        grabbed.info("Grabbed image %d", i, width=width, height=height)
+    grabbed.flush()                                       # the last suppressed call and its count
+    log.info("done")                                      # unthrottled records work as usual
+
+Run this file to measure the cost of suppressed, sampled and emitted calls.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+TEXT_FORMAT = "[{filename:s}][{funcName:s}:{lineno:d}][{levelname:s}] {message:s}"
+
+_listeners = {}   # id(stream) -> (queue, QueueListener)
+_listeners_lock = threading.Lock()
+
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that hands the record over untouched; formatting happens on the writer thread."""
+
+    def prepare(self, record):
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """Text lines; structured fields and the number of suppressed calls are appended as key=value."""
+
+    def __init__(self, fmt=TEXT_FORMAT):
+        super().__init__(fmt, style="{")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line += f" (+{suppressed} suppressed)"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record):
+        entry = {"time": record.created, "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage(), "file": record.filename, "line": record.lineno,
+                 "thread": record.threadName}
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _WriterHandler(logging.StreamHandler):
+    """Stream handler used by the writer thread; formatters are per record, by its logger."""
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.formatters = {}
+
+    def format(self, record):
+        return self.formatters.get(record.name, self.formatter).format(record)
+
+    def handle(self, record):
+        event = getattr(record, "flush_event", None)
+        if event is not None:  # flush() marker: nothing to write, just release the caller
+            event.set()
+            return True
+        return super().handle(record)
+
+
+def _listener(stream):
+    with _listeners_lock:
+        entry = _listeners.get(id(stream))
+        if entry is None:
+            records = queue.SimpleQueue()
+            writer = _WriterHandler(stream)
+            writer.setFormatter(TextFormatter())
+            listener = logging.handlers.QueueListener(records, writer, respect_handler_level=False)
+            listener.start()
+            entry = _listeners[id(stream)] = (records, listener, writer)
+        return entry
+
+
+def get_logger(logger_name, log_level="info", json_format=False, stream=None, fmt=TEXT_FORMAT):
+    """
+    Logger writing through the background thread of stream (default stdout). Calling it again
+    with the same name returns the same logger without adding another handler.
+    """
+    stream = sys.stdout if stream is None else stream
+    level = getattr(logging, log_level.upper(), logging.INFO)
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(level)
+    logger.propagate = False
+    records, _, writer = _listener(stream)
+    writer.formatters[logger_name] = JsonFormatter() if json_format else TextFormatter(fmt)
+    if not any(isinstance(handler, _EnqueueHandler) for handler in logger.handlers):
+        logger.addHandler(_EnqueueHandler(records))
+    return logger
+
+
+def flush(timeout=5.0):
+    """Wait until every record queued so far has been written."""
+    deadline = time.monotonic() + timeout
+    for records, _, writer in list(_listeners.values()):
+        done = threading.Event()
+        # a record the writer handles after everything queued before it
+        marker = logging.LogRecord("AsyncLog.flush", logging.CRITICAL + 1, "", 0, "", None, None)
+        marker.flush_event = done
+        records.put(marker)
+        done.wait(max(0.0, deadline - time.monotonic()))
+        writer.flush()
+
+
+def _stop():
+    flush()
+    with _listeners_lock:
+        for _, listener, _ in _listeners.values():
+            listener.stop()
+        _listeners.clear()
+
+
+atexit.register(_stop)
+
+
+class hot:
+    """
+    Throttled call site for a logger; create it once and call its level methods in the loop.
+
+    Parameters:
+        - logger (logging.Logger): usually from get_logger()
+        - every_seconds (float): at most one record per interval (None: no time limit)
+        - sample (int): only every n-th call can produce a record (None: every call)
+    """
+
+    __slots__ = ("logger", "interval_ns", "sample", "suppressed", "_next_ns", "_calls", "_last")
+
+    def __init__(self, logger, every_seconds=1.0, sample=None):
+        self.logger = logger
+        self.interval_ns = None if every_seconds is None else int(every_seconds * 1e9)
+        self.sample = sample
+        self.suppressed = 0
+        self._next_ns = 0
+        self._calls = 0
+        self._last = None  # (level, msg, args, fields) of the last suppressed call
+
+    def _emit(self, level, msg, args, fields, frame):
+        if not self.logger.isEnabledFor(level):
+            return
+        # file and line of the caller, taken only for records that are written (logging's own
+        # findCaller walks the stack and costs microseconds)
+        code = frame.f_code
+        record = self.logger.makeRecord(self.logger.name, level, code.co_filename, frame.f_lineno, msg, args,
+                                        None, code.co_name)
+        record.fields = fields
+        record.suppressed = self.suppressed
+        self.suppressed = 0
+        self._last = None
+        self.logger.handle(record)
+
+    def flush(self):
+        """
+        Write the last suppressed call, with the number of calls suppressed before it, if no record
+        has reported them yet. Call it after the loop; the record carries the line of this call.
+        """
+        if self._last is None:
+            return
+        level, msg, args, fields = self._last
+        self._last = None  # flushed once, even when the level is disabled
+        if not self.logger.isEnabledFor(level):
+            return
+        self.suppressed -= 1  # the last call itself is now written
+        self._emit(level, msg, args, fields, sys._getframe(1))
+
+
+def _throttled(level):
+    def method(self, msg, *args, **fields):
+        # the suppressed path: a counter and / or one clock read, nothing else
+        if self.sample is not None:
+            self._calls += 1
+            if self._calls % self.sample:
+                self.suppressed += 1
+                self._last = (level, msg, args, fields)
+                return
+        if self.interval_ns is not None:
+            now = _monotonic_ns()
+            if now < self._next_ns:
+                self.suppressed += 1
+                self._last = (level, msg, args, fields)
+                return
+            self._next_ns = now + self.interval_ns
+        self._emit(level, msg, args, fields, sys._getframe(1))
+    method.__name__ = logging.getLevelName(level).lower()
+    return method
+
+
+_monotonic_ns = time.monotonic_ns
+hot.debug = _throttled(logging.DEBUG)
+hot.info = _throttled(logging.INFO)
+hot.warning = _throttled(logging.WARNING)
+hot.error = _throttled(logging.ERROR)
+
+
+class _Discard:
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+_DISCARD = _Discard()
+
+
+def benchmark(calls=200_000):
+    """Nanoseconds per call: suppressed by the interval, suppressed by sampling, and emitted."""
+    log = get_logger("AsyncLog.benchmark", stream=_DISCARD)
+    results = {}
+    for label, site, count in (("suppressed (1 per second)", hot(log, every_seconds=1.0), calls),
+                               ("sampled (1 in 1000)", hot(log, every_seconds=None, sample=1000), calls),
+                               ("emitted (every call)", hot(log, every_seconds=None), calls // 10)):
+        start = time.perf_counter_ns()
+        for i in range(count):
+            site.info("frame %d", i)
+        results[label] = (time.perf_counter_ns() - start) / count
+    start = time.perf_counter_ns()
+    for i in range(calls // 10):
+        log.info("frame %d", i)
+    results["plain logger.info"] = (time.perf_counter_ns() - start) / (calls // 10)
+    flush()
+    return results
+
+
+if __name__ == "__main__":
+    for label, ns in benchmark().items():
+        print(f"{label:<28} {ns:8.0f} ns per call")
+    demo = get_logger("AsyncLog.demo", json_format=True)
+    site = hot(demo, every_seconds=0.01)
+    for i in range(50000):
+        site.info("frame %d grabbed", i, frame=i)
+    site.flush()
+    flush()
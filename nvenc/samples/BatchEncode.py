@@ -0,0 +1,144 @@
+"""
+Batched frame submission on top of PyNvVideoCodec.
+
+NVENC only takes one frame per Encode() call and returns whatever bitstream is ready at that
+point: nothing while the encoder is still filling its internal queue (lookahead, B-frames), and
+possibly several frames at once later and from EndEncode(). BatchEncoder accepts a whole batch,
+pushes the frames back to back into the encoder queue, splits whatever comes out into access
+units (NetworkStream.split_access_units) and hands back one packet per frame in stream order,
+tagged with that frame's id. The Encode() call and the copy of its output are still one per
+frame; argument checking, surface preparation and the write to disk happen once per batch.
+
+Ids are given to packets in the order they come out of the encoder, which is the order the
+frames were submitted in unless B-frames reorder them (then the ids follow decode order).
+
+Accepted batches:
+    - (N, frame_size) uint8 array, every row a complete frame in the encoder's surface format
+    - (N, height, width) uint8 array of Mono8 images, copied into the luma plane of a
+      preallocated surface (chroma is neutral grey) when the encoder format is NV12/YUV420/YUV444
+    - a list of SurfacePool surfaces (host or device)
+
+Usage:
+    encoder = BatchEncoder(width, height, "NV12", codec="h264")
+    packets = encoder.encode_batch(frames)              # frame ids 0..N-1
+    packets += encoder.flush()
+    encoder.write(out_file, packets)
+"""
+
+from collections import deque, namedtuple
+
+import numpy as np
+
+from NetworkStream import split_access_units
+from PixelFormats import GetFrameLayout
+from SurfacePool import HostSurface, SurfacePool
+
+# frame_ids: (id,) of the frame whose access unit is data; (None,) if the encoder returned more
+# frames than were submitted
+EncodedPacket = namedtuple("EncodedPacket", ["frame_ids", "data"])
+
+_MONO_FORMATS = ("NV12", "YUV420", "YUV444")
+
+
+class BatchEncoder:
+    """
+    Parameters:
+        - width, height (int): frame geometry in pixels
+        - fmt (str): surface format of the encoder input, e.g. NV12
+        - use_cpu_memory (bool): encoder takes host buffers (True) or CUDA surfaces (False)
+        - max_batch (int): number of staging surfaces kept for Mono8 batches
+        - encoder: an already created encoder to use instead (pass its codec as well)
+        - config_params: passed through to nvc.CreateEncoder (codec, preset, bitrate, ...); codec
+          (default h264) also decides how the output is split into access units
+    """
+
+    def __init__(self, width, height, fmt="NV12", use_cpu_memory=True, max_batch=16, encoder=None,
+                 **config_params):
+        self.layout = GetFrameLayout(width, height, fmt)
+        self.use_cpu_memory = use_cpu_memory
+        if encoder is None:
+            import PyNvVideoCodec as nvc
+            encoder = nvc.CreateEncoder(width, height, self.layout.format, use_cpu_memory, **config_params)
+        self.encoder = encoder
+        self.codec = str(config_params.get("codec", "h264")).lower()
+        self.max_batch = max_batch
+        self._staging = None
+        self._pending = deque()  # ids submitted to NVENC whose bitstream has not come out yet
+        self.next_frame_id = 0
+
+    def _mono_staging(self):
+        if self._staging is None:
+            if self.layout.format not in _MONO_FORMATS:
+                raise ValueError(f"Mono8 batches need an 8 bit YUV encoder format, not {self.layout.format}")
+            self._staging = SurfacePool(self.layout.width, self.layout.height, self.layout.format,
+                                        count=self.max_batch)
+            # chroma stays neutral grey for ever, only the luma plane is rewritten per batch
+            self._staging.buffer[:] = 128
+        return self._staging
+
+    def _inputs(self, frames):
+        """Yield one encoder input per frame without copying wherever the layout allows it."""
+        if isinstance(frames, np.ndarray):
+            if not self.use_cpu_memory:
+                raise ValueError("Array batches need an encoder created with use_cpu_memory=True")
+            if frames.dtype != np.uint8:
+                raise ValueError(f"Expected uint8 frames, got {frames.dtype}")
+            if frames.ndim == 2 and frames.shape[1] == self.layout.frame_size:
+                frames = np.ascontiguousarray(frames)
+                for row in frames:
+                    yield row
+                return
+            if frames.ndim == 3 and frames.shape[1:] == (self.layout.height, self.layout.width):
+                staging = self._mono_staging()
+                for start in range(0, len(frames), len(staging)):
+                    chunk = frames[start:start + len(staging)]
+                    for image, surface in zip(chunk, staging):
+                        surface.planes[0][:] = image
+                    for surface in staging.surfaces[:len(chunk)]:
+                        yield surface.data
+                return
+            raise ValueError(f"Batch of shape {frames.shape} does not match {self.layout!r}")
+
+        for surface in frames:
+            if surface.layout is not self.layout:
+                raise ValueError(f"Surface {surface!r} does not match {self.layout!r}")
+            yield surface.data if isinstance(surface, HostSurface) else surface
+
+    def _collect(self, bitstream, packets):
+        if not len(bitstream):
+            return
+        pending = self._pending
+        for unit in split_access_units(bitstream, self.codec):
+            packets.append(EncodedPacket((pending.popleft() if pending else None,), unit))
+
+    def encode_batch(self, frames, frame_ids=None):
+        """
+        Submit a batch of frames and return the packets that came out of the encoder meanwhile.
+
+        Packets can lag the frames that were submitted (NVENC keeps a few frames queued); the
+        rest is returned by later calls or by flush(). frame_ids defaults to a running counter.
+        """
+        if frame_ids is None:
+            frame_ids = range(self.next_frame_id, self.next_frame_id + len(frames))
+            self.next_frame_id += len(frames)
+        elif len(frame_ids) != len(frames):
+            raise ValueError(f"Got {len(frame_ids)} frame ids for {len(frames)} frames")
+
+        packets = []
+        encode, pending, collect = self.encoder.Encode, self._pending, self._collect
+        for frame_id, frame in zip(frame_ids, self._inputs(frames)):
+            pending.append(frame_id)
+            collect(encode(frame), packets)
+        return packets
+
+    def flush(self):
+        """Drain the encoder queue; returns one packet per remaining frame."""
+        packets = []
+        self._collect(self.encoder.EndEncode(), packets)
+        self._pending.clear()
+        return packets
+
+    @staticmethod
+    def write(out_file, packets):
+        """Write packets to a file object with a single write call."""
+        out_file.write(b"".join(packet.data for packet in packets))
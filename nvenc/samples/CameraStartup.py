@@ -0,0 +1,237 @@
+"""
+Fast startup path: initialise every camera concurrently, apply node settings from a cached
+profile and open encoders / writers while the cameras are still being configured.
+
+Applying 20+ nodes one by one costs a USB round trip each. With save_user_set=True the first time
+a profile is applied to a camera it is written node by node and then saved on the camera in
+UserSet1; the profile digest is remembered in a small JSON cache keyed by serial number. Every
+later start is a single UserSetLoad of UserSet1, which the camera applies internally. This
+overwrites UserSet1 and trusts it afterwards, so only turn it on for cameras whose UserSet1 no
+other software (SpinView, other rigs) writes; forget_profile(serial) makes the next start write
+the nodes again. By default profiles are written node by node on every start and the camera's
+user sets are left alone.
+
+A profile is an ordered list of (node name, value) pairs; order matters (e.g. AdcBitDepth before
+PixelFormat, Width/Height before OffsetX/OffsetY). Enumeration values are entry names, commands
+are executed when the value is None. Transport layer stream settings are not part of user sets and
+are applied separately on every start:
+
+    profile = CameraProfile(
+        [("AcquisitionMode", "Continuous"), ("ExposureAuto", "Off"), ("ExposureTime", 500.0)],
+        stream=[("StreamBufferHandlingMode", "OldestFirst")])
+
+    timer = StartupTimer()
+    started = start_cameras(list(cam_list), profile, encoder_factory=lambda cam_id: open_writer(cam_id),
+                            timer=timer, save_user_set=True)
+    ...
+    timer.mark("first recorded frame")
+    print(timer.report())
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+import time
+
+PROFILE_USER_SET = "UserSet1"
+PROFILE_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".aquire-video", "camera_profiles.json")
+
+_cache_lock = threading.Lock()
+
+
+class CameraProfile:
+    def __init__(self, settings, stream=()):
+        self.settings = [tuple(setting) for setting in settings]
+        self.stream = [tuple(setting) for setting in stream]
+        self.digest = hashlib.sha1(json.dumps(self.settings).encode()).hexdigest()
+
+    def __repr__(self):
+        return f"CameraProfile({len(self.settings)} nodes, {self.digest[:8]})"
+
+
+class StartupTimer:
+    """Timestamps of startup milestones relative to construction, safe to mark from any thread."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.marks = []
+        self._lock = threading.Lock()
+
+    def mark(self, label):
+        elapsed = time.perf_counter() - self.t0
+        with self._lock:
+            self.marks.append((elapsed, label))
+        return elapsed
+
+    def elapsed(self, label):
+        for elapsed, mark_label in self.marks:
+            if mark_label == label:
+                return elapsed
+        return None
+
+    def report(self):
+        return "\n".join(f"{elapsed * 1000:8.1f} ms  {label}" for elapsed, label in sorted(self.marks))
+
+
+def set_node(nodemap, name, value):
+    """Write one GenICam node by name, whatever its type. Commands are executed when value is None."""
+    import PySpin
+    node = nodemap.GetNode(name)
+    if node is None or not PySpin.IsAvailable(node) or not PySpin.IsWritable(node):
+        raise PySpin.SpinnakerException(f"Node {name} is not available or not writable")
+    interface = node.GetPrincipalInterfaceType()
+    if interface == PySpin.intfIEnumeration:
+        node = PySpin.CEnumerationPtr(node)
+        entry = node.GetEntryByName(value)
+        if entry is None or not PySpin.IsReadable(entry):
+            raise PySpin.SpinnakerException(f"{name} has no entry {value}")
+        node.SetIntValue(entry.GetValue())
+    elif interface == PySpin.intfIInteger:
+        PySpin.CIntegerPtr(node).SetValue(int(value))
+    elif interface == PySpin.intfIFloat:
+        PySpin.CFloatPtr(node).SetValue(float(value))
+    elif interface == PySpin.intfIBoolean:
+        PySpin.CBooleanPtr(node).SetValue(bool(value))
+    elif interface == PySpin.intfICommand:
+        PySpin.CCommandPtr(node).Execute()
+    elif interface == PySpin.intfIString:
+        PySpin.CStringPtr(node).SetValue(str(value))
+    else:
+        raise PySpin.SpinnakerException(f"Node {name} has an unsupported type")
+
+
+def get_serial_number(cam):
+    import PySpin
+    node = PySpin.CStringPtr(cam.GetTLDeviceNodeMap().GetNode("DeviceSerialNumber"))
+    if PySpin.IsAvailable(node) and PySpin.IsReadable(node):
+        return node.GetValue()
+    return ""
+
+
+def _load_cache(path):
+    try:
+        with open(path) as jsonFile:
+            return json.load(jsonFile)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path, cache):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as jsonFile:
+        json.dump(cache, jsonFile, indent=2)
+
+
+def forget_profile(serial, cache_path=PROFILE_CACHE_PATH):
+    """Drop the cached profile of a camera, e.g. after its UserSet1 was changed by other software."""
+    with _cache_lock:
+        cache = _load_cache(cache_path)
+        if cache.pop(serial, None) is not None:
+            _save_cache(cache_path, cache)
+
+
+def apply_profile(cam, profile, serial="", cache_path=PROFILE_CACHE_PATH, save_user_set=False):
+    """
+    Configure an initialised camera. Returns "cached" when the profile was restored with a single
+    UserSetLoad and "applied" when it had to be written node by node (and, with save_user_set,
+    was then saved to UserSet1).
+    """
+    nodemap = cam.GetNodeMap()
+    cached = False
+    if save_user_set and serial:
+        with _cache_lock:
+            cached = _load_cache(cache_path).get(serial) == profile.digest
+
+    if cached:
+        set_node(nodemap, "UserSetSelector", PROFILE_USER_SET)
+        set_node(nodemap, "UserSetLoad", None)
+        how = "cached"
+    else:
+        # start from the factory default so nodes missing from the profile are predictable
+        set_node(nodemap, "UserSetSelector", "Default")
+        set_node(nodemap, "UserSetLoad", None)
+        for name, value in profile.settings:
+            set_node(nodemap, name, value)
+        if save_user_set:
+            set_node(nodemap, "UserSetSelector", PROFILE_USER_SET)
+            set_node(nodemap, "UserSetSave", None)
+            if serial:
+                with _cache_lock:
+                    cache = _load_cache(cache_path)
+                    cache[serial] = profile.digest
+                    _save_cache(cache_path, cache)
+        how = "applied"
+
+    stream_nodemap = cam.GetTLStreamNodeMap()
+    for name, value in profile.stream:
+        set_node(stream_nodemap, name, value)
+    return how
+
+
+def read_device_info(cam):
+    """DeviceInformation category of the transport layer nodemap as a dict of strings."""
+    import PySpin
+    info = {}
+    node_device_information = PySpin.CCategoryPtr(cam.GetTLDeviceNodeMap().GetNode("DeviceInformation"))
+    if PySpin.IsAvailable(node_device_information) and PySpin.IsReadable(node_device_information):
+        for feature in node_device_information.GetFeatures():
+            node_feature = PySpin.CValuePtr(feature)
+            info[node_feature.GetName()] = (node_feature.ToString() if PySpin.IsReadable(node_feature)
+                                            else "Node not readable")
+    return info
+
+
+class StartedCamera:
+    def __init__(self, index, cam, serial, info, profile_status, encoder):
+        self.index = index
+        self.cam = cam
+        self.serial = serial
+        self.info = info
+        self.profile_status = profile_status
+        self.encoder = encoder
+
+
+def start_cameras(cams, profile, encoder_factory=None, timer=None, begin_acquisition=True,
+                  cache_path=PROFILE_CACHE_PATH, save_user_set=False):
+    """
+    Initialise, configure and (optionally) start every camera in parallel, opening one encoder per
+    camera through encoder_factory(cam_index) at the same time. save_user_set is passed on to
+    apply_profile.
+
+    Returns a list of StartedCamera in camera order. Any failure is re-raised after all other
+    startup work has finished, so no camera is left half initialised without the caller knowing.
+    """
+    timer = timer or StartupTimer()
+    cams = list(cams)
+
+    def start_one(index, cam):
+        serial = get_serial_number(cam)
+        info = read_device_info(cam)
+        cam.Init()
+        status = apply_profile(cam, profile, serial, cache_path, save_user_set)
+        timer.mark(f"camera {index} ({serial}) configured [{status}]")
+        if begin_acquisition:
+            cam.BeginAcquisition()
+            timer.mark(f"camera {index} acquiring")
+        return serial, info, status
+
+    def open_encoder(index):
+        encoder = encoder_factory(index)
+        timer.mark(f"encoder {index} open")
+        return encoder
+
+    workers = max(1, len(cams) * (2 if encoder_factory else 1))
+    with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="startup") as pool:
+        camera_futures = [pool.submit(start_one, i, cam) for i, cam in enumerate(cams)]
+        encoder_futures = [pool.submit(open_encoder, i) if encoder_factory else None for i in range(len(cams))]
+        concurrent.futures.wait(camera_futures + [f for f in encoder_futures if f is not None])
+
+    started = []
+    for index, (cam, camera_future, encoder_future) in enumerate(zip(cams, camera_futures, encoder_futures)):
+        serial, info, status = camera_future.result()
+        encoder = encoder_future.result() if encoder_future is not None else None
+        started.append(StartedCamera(index, cam, serial, info, status, encoder))
+    timer.mark("all cameras and encoders ready")
+    return started
@@ -0,0 +1,289 @@
+"""
+Lossless chunked frame store (Zarr v2 layout) with parallel compression.
+
+Frames are collected into time blocks of `chunk_frames`; every full block is split into
+time x height x width chunks that are delta filtered and compressed on a thread pool (zstd, lz4
+and zlib all release the GIL while compressing) and written as one file per chunk. Acquisition
+only copies the frame into a preallocated block buffer; it only waits when all `threads + 1`
+block buffers are still being compressed.
+
+The directory is a valid Zarr v2 array (`.zarray` + `t.y.x` chunk files, numcodecs Delta filter
+and Zstd/LZ4/Zlib compressor), so it opens with `zarr.open(path)` as well as with the
+dependency-free ChunkedArrayReader below, which only decompresses the chunks a slice touches:
+
+    writer = ChunkedArrayWriter("trial.zarr", (height, width), np.uint8, chunk_frames=32)
+    writer.writeFrame(frame)           # same call as skvideo's FFmpegWriter
+    writer.close()
+    print(writer.report())             # compression ratio and MB/s
+
+    reader = ChunkedArrayReader("trial.zarr")
+    clip = reader[1000:1100]           # decompresses 4 time chunks, not the whole recording
+
+Codecs: "zstd" needs the zstandard package, "lz4" the lz4 package, "zlib" is always available.
+"""
+
+import concurrent.futures
+import json
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+
+
+def _get_codec(name, level):
+    """(numcodecs compressor config, compress function, decompress function) for a codec name."""
+    if name == "zstd":
+        import zstandard
+        # one (de)compressor object per thread: zstandard objects are not thread safe
+        local = threading.local()
+
+        def compress(data):
+            if not hasattr(local, "c"):
+                local.c = zstandard.ZstdCompressor(level=level)
+            return local.c.compress(data)
+
+        def decompress(data):
+            if not hasattr(local, "d"):
+                local.d = zstandard.ZstdDecompressor()
+            return local.d.decompress(data)
+        return {"id": "zstd", "level": level}, compress, decompress
+    if name == "lz4":
+        import lz4.block
+        # numcodecs LZ4 stores the uncompressed size in front, which is lz4's store_size format
+        return ({"id": "lz4", "acceleration": 1},
+                lambda data: lz4.block.compress(data, store_size=True),
+                lz4.block.decompress)
+    if name == "zlib":
+        return {"id": "zlib", "level": level}, lambda data: zlib.compress(data, level), zlib.decompress
+    raise ValueError(f"Unknown codec {name}, expected zstd, lz4 or zlib")
+
+
+def _delta_encode(chunk, out):
+    """numcodecs Delta filter: first element, then differences along the flattened chunk."""
+    flat = chunk.reshape(-1)
+    out[0] = flat[0]
+    np.subtract(flat[1:], flat[:-1], out=out[1:])
+    return out
+
+
+def _delta_decode(flat):
+    return np.cumsum(flat, dtype=flat.dtype)
+
+
+class ChunkedArrayWriter:
+    """
+    Parameters:
+        - path (str): output directory, created if missing
+        - frame_shape (tuple): (height, width) or (height, width, channels)
+        - dtype: numpy dtype of the frames
+        - chunk_frames (int): frames per chunk along time
+        - chunk_rows, chunk_cols (int): spatial chunk size, default the full frame
+        - codec (str): "zstd", "lz4" or "zlib"
+        - level (int): compression level (zstd / zlib)
+        - threads (int): compression threads
+    """
+
+    def __init__(self, path, frame_shape, dtype=np.uint8, chunk_frames=32, chunk_rows=None, chunk_cols=None,
+                 codec="zstd", level=1, threads=4):
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        rows, cols = self.frame_shape[:2]
+        self.chunks = (chunk_frames, chunk_rows or rows, chunk_cols or cols) + self.frame_shape[2:]
+        self.compressor_config, self._compress, _ = _get_codec(codec, level)
+        os.makedirs(path, exist_ok=True)
+
+        self._pool = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix="chunk-compress")
+        self._free = [np.empty((chunk_frames,) + self.frame_shape, self.dtype) for _ in range(threads + 1)]
+        self._free_cond = threading.Condition()
+        self._pending = []
+        self._block = None
+        self._block_index = 0
+        self._fill = 0
+        self.frames = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self._t0 = None
+        self.elapsed = 0.0
+        self._closed = False
+        self._write_metadata()
+
+    def _write_metadata(self):
+        meta = {"zarr_format": 2,
+                "shape": [self.frames] + list(self.frame_shape),
+                "chunks": list(self.chunks),
+                "dtype": self.dtype.str,
+                "compressor": self.compressor_config,
+                "fill_value": 0,
+                "order": "C",
+                "filters": [{"id": "delta", "dtype": self.dtype.str}]}
+        tmp = os.path.join(self.path, ".zarray.tmp")
+        with open(tmp, "w") as jsonFile:
+            json.dump(meta, jsonFile, indent=2)
+        os.replace(tmp, os.path.join(self.path, ".zarray"))
+
+    def _take_block(self):
+        with self._free_cond:
+            while not self._free:
+                self._free_cond.wait()  # all buffers are being compressed: back-pressure
+            return self._free.pop()
+
+    def write(self, frame):
+        if self._closed:
+            raise ValueError("Writer is closed")
+        if self._t0 is None:
+            self._t0 = time.perf_counter()
+        if self._block is None:
+            self._block = self._take_block()
+        elif self._fill == len(self._block):
+            self._submit()  # the last submit raised and kept the full block: raise again
+            self._block = self._take_block()
+        self._block[self._fill] = frame
+        self._fill += 1
+        self.frames += 1
+        if self._fill == self.chunks[0]:
+            self._submit()
+
+    writeFrame = write  # drop-in for skvideo.io.FFmpegWriter
+
+    def _submit(self):
+        for future in self._pending:
+            if future.done():
+                future.result()  # re-raise compression / I/O errors on the next write, while the block is still ours
+        self._pending = [f for f in self._pending if not f.done()]
+        block, index, fill = self._block, self._block_index, self._fill
+        if fill < len(block):
+            block[fill:] = 0  # the last chunk is padded with the fill value, like zarr does
+        self._block, self._fill = None, 0
+        self._block_index += 1
+        self._pending.append(self._pool.submit(self._compress_block, block, index, fill))
+
+    def _compress_block(self, block, t_index, fill):
+        try:
+            _, chunk_rows, chunk_cols = self.chunks[:3]
+            rows, cols = self.frame_shape[:2]
+            scratch = None
+            written = 0
+            for y_index, y in enumerate(range(0, rows, chunk_rows)):
+                for x_index, x in enumerate(range(0, cols, chunk_cols)):
+                    chunk = block[:, y:y + chunk_rows, x:x + chunk_cols]
+                    if chunk.shape[1:3] != (chunk_rows, chunk_cols):
+                        # edge chunks are stored full size as well
+                        padded = np.zeros(self.chunks, self.dtype)
+                        padded[:, :chunk.shape[1], :chunk.shape[2]] = chunk
+                        chunk = padded
+                    if scratch is None or scratch.size != chunk.size:
+                        scratch = np.empty(chunk.size, self.dtype)
+                    data = self._compress(_delta_encode(np.ascontiguousarray(chunk), scratch))
+                    key = ".".join(str(i) for i in (t_index, y_index, x_index) + (0,) * (len(self.chunks) - 3))
+                    with open(os.path.join(self.path, key), "wb") as chunk_file:
+                        chunk_file.write(data)
+                    written += len(data)
+            with self._free_cond:
+                self.raw_bytes += block[:fill].nbytes  # not the padding of the last block
+                self.compressed_bytes += written
+        finally:
+            with self._free_cond:
+                self._free.append(block)
+                self._free_cond.notify()
+
+    def close(self):
+        """Compress the last (partial) block, wait for all chunks and write the final shape."""
+        if self._closed:
+            return
+        try:
+            if self._block is not None and self._fill:
+                self._submit()
+            for future in self._pending:
+                future.result()  # re-raise compression / I/O errors
+        finally:
+            self._pool.shutdown(wait=True)
+            self._closed = True
+        self.elapsed = time.perf_counter() - self._t0 if self._t0 is not None else 0.0
+        self._write_metadata()
+
+    def compression_ratio(self):
+        return self.raw_bytes / self.compressed_bytes if self.compressed_bytes else float("nan")
+
+    def report(self):
+        mb_per_s = self.raw_bytes / 1e6 / self.elapsed if self.elapsed else float("nan")
+        return (f"{self.frames} frames, {self.raw_bytes / 1e6:.1f} MB raw -> {self.compressed_bytes / 1e6:.1f} MB "
+                f"(ratio {self.compression_ratio():.2f}), {mb_per_s:.1f} MB/s")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChunkedArrayReader:
+    """Read slices of a store written by ChunkedArrayWriter without decompressing whole files."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, ".zarray")) as jsonFile:
+            meta = json.load(jsonFile)
+        self.shape = tuple(meta["shape"])
+        self.chunks = tuple(meta["chunks"])
+        self.dtype = np.dtype(meta["dtype"])
+        self.fill_value = meta.get("fill_value") or 0
+        self._delta = any(f["id"] == "delta" for f in meta.get("filters") or [])
+        compressor = meta["compressor"]
+        level = compressor.get("level", 1)
+        _, _, self._decompress = _get_codec(compressor["id"], level)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _chunk(self, index):
+        try:
+            with open(os.path.join(self.path, ".".join(str(i) for i in index)), "rb") as chunk_file:
+                data = chunk_file.read()
+        except FileNotFoundError:
+            return np.full(self.chunks, self.fill_value, self.dtype)
+        flat = np.frombuffer(self._decompress(data), self.dtype)
+        if self._delta:
+            flat = _delta_decode(flat)
+        return flat.reshape(self.chunks)
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        key = key + (slice(None),) * (len(self.shape) - len(key))
+        ranges, squeeze, post = [], [], []
+        for dim, (k, size) in enumerate(zip(key, self.shape)):
+            if isinstance(k, (int, np.integer)):
+                k = int(k) + size if k < 0 else int(k)
+                if not 0 <= k < size:
+                    raise IndexError(f"Index {k} out of range for axis {dim} of size {size}")
+                ranges.append((k, k + 1))
+                squeeze.append(dim)
+                post.append(slice(None))
+            else:
+                # read the covered range [lo, hi) and apply the step afterwards
+                indices = range(*k.indices(size))
+                if not indices:
+                    ranges.append((0, 0))
+                    post.append(slice(None))
+                    continue
+                lo, hi = min(indices[0], indices[-1]), max(indices[0], indices[-1]) + 1
+                stop = indices[-1] - lo + (1 if indices.step > 0 else -1)
+                ranges.append((lo, hi))
+                post.append(slice(indices[0] - lo, stop if stop >= 0 else None, indices.step))
+
+        out = np.empty(tuple(hi - lo for lo, hi in ranges), self.dtype)
+        chunk_ranges = [range(lo // c, (hi - 1) // c + 1) if hi > lo else range(0)
+                        for (lo, hi), c in zip(ranges, self.chunks)]
+        for index in np.ndindex(*[len(r) for r in chunk_ranges]):
+            chunk_index = tuple(r[i] for r, i in zip(chunk_ranges, index))
+            chunk = self._chunk(chunk_index)
+            src, dst = [], []
+            for ci, (lo, hi), c in zip(chunk_index, ranges, self.chunks):
+                c_lo, c_hi = max(lo, ci * c), min(hi, (ci + 1) * c)
+                src.append(slice(c_lo - ci * c, c_hi - ci * c))
+                dst.append(slice(c_lo - lo, c_hi - lo))
+            out[tuple(dst)] = chunk[tuple(src)]
+        out = out[tuple(post)]
+        return out.reshape([n for dim, n in enumerate(out.shape) if dim not in squeeze]) if squeeze else out
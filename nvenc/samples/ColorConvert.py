@@ -0,0 +1,255 @@
+"""
+Multithreaded colour conversion from camera images into encoder surfaces.
+
+    sources       BGR, RGB, MONO, BAYER_RG, BAYER_BG, BAYER_GB, BAYER_GR (8 bit)
+    destinations  NV12, YUV420 (I420), YUV444, ARGB, ABGR (the layouts of PixelFormats.py)
+
+The frame is cut into row stripes (even heights, so 4:2:0 chroma and Bayer phases line up) that
+are converted concurrently on a thread pool; every step is an OpenCV call that releases the GIL
+and writes through dst= into either the caller's surface or a per-stripe scratch buffer allocated
+once, so converting a frame allocates nothing. Bayer stripes are demosaiced with a two row halo
+and cropped, which gives exactly the full-frame result.
+
+All YUV outputs use BT.601 limited range (Y 16-235), the same coefficients as cv2's
+COLOR_BGR2YUV_I420 and what NVENC assumes by default, so NV12, I420 and YUV444 of one frame agree.
+ARGB / ABGR follow NVENC's word order: ARGB is stored as bytes B, G, R, A (cv2's BGRA).
+
+Usage:
+    converter = ColorConverter("BGR", "NV12", width, height, threads=4)
+    converter.convert(frame, surface.data)      # writes straight into the encoder surface
+    converter.close()
+
+Run this file to validate every conversion against full-frame OpenCV / numpy references and to
+measure 4K throughput.
+"""
+
+import concurrent.futures
+import os
+import time
+
+import cv2
+import numpy as np
+
+from PixelFormats import GetFrameLayout
+
+SOURCES = ("BGR", "RGB", "MONO", "BAYER_RG", "BAYER_BG", "BAYER_GB", "BAYER_GR")
+DESTINATIONS = ("NV12", "YUV420", "YUV444", "ARGB", "ABGR")
+
+# the Bayer names follow the PySpin pixel format names (BayerRG8: R G / G B starting at the top
+# left pixel); OpenCV names its patterns after the second row and column, hence the swaps
+_BAYER_CODES = {"BAYER_RG": cv2.COLOR_BAYER_BG2BGR, "BAYER_BG": cv2.COLOR_BAYER_RG2BGR,
+                "BAYER_GB": cv2.COLOR_BAYER_GR2BGR, "BAYER_GR": cv2.COLOR_BAYER_GB2BGR}
+_BAYER_HALO = 2
+
+# BT.601 limited range: rows Y, U, V; columns B, G, R, offset (BGR order, as cv2.transform sees it)
+_BGR2YUV = np.array([[0.114 * 219 / 255, 0.587 * 219 / 255, 0.299 * 219 / 255, 16.0],
+                     [0.5 * 224 / 255, -0.331264 * 224 / 255, -0.168736 * 224 / 255, 128.0],
+                     [-0.081312 * 224 / 255, -0.418688 * 224 / 255, 0.5 * 224 / 255, 128.0]], np.float32)
+# grey level -> Y with cv2's own fixed point rounding: GRAY -> BGR -> I420 of a 0..255 ramp
+_GREY2Y = cv2.cvtColor(np.repeat(np.tile(np.arange(256, dtype=np.uint8), 2), 3).reshape(2, 256, 3),
+                       cv2.COLOR_BGR2YUV_I420)[0].copy()
+
+
+def _stripes(height, count):
+    """Even row boundaries splitting height into count stripes."""
+    count = max(1, min(count, height // 2))
+    bounds = [(height * i // count) & ~1 for i in range(count + 1)]
+    bounds[-1] = height
+    return [(bounds[i], bounds[i + 1]) for i in range(count) if bounds[i + 1] > bounds[i]]
+
+
+class ColorConverter:
+    """
+    Parameters:
+        - source (str): input format, see SOURCES
+        - destination (str): surface format, see DESTINATIONS
+        - width, height (int): frame size
+        - threads (int): worker threads (stripes); default the number of CPUs, at most 8
+    """
+
+    def __init__(self, source, destination, width, height, threads=None):
+        source, destination = source.upper(), destination.upper()
+        if source not in SOURCES:
+            raise ValueError(f"Unsupported source format {source}, expected one of {SOURCES}")
+        if destination not in DESTINATIONS:
+            raise ValueError(f"Unsupported destination format {destination}, expected one of {DESTINATIONS}")
+        self.source = source
+        self.destination = destination
+        self.width = width
+        self.height = height
+        self.layout = GetFrameLayout(width, height, destination)
+        self.threads = threads or min(8, os.cpu_count() or 1)
+        self.stripes = _stripes(height, self.threads)
+        self._pool = concurrent.futures.ThreadPoolExecutor(self.threads, thread_name_prefix="colour") \
+            if len(self.stripes) > 1 else None
+        self.output = None   # allocated on the first convert() without an output buffer
+
+        # scratch buffers per stripe, allocated once
+        self._scratch = []
+        for r0, r1 in self.stripes:
+            rows = r1 - r0
+            scratch = {}
+            if source.startswith("BAYER"):
+                halo_rows = min(height, r1 + _BAYER_HALO) - max(0, r0 - _BAYER_HALO)
+                scratch["bgr"] = np.empty((halo_rows, width, 3), np.uint8)
+            if destination in ("NV12", "YUV420") and source != "MONO":
+                scratch["i420"] = np.empty((rows * 3 // 2, width), np.uint8)
+            if destination == "YUV444" and source != "MONO":
+                scratch["yuv"] = np.empty((rows, width, 3), np.uint8)
+            self._scratch.append(scratch)
+
+    def _to_bgr(self, frame, r0, r1, scratch):
+        """BGR (or RGB) rows r0:r1 of the frame, demosaicing Bayer input through the stripe scratch."""
+        if not self.source.startswith("BAYER"):
+            return frame[r0:r1]
+        h0, h1 = max(0, r0 - _BAYER_HALO), min(self.height, r1 + _BAYER_HALO)
+        bgr = scratch["bgr"]
+        cv2.cvtColor(frame[h0:h1], _BAYER_CODES[self.source], dst=bgr)
+        return bgr[r0 - h0:r0 - h0 + r1 - r0]
+
+    def _convert_stripe(self, frame, planes, index):
+        r0, r1 = self.stripes[index]
+        scratch = self._scratch[index]
+        destination = self.destination
+        rgb = self.source == "RGB"
+
+        if self.source == "MONO":
+            grey = frame[r0:r1]
+            if destination in ("ARGB", "ABGR"):
+                cv2.cvtColor(grey, cv2.COLOR_GRAY2BGRA, dst=planes[0][r0:r1])
+                return
+            cv2.LUT(grey, _GREY2Y, dst=planes[0][r0:r1])
+            c0, c1 = (r0, r1) if destination == "YUV444" else (r0 // 2, r1 // 2)
+            for chroma in planes[1:]:
+                chroma[c0:c1] = 128
+            return
+
+        bgr = self._to_bgr(frame, r0, r1, scratch)
+        if destination in ("ARGB", "ABGR"):
+            code = {("ARGB", False): cv2.COLOR_BGR2BGRA, ("ARGB", True): cv2.COLOR_RGB2BGRA,
+                    ("ABGR", False): cv2.COLOR_BGR2RGBA, ("ABGR", True): cv2.COLOR_RGB2RGBA}[destination, rgb]
+            cv2.cvtColor(bgr, code, dst=planes[0][r0:r1])
+        elif destination == "YUV444":
+            matrix = _BGR2YUV if not rgb else _BGR2YUV[:, [2, 1, 0, 3]]
+            yuv = scratch["yuv"]
+            cv2.transform(bgr, matrix, dst=yuv)
+            for channel, plane in enumerate(planes):
+                cv2.extractChannel(yuv, channel, dst=plane[r0:r1])
+        else:
+            rows = r1 - r0
+            i420 = scratch["i420"]
+            cv2.cvtColor(bgr, cv2.COLOR_RGB2YUV_I420 if rgb else cv2.COLOR_BGR2YUV_I420, dst=i420)
+            planes[0][r0:r1] = i420[:rows]
+            flat = i420.reshape(-1)
+            luma, chroma = rows * self.width, (rows // 2) * (self.width // 2)
+            u = flat[luma:luma + chroma].reshape(rows // 2, self.width // 2)
+            v = flat[luma + chroma:].reshape(rows // 2, self.width // 2)
+            if destination == "NV12":
+                cv2.merge([u, v], dst=planes[1][r0 // 2:r1 // 2])
+            else:
+                planes[1][r0 // 2:r1 // 2] = u
+                planes[2][r0 // 2:r1 // 2] = v
+
+    def convert(self, frame, out=None):
+        """
+        Convert frame into out (a buffer of layout.frame_size bytes, e.g. surface.data);
+        without out, into a buffer allocated on the first call and reused afterwards.
+        """
+        expected = (self.height, self.width) if self.source == "MONO" or self.source.startswith("BAYER") \
+            else (self.height, self.width, 3)
+        if frame.shape != expected or frame.dtype != np.uint8:
+            raise ValueError(f"{self.source} input must be a uint8 array of shape {expected}, got {frame.dtype} {frame.shape}")
+        if out is None:
+            if self.output is None:
+                self.output = np.empty(self.layout.frame_size, np.uint8)
+            out = self.output
+        planes = self.layout.plane_views(out)
+        if self._pool is None:
+            self._convert_stripe(frame, planes, 0)
+        else:
+            for future in [self._pool.submit(self._convert_stripe, frame, planes, i) for i in range(len(self.stripes))]:
+                future.result()
+        return out
+
+    __call__ = convert
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# validation ####################################################################################
+
+def reference(frame, source, destination):
+    """Full-frame, single threaded conversion with fresh allocations, for validation."""
+    source, destination = source.upper(), destination.upper()
+    if source.startswith("BAYER"):
+        frame, source = cv2.cvtColor(frame, _BAYER_CODES[source]), "BGR"
+    elif source == "MONO":
+        frame, source = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), "BGR"
+    if source == "RGB":
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    height, width = frame.shape[:2]
+    if destination == "ARGB":
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA).ravel()
+    if destination == "ABGR":
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA).ravel()
+    if destination == "YUV444":
+        yuv = frame.astype(np.float64) @ _BGR2YUV[:, :3].T.astype(np.float64) + _BGR2YUV[:, 3]
+        return np.clip(np.round(yuv), 0, 255).astype(np.uint8).transpose(2, 0, 1).ravel()
+    i420 = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420).ravel()
+    if destination == "YUV420":
+        return i420
+    y, u, v = i420[:height * width], i420[height * width:height * width * 5 // 4], i420[height * width * 5 // 4:]
+    return np.concatenate([y, np.stack([u, v], axis=1).ravel()])
+
+
+def validate(width=640, height=480, threads=4, seed=0):
+    """Max absolute difference to the reference for every source / destination pair."""
+    rng = np.random.default_rng(seed)
+    colour = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    grey = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    results = {}
+    for source in SOURCES:
+        frame = colour if source in ("BGR", "RGB") else grey
+        for destination in DESTINATIONS:
+            with ColorConverter(source, destination, width, height, threads) as converter:
+                out = converter.convert(frame)
+            diff = np.abs(out.astype(np.int16) - reference(frame, source, destination).astype(np.int16))
+            results[source, destination] = int(diff.max())
+    return results
+
+
+def benchmark(source="BGR", destination="NV12", width=3840, height=2160, threads=None, frames=30):
+    """Frames per second of ColorConverter and of a single full-frame cvtColor-style reference."""
+    rng = np.random.default_rng(0)
+    shape = (height, width, 3) if source in ("BGR", "RGB") else (height, width)
+    frame = rng.integers(0, 256, shape, dtype=np.uint8)
+    with ColorConverter(source, destination, width, height, threads) as converter:
+        out = np.empty(converter.layout.frame_size, np.uint8)
+        converter.convert(frame, out)
+        start = time.perf_counter()
+        for _ in range(frames):
+            converter.convert(frame, out)
+        fps = frames / (time.perf_counter() - start)
+        threads = converter.threads
+    start = time.perf_counter()
+    for _ in range(max(1, frames // 3)):
+        reference(frame, source, destination)
+    reference_fps = max(1, frames // 3) / (time.perf_counter() - start)
+    return fps, reference_fps, threads
+
+
+if __name__ == "__main__":
+    failures = {pair: diff for pair, diff in validate().items() if diff > (1 if pair[1] == "YUV444" else 0)}
+    print("validation: " + ("all conversions match the reference" if not failures else f"FAILED {failures}"))
+    for source, destination in (("BGR", "NV12"), ("BAYER_RG", "NV12"), ("MONO", "NV12"), ("BGR", "YUV444"), ("BGR", "ARGB")):
+        fps, reference_fps, threads = benchmark(source, destination)
+        print(f"4K {source:>8} -> {destination:<6}: {fps:6.1f} fps on {threads} threads "
+              f"(single threaded reference {reference_fps:5.1f} fps)")
@@ -26,14 +26,15 @@ import json
 import argparse
 from pathlib import Path
 import io
-from Utils import AppFrame
+from SurfacePool import SurfacePool
 from Utils import FetchCPUFrame
 from Utils import FetchGPUFrame
+from ReplaySource import ReplayCamera, open_raw
 
 total_num_frames = 1000
 
 
-def encode(gpu_id, dec_file_path, enc_file_path, width, height, fmt, config_params):
+def encode(gpu_id, dec_file_path, enc_file_path, width, height, fmt, config_params, replay_rate=None, fps=30.0):
     """
                 This function illustrates encoding of frames using CUDA device buffers as input.
 
@@ -53,6 +54,9 @@ def encode(gpu_id, dec_file_path, enc_file_path, width, height, fmt, config_para
                     - height (int): height of encoded frame
                     - fmt (str) : surface format string in uppercase, for e.g. NV12
                     - config_params(key value pairs) : key value pairs providing fine-grained control on encoding
+                    - replay_rate (float) : deliver frames at fps x replay_rate like a live camera (see ReplaySource.py)
+                      instead of as fast as the file can be read, and report whether encoding kept pace
+                    - fps (float) : frame rate of the raw file, when it has no .timestamps.npy index
 
                 Returns: - None.
 
@@ -61,15 +65,19 @@ def encode(gpu_id, dec_file_path, enc_file_path, width, height, fmt, config_para
                 Encode 1080p NV12 raw YUV into elementary bitstream using H.264 codec and P4 preset
         """
 
-    with open(dec_file_path, "rb") as decFile, open(enc_file_path, "wb") as encFile:
+    with open_raw(dec_file_path, width, height, fmt, replay_rate, fps, total_num_frames) as decFile, \
+            open(enc_file_path, "wb") as encFile:
         nvenc = nvc.CreateEncoder(width, height, fmt, False, **config_params)  # create encoder object
-        input_frame_list = list([AppFrame(width, height, fmt) for x in range(1, 5)])
+        # four device surfaces allocated once and cycled through by FetchGPUFrame
+        input_frame_list = SurfacePool(width, height, fmt, count=4, device="cuda")
         for input_gpu_frame in FetchGPUFrame(input_frame_list,
-                                             FetchCPUFrame(decFile, input_frame_list[0].frameSize),
+                                             FetchCPUFrame(decFile, input_frame_list.layout.frame_size),
                                              total_num_frames):
             bitstream = nvenc.Encode(input_gpu_frame)  # encode frame one by one
             bitstream = bytearray(bitstream)
             encFile.write(bitstream)
+        if isinstance(decFile, ReplayCamera):
+            print(decFile.report())
 
         bitstream = nvenc.EndEncode()  # flush encoder queue
         bitstream = bytearray(bitstream)
@@ -88,6 +96,9 @@ if __name__ == "__main__":
     parser.add_argument("-if", "--format", type=str, required=True, help="Format of input file", )
     parser.add_argument("-c", "--codec", type=str, required=True, help="h264, hevc, av1", )
     parser.add_argument("-json", "--config_file", type=str, default='', help="path of json config file", )
+    parser.add_argument("-r", "--replay_rate", type=float, default=None,
+                        help="feed frames at fps x rate like a live camera instead of as fast as possible", )
+    parser.add_argument("-fps", "--fps", type=float, default=30.0, help="frame rate of the raw file", )
 
     args = parser.parse_args()
     config = {}
@@ -109,4 +120,6 @@ if __name__ == "__main__":
            int(size[0]),
            int(size[1]),
            args.format,
-           config)
\ No newline at end of file
+           config,
+           args.replay_rate,
+           args.fps)
\ No newline at end of file
@@ -27,29 +27,20 @@ import json
 import argparse
 from pathlib import Path
 
-total_num_frames = 100
-
+from PixelFormats import GetFrameSize
+from SurfacePool import SurfacePool
+from ReplaySource import ReplayCamera, open_raw
 
-def GetFrameSize(width, height, surface_format):
-    frame_size = int(width * height * 3 / 2)
-    if surface_format == "ARGB" or surface_format == "ABGR":
-        frame_size = width * height * 4
-    if surface_format == "YUV444":
-        frame_size = width * height * 3
-    if surface_format == "YUV420":
-        frame_size = int(width * height * 3 / 2)
-    if surface_format == "P010":
-        frame_size = int(width * height * 3 / 2 * 2)
-    if surface_format == "YUV444_16BIT":
-        frame_size = int(width * height * 3 * 2)
-    return frame_size
+total_num_frames = 100
 
 
-def FetchCPUFrame(dec_file, frame_size):
-    yield np.fromfile(dec_file, np.uint8, count=frame_size)
+def FetchCPUFrame(dec_file, surface):
+    """Read the next frame from dec_file straight into a pooled host surface, returns the bytes read."""
+    return dec_file.readinto(surface.data)
 
 
-def encode(gpuID, dec_file_path, enc_file_path, width, height, fmt, use_cpu_memory, config_params):
+def encode(gpuID, dec_file_path, enc_file_path, width, height, fmt, use_cpu_memory, config_params, replay_rate=None,
+           fps=30.0):
     """
             This function illustrates encoding of frames using host memory buffers as input.
 
@@ -68,6 +59,9 @@ def encode(gpuID, dec_file_path, enc_file_path, width, height, fmt, use_cpu_memo
                 - height (int): height of encoded frame
                 - fmt (str) : surface format string in uppercase, for e.g. NV12
                 - config_params(key value pairs) : key value pairs providing fine-grained control on encoding
+                - replay_rate (float) : deliver frames at fps x replay_rate like a live camera (see ReplaySource.py)
+                  instead of as fast as the file can be read, and report whether encoding kept pace
+                - fps (float) : frame rate of the raw file, when it has no .timestamps.npy index
 
             Returns: - None.
 
@@ -76,15 +70,22 @@ def encode(gpuID, dec_file_path, enc_file_path, width, height, fmt, use_cpu_memo
             Encode 1080p NV12 raw YUV into elementary bitstream using H.264 codec and P4 preset
     """
     frame_size = GetFrameSize(width, height, fmt)
-    with open(dec_file_path, "rb") as dec_file, open(enc_file_path, "wb") as enc_file:
+    # one host surface is enough: Encode() copies the input before returning
+    pool = SurfacePool(width, height, fmt, count=1)
+    with open_raw(dec_file_path, width, height, fmt, replay_rate, fps, total_num_frames) as dec_file, \
+            open(enc_file_path, "wb") as enc_file:
         nvenc = nvc.CreateEncoder(width, height, fmt, use_cpu_memory, **config_params)  # create encoder object
+        surface = pool.acquire()
         for i in range(total_num_frames):
             # Read frame from file, where each frame is one chunk of frame_size bytes
-            chunk = np.fromfile(dec_file, np.uint8, count=frame_size)
-            if chunk.size != 0:
-                bitstream = nvenc.Encode(chunk)  # encode frame one by one
-                bitstream = bytearray(bitstream)
-                enc_file.write(bitstream)
+            if FetchCPUFrame(dec_file, surface) != frame_size:
+                break
+            bitstream = nvenc.Encode(surface.data)  # encode frame one by one
+            bitstream = bytearray(bitstream)
+            enc_file.write(bitstream)
+        pool.release(surface)
+        if isinstance(dec_file, ReplayCamera):
+            print(dec_file.report())
         print("Flushing encoder queue")
         bitstream = nvenc.EndEncode()  # flush encoder queue
         bitstream = bytearray(bitstream)
@@ -106,6 +107,9 @@ def sample_encode():
     parser.add_argument("-json", "--config_file", type=str, default='', help="path of json config file", )
     parser.add_argument("-cb", "--use_cpu_memory", required=True, type=int,
                         help="encode accepts CPU buffer directly else accepts CAI or DLPack", )
+    parser.add_argument("-r", "--replay_rate", type=float, default=None,
+                        help="feed frames at fps x rate like a live camera instead of as fast as possible", )
+    parser.add_argument("-fps", "--fps", type=float, default=30.0, help="frame rate of the raw file", )
     
 
     args = parser.parse_args()
@@ -129,7 +133,9 @@ def sample_encode():
            int(size[1]),
            args.format,
            args.use_cpu_memory,
-           config)
+           config,
+           args.replay_rate,
+           args.fps)
 
 
 def sample_usage():
@@ -0,0 +1,309 @@
+"""
+Encoder parameter sweep: encodes a reference clip with every combination of a parameter grid and
+measures encode speed, output size and quality, instead of hand-picking crfOut / ffmpegThreads
+(cameraCapture.py) or bitrate / preset (complete pipeline.py).
+
+Backends:
+    ffmpeg  skvideo.io.FFmpegWriter exactly as cameraCapture.py uses it (libx264, libx265,
+            libsvtav1; -crf, -preset, -threads)
+    nvenc   PyNvVideoCodec encoder fed with NV12 surfaces from a SurfacePool (h264, hevc, av1;
+            any CreateEncoder option such as preset, bitrate, rc)
+
+Every output is decoded again with cv2 and compared with the reference on the grey levels:
+PSNR from the squared error summed frame by frame in integers, and SSIM (Wang et al. 2004, 11x11
+Gaussian, sigma 1.5) with a few frames stacked as image channels so one cv2.GaussianBlur call
+filters several frames at once; the stack is capped in bytes (SSIM_BATCH_BYTES), so the float32
+temporaries (about ten stacks) stay well under 1 GB whatever the clip length and frame size. The
+Pareto front over (fps, size, SSIM) is printed together with the fastest settings that reach the
+quality target.
+
+Encode speed excludes start-up: ffmpeg is launched by writing the first frame, which is timed
+separately (startup_s) and not counted in fps; for NVENC startup_s is the CreateEncoder call.
+
+Usage:
+    python EncoderSweep.py -i mj_12_00_00_m1.mp4 -n 300 --backend ffmpeg --target_ssim 0.98
+    python EncoderSweep.py -i clip.mp4 --backend nvenc -json sweep.json -o results.json
+    python EncoderSweep.py -i synthetic:1920x1080 -n 300      # SyntheticVideo.py clip, seed 0
+
+A grid file maps backend name to a list of grids; every grid is expanded as a cartesian product:
+    {"ffmpeg": [{"-vcodec": ["libx264"], "-crf": [18, 21, 24], "-preset": ["ultrafast", "medium"], "-threads": [2, 4]}],
+     "nvenc": [{"codec": ["h264", "hevc"], "preset": ["P1", "P4"], "bitrate": [4000000]}]}
+"""
+
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+DEFAULT_GRIDS = {
+    "ffmpeg": [
+        {"-vcodec": ["libx264"], "-crf": [18, 21, 24, 28], "-preset": ["ultrafast", "veryfast", "medium"],
+         "-threads": [2, 4, 8]},
+        {"-vcodec": ["libx265"], "-crf": [21, 28], "-preset": ["ultrafast", "fast"], "-threads": [4]},
+        {"-vcodec": ["libsvtav1"], "-crf": [30, 40], "-preset": ["10"], "-threads": [4]},
+    ],
+    "nvenc": [
+        {"codec": ["h264", "hevc", "av1"], "preset": ["P1", "P4", "P7"], "bitrate": [2000000, 4000000, 8000000]},
+    ],
+}
+
+SSIM_BATCH_BYTES = 64 * 1024 * 1024  # float32 bytes of one stack of frames filtered together
+
+# raw elementary stream extension per NVENC codec, so cv2/ffmpeg can probe the output
+_NVENC_EXTENSIONS = {"h264": ".h264", "hevc": ".hevc", "av1": ".obu"}
+
+
+def expand_grid(grid):
+    """All settings dicts of one grid (dict of option -> list of values)."""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def load_clip(path, frame_count=300):
+    """
+    First frame_count frames of a video as a (N, H, W) uint8 grey level array.
+    "synthetic:WIDTHxHEIGHT[:SEED]" renders a reproducible SyntheticVideo clip instead.
+    """
+    if path.startswith("synthetic:"):
+        from SyntheticVideo import SyntheticVideo
+        size, _, seed = path[len("synthetic:"):].partition(":")
+        width, height = (int(n) for n in size.lower().split("x"))
+        video = SyntheticVideo(width, height, "Mono8", seed=int(seed or 0))
+        clip = video.clip(frame_count)
+        video.close()
+        return clip
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video file {path}")
+    frames = []
+    while len(frames) < frame_count:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame)
+    cap.release()
+    if not frames:
+        raise IOError(f"No frames could be read from {path}")
+    clip = np.stack(frames)
+    # 4:2:0 encoders need even dimensions
+    return np.ascontiguousarray(clip[:, :clip.shape[1] & ~1, :clip.shape[2] & ~1])
+
+
+def decode_grey(path, frame_count):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while cap.isOpened() and len(frames) < frame_count:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    cap.release()
+    return np.stack(frames) if frames else None
+
+
+# quality ######################################################################################
+
+def psnr(reference, decoded):
+    """PSNR in dB over the whole clip (mean squared error over all frames and pixels)."""
+    squared_error = 0
+    for x, y in zip(reference, decoded):
+        diff = cv2.absdiff(x, y).astype(np.uint32)  # one frame at a time, exact in integers
+        squared_error += int(np.dot(diff.ravel(), diff.ravel()))
+    mse = squared_error / reference.size
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def ssim(reference, decoded, batch_bytes=SSIM_BATCH_BYTES):
+    """Mean SSIM over all frames; frames are filtered as channels of one image, batch_bytes at a time."""
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    frame_bytes = reference[0].size * 4
+    batch = int(min(512, max(1, batch_bytes // frame_bytes)))  # cv2 handles at most 512 channels
+    blur = lambda image: cv2.GaussianBlur(image, (11, 11), 1.5).reshape(image.shape)
+    total = 0.0
+    for start in range(0, len(reference), batch):
+        # (N, H, W) -> (H, W, N): cv2 filters every channel independently
+        x = np.ascontiguousarray(reference[start:start + batch].transpose(1, 2, 0), dtype=np.float32)
+        y = np.ascontiguousarray(decoded[start:start + batch].transpose(1, 2, 0), dtype=np.float32)
+        mu_x, mu_y = blur(x), blur(y)
+        sigma_x = blur(x * x)
+        sigma_y = blur(y * y)
+        x *= y
+        sigma_xy = blur(x)
+        del x, y
+        mu_xy = mu_x * mu_y
+        mu_x *= mu_x
+        mu_y *= mu_y
+        sigma_x -= mu_x
+        sigma_y -= mu_y
+        sigma_xy -= mu_xy
+        # numerator and denominator built in place in the buffers that are no longer needed
+        mu_xy *= 2
+        mu_xy += c1
+        sigma_xy *= 2
+        sigma_xy += c2
+        mu_xy *= sigma_xy
+        mu_x += mu_y
+        mu_x += c1
+        sigma_x += sigma_y
+        sigma_x += c2
+        mu_x *= sigma_x
+        mu_xy /= mu_x
+        total += float(mu_xy.mean(axis=(0, 1)).sum())
+    return total / len(reference)
+
+
+# backends #####################################################################################
+
+def encode_ffmpeg(clip, settings, out_path):
+    """
+    Encode with skvideo's FFmpegWriter. Returns (encode seconds, frames timed, startup seconds):
+    the first writeFrame launches ffmpeg and is timed as start-up, the clock starts after it.
+    """
+    import skvideo.io
+    writer = skvideo.io.FFmpegWriter(out_path, outputdict={key: str(value) for key, value in settings.items()})
+    start = time.perf_counter()
+    writer.writeFrame(clip[0])
+    startup = time.perf_counter() - start
+    start = time.perf_counter()
+    for frame in clip[1:]:
+        writer.writeFrame(frame)
+    writer.close()
+    return time.perf_counter() - start, len(clip) - 1, startup
+
+
+def encode_nvenc(clip, settings, out_path):
+    """
+    Encode with NVENC from host NV12 surfaces. Returns (encode seconds, frames timed, startup
+    seconds), start-up being the CreateEncoder call.
+    """
+    import PyNvVideoCodec as nvc
+    from SurfacePool import SurfacePool
+    from PackedFormats import fill_neutral_chroma
+
+    height, width = clip.shape[1:]
+    pool = SurfacePool(width, height, "NV12", count=len(clip))
+    fill_neutral_chroma(pool.buffer, pool.layout)
+    # full range grey -> limited range luma, which is what the decoder (and ffmpeg's gray -> yuv420p) assumes
+    lut = np.round(16 + np.arange(256) * 219 / 255).astype(np.uint8)
+    surfaces = [pool.acquire() for _ in clip]
+    for surface, frame in zip(surfaces, clip):
+        np.take(lut, frame, out=surface.planes[0])
+    start = time.perf_counter()
+    encoder = nvc.CreateEncoder(width, height, "NV12", True, **settings)
+    startup = time.perf_counter() - start
+    start = time.perf_counter()
+    with open(out_path, "wb") as out_file:
+        for surface in surfaces:
+            out_file.write(bytearray(encoder.Encode(surface.data)))
+        out_file.write(bytearray(encoder.EndEncode()))
+    return time.perf_counter() - start, len(clip), startup
+
+
+def _output_extension(backend, settings):
+    if backend == "nvenc":
+        return _NVENC_EXTENSIONS.get(str(settings.get("codec", "h264")).lower(), ".bin")
+    return ".mkv" if "av1" in str(settings.get("-vcodec", "")) else ".mp4"
+
+
+BACKENDS = {"ffmpeg": encode_ffmpeg, "nvenc": encode_nvenc}
+
+
+# sweep ########################################################################################
+
+def run_sweep(clip, grids, backends=("ffmpeg",), work_dir=None, keep_outputs=False, log=print):
+    """Encode clip with every setting of grids[backend]; returns one result dict per run."""
+    results = []
+    work_dir = work_dir or tempfile.mkdtemp(prefix="encoder_sweep_")
+    raw_bytes = clip.nbytes
+    for backend in backends:
+        for grid in grids.get(backend, []):
+            for settings in expand_grid(grid):
+                out_path = os.path.join(work_dir, f"{backend}_{len(results)}{_output_extension(backend, settings)}")
+                result = {"backend": backend, "settings": settings}
+                try:
+                    seconds, frames, startup = BACKENDS[backend](clip, settings, out_path)
+                except Exception as e:
+                    result["error"] = str(e)
+                    log(f"{backend} {settings}: failed ({e})")
+                    results.append(result)
+                    continue
+                size = os.path.getsize(out_path)
+                decoded = decode_grey(out_path, len(clip))
+                result.update(fps=frames / seconds, startup_s=startup, bytes=size, ratio=raw_bytes / size if size else float("nan"))
+                if decoded is not None and len(decoded) == len(clip):
+                    result.update(psnr=psnr(clip, decoded), ssim=ssim(clip, decoded))
+                else:
+                    result.update(psnr=float("nan"), ssim=float("nan"))
+                if not keep_outputs:
+                    os.remove(out_path)
+                log(format_result(result))
+                results.append(result)
+    return results
+
+
+def pareto_front(results, quality="ssim"):
+    """Runs not beaten by another run on all of fps (higher), bytes (lower) and quality (higher)."""
+    valid = [r for r in results if "error" not in r and not np.isnan(r[quality])]
+    front = []
+    for r in valid:
+        dominated = any(o["fps"] >= r["fps"] and o["bytes"] <= r["bytes"] and o[quality] >= r[quality] and
+                        (o["fps"] > r["fps"] or o["bytes"] < r["bytes"] or o[quality] > r[quality])
+                        for o in valid)
+        if not dominated:
+            front.append(r)
+    return sorted(front, key=lambda r: -r["fps"])
+
+
+def recommend(results, target_ssim=None, target_psnr=None, min_ratio=None):
+    """Fastest run that meets the quality targets (and optionally a minimum compression ratio)."""
+    candidates = [r for r in results if "error" not in r
+                  and (target_ssim is None or r["ssim"] >= target_ssim)
+                  and (target_psnr is None or r["psnr"] >= target_psnr)
+                  and (min_ratio is None or r["ratio"] >= min_ratio)]
+    return max(candidates, key=lambda r: r["fps"]) if candidates else None
+
+
+def format_result(result):
+    if "error" in result:
+        return f"{result['backend']:>6} {result['settings']}: {result['error']}"
+    return (f"{result['backend']:>6} {result['fps']:8.1f} fps {result['bytes'] / 1e6:8.2f} MB "
+            f"(x{result['ratio']:6.1f}) start {result['startup_s'] * 1000:5.0f} ms PSNR {result['psnr']:6.2f} dB SSIM {result['ssim']:.4f}  {result['settings']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Encode a reference clip with a grid of encoder settings and report speed, size and quality."
+    )
+    parser.add_argument("-i", "--clip", type=str, required=True, help="Reference video (e.g. a recorded mj_*.mp4) or synthetic:1920x1080", )
+    parser.add_argument("-n", "--frames", type=int, default=300, help="Number of frames of the clip to use", )
+    parser.add_argument("-b", "--backend", type=str, default="ffmpeg", help="ffmpeg, nvenc or ffmpeg,nvenc", )
+    parser.add_argument("-json", "--config_file", type=str, default='', help="path of json grid file", )
+    parser.add_argument("--target_ssim", type=float, default=0.98, help="Quality the recommendation must reach", )
+    parser.add_argument("--target_psnr", type=float, default=None, help="Optional PSNR target in dB", )
+    parser.add_argument("-o", "--output", type=str, default='', help="Write all results to this JSON file", )
+    args = parser.parse_args()
+
+    grids = DEFAULT_GRIDS
+    if len(args.config_file):
+        with open(args.config_file) as jsonFile:
+            grids = json.load(jsonFile)
+
+    clip = load_clip(args.clip, args.frames)
+    print(f"Reference clip: {clip.shape[0]} frames of {clip.shape[2]}x{clip.shape[1]}")
+    results = run_sweep(clip, grids, [b.strip() for b in args.backend.split(",")])
+
+    print("\nPareto front (fps / size / SSIM):")
+    for result in pareto_front(results):
+        print(format_result(result))
+    best = recommend(results, args.target_ssim, args.target_psnr)
+    print(f"\nFastest with SSIM >= {args.target_ssim}" + (f" and PSNR >= {args.target_psnr}" if args.target_psnr else "") + ":")
+    print(format_result(best) if best else "no setting reaches the target")
+
+    if len(args.output):
+        with open(args.output, "w") as jsonFile:
+            json.dump(results, jsonFile, indent=2)
@@ -0,0 +1,214 @@
+"""
+In-process fan-out: one frame reaches any number of consumers (recorder, preview, online tracker)
+at the same time, without copies.
+
+publish() wraps the frame in a SharedFrame: a read-only view plus a reference count with one
+reference per subscriber that took it. Every subscriber has its own queue depth and drop policy,
+so a slow preview or tracker only ever loses its own frames:
+
+    "block"        the publisher waits for space (use for the recorder; depth 0 = unbounded)
+    "drop_oldest"  the oldest queued frame is dropped (previews / trackers that want the newest)
+    "drop_newest"  the new frame is dropped (consumers that want contiguous runs of frames)
+
+When the last reference is released, the optional on_free callback runs, e.g. image.Release to
+return a camera buffer or pool.release to recycle a surface; frames are never copied on the way.
+
+Usage:
+    fanout = FanOut()
+    recorder = fanout.subscribe("recorder", depth=0, policy="block")
+    fanout.subscribe("tracker", depth=2, policy="drop_oldest", callback=track)   # own thread
+    fanout.publish(frame, timestamp)
+    ...
+    with recorder.get() as shared:          # None after close()
+        writer.writeFrame(shared.array)
+    fanout.close()                          # subscribers drain their queues and stop
+"""
+
+import threading
+import time
+from collections import deque
+
+POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+class SharedFrame:
+    """Read-only frame shared by several subscribers; release() once per get()."""
+
+    __slots__ = ("array", "timestamp", "_refs", "_on_free", "_lock")
+
+    def __init__(self, array, timestamp, on_free=None):
+        view = array.view()
+        view.flags.writeable = False  # subscribers must not change what the others see
+        self.array = view
+        self.timestamp = timestamp
+        self._refs = 1                 # held by publish() until every subscriber has its reference
+        self._on_free = on_free
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            self._refs += 1
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            free = self._refs == 0
+        if free and self._on_free is not None:
+            self._on_free()
+
+    @property
+    def refs(self):
+        return self._refs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Subscriber:
+    """
+    Parameters:
+        - name (str): used in stats
+        - depth (int): queued frames before the policy applies (0 with "block": unbounded)
+        - policy (str): "block", "drop_oldest" or "drop_newest"
+        - callback (callable): optional (array, timestamp) -> None, run on the subscriber's own thread
+    """
+
+    def __init__(self, name, depth=4, policy="drop_oldest", callback=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown drop policy {policy}, expected one of {POLICIES}")
+        if depth < 1 and policy != "block":
+            raise ValueError("Only the block policy can use an unbounded queue (depth 0)")
+        self.name = name
+        self.depth = depth
+        self.policy = policy
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {"delivered": 0, "dropped": 0, "max_queued": 0, "blocked_seconds": 0.0}
+        self._thread = None
+        if callback is not None:
+            self._thread = threading.Thread(target=self._run, args=(callback,), name=f"fanout-{name}", daemon=True)
+            self._thread.start()
+
+    def _offer(self, frame):
+        dropped = None
+        with self._cond:
+            if self._closed:
+                return
+            if self.depth and len(self._queue) >= self.depth:
+                if self.policy == "drop_newest":
+                    self.stats["dropped"] += 1
+                    return
+                if self.policy == "drop_oldest":
+                    dropped = self._queue.popleft()
+                    self.stats["dropped"] += 1
+                else:
+                    start = time.perf_counter()
+                    while len(self._queue) >= self.depth and not self._closed:
+                        self._cond.wait()
+                    self.stats["blocked_seconds"] += time.perf_counter() - start
+                    if self._closed:
+                        return  # closed while waiting: nobody will get() or release the frame
+            frame._acquire()
+            self._queue.append(frame)
+            self.stats["max_queued"] = max(self.stats["max_queued"], len(self._queue))
+            self._cond.notify_all()
+        if dropped is not None:
+            dropped.release()
+
+    def get(self, timeout=None):
+        """Next SharedFrame (caller must release it), or None when closed and drained / on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._queue or self._closed, timeout):
+                return None
+            if not self._queue:
+                return None
+            frame = self._queue.popleft()
+            self.stats["delivered"] += 1
+            self._cond.notify_all()  # a blocked publisher may continue
+            return frame
+
+    def latest(self):
+        """Newest queued frame without waiting (older queued ones are released), or None."""
+        with self._cond:
+            if not self._queue:
+                return None
+            frames = list(self._queue)
+            self._queue.clear()
+            self.stats["delivered"] += 1
+            self.stats["dropped"] += len(frames) - 1
+            self._cond.notify_all()
+        for frame in frames[:-1]:
+            frame.release()
+        return frames[-1]
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _run(self, callback):
+        while True:
+            frame = self.get()
+            if frame is None:
+                break
+            with frame:
+                callback(frame.array, frame.timestamp)
+
+    def close(self, drain=True):
+        """Stop accepting frames; queued frames are still delivered unless drain is False."""
+        with self._cond:
+            self._closed = True
+            dropped = [] if drain else list(self._queue)
+            if not drain:
+                self._queue.clear()
+            self._cond.notify_all()
+        for frame in dropped:
+            frame.release()
+        if self._thread is not None and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+class FanOut:
+    def __init__(self):
+        self._subscribers = ()
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, name, depth=4, policy="drop_oldest", callback=None):
+        subscriber = Subscriber(name, depth, policy, callback)
+        with self._lock:
+            # copy-on-write, so publish() iterates without taking the lock
+            self._subscribers = self._subscribers + (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber, drain=False):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscriber)
+        subscriber.close(drain)
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    def publish(self, array, timestamp=None, on_free=None):
+        """Hand array to every subscriber; on_free runs once nobody holds it any more."""
+        frame = SharedFrame(array, time.perf_counter_ns() if timestamp is None else timestamp, on_free)
+        for subscriber in self._subscribers:
+            subscriber._offer(frame)
+        self.published += 1
+        frame.release()  # publisher's reference
+        return frame
+
+    def report(self):
+        lines = [f"published {self.published} frames"]
+        for s in self._subscribers:
+            lines.append(f"  {s.name:>12} ({s.policy}, depth {s.depth}): delivered {s.stats['delivered']}, "
+                         f"dropped {s.stats['dropped']}, max queued {s.stats['max_queued']}, "
+                         f"publisher blocked {s.stats['blocked_seconds'] * 1000:.1f} ms")
+        return "\n".join(lines)
+
+    def close(self, drain=True):
+        for subscriber in self._subscribers:
+            subscriber.close(drain)
@@ -0,0 +1,434 @@
+"""
+Camera pixel format negotiation: pick the camera PixelFormat / encoder surface format pair that
+leaves the least work for the host.
+
+Scripts used to either force Mono8 (cameraCapture.py) or take whatever the camera delivers and
+convert on the host (BayerRG8 -> BGR -> NV12). Cameras can often do part of that work themselves
+(on-camera ISP delivering RGB / BGRa / YUV 4:2:2, on-camera binning), and some pairs need almost
+no host work at all (Mono8 -> luma plane, BGRa8 -> ARGB surface). negotiate() looks at every pair
+of a camera format the camera offers and a surface format the encoder accepts, and ranks the
+possible ones by the measured host cost of the conversion:
+
+    host cost    milliseconds per frame, from a per-machine cost table (ms per megapixel for every
+                 conversion path) measured by measure_costs() and cached next to the camera profiles,
+                 plus copying the surface to the GPU (an ARGB surface is 4 bytes per pixel, NV12 1.5)
+    link         bytes per pixel * pixels * fps must fit the camera link (DeviceLinkThroughputLimit)
+    colour       colour output only from colour formats; by default colour is kept if the camera has it
+    bit depth    8 bit pairs by default; bit_depth=10/12 picks packed mono formats into P010 / YUV444_16BIT
+
+HostConverter does the conversion of the chosen pair, from the raw image bytes
+(image_result.GetData()) straight into an encoder surface, with PackedFormats, ColorConverter or a
+plain copy. Run this file to measure and print the cost table of this machine.
+
+Usage:
+    cam.Init()
+    plan = negotiate_camera(cam, codec="h264")        # sets PixelFormat (and IspEnable) on the camera
+    print(plan.report())
+    cam.BeginAcquisition()
+    convert = plan.converter(width, height)
+    pool = SurfacePool(width, height, plan.surface_format); convert.prepare(pool.buffer)
+    convert(image_result.GetData(), surface.data)
+"""
+
+import json
+import os
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from CameraStartup import PROFILE_CACHE_PATH, set_node
+from ColorConvert import ColorConverter
+from PackedFormats import PACKED_FORMATS, Unpacker, fill_neutral_chroma, packed_size
+from PixelFormats import GetFrameLayout
+
+COST_CACHE_PATH = os.path.join(os.path.dirname(PROFILE_CACHE_PATH), "format_costs.json")
+
+# bytes per pixel on the link, colour, significant bits, needs the on-camera ISP
+CameraFormat = namedtuple("CameraFormat", ["bytes_per_pixel", "colour", "bits", "isp"])
+
+CAMERA_FORMATS = {
+    "Mono8": CameraFormat(1, False, 8, False),
+    "Mono10p": CameraFormat(1.25, False, 10, False),
+    "Mono12p": CameraFormat(1.5, False, 12, False),
+    "Mono10Packed": CameraFormat(1.5, False, 10, False),
+    "Mono12Packed": CameraFormat(1.5, False, 12, False),
+    "Mono10": CameraFormat(2, False, 10, False),
+    "Mono12": CameraFormat(2, False, 12, False),
+    "Mono16": CameraFormat(2, False, 16, False),
+    "BayerRG8": CameraFormat(1, True, 8, False),
+    "BayerBG8": CameraFormat(1, True, 8, False),
+    "BayerGB8": CameraFormat(1, True, 8, False),
+    "BayerGR8": CameraFormat(1, True, 8, False),
+    "YUV422_8": CameraFormat(2, True, 8, True),              # Y U Y V
+    "YCbCr422_8": CameraFormat(2, True, 8, True),            # Y Cb Y Cr
+    "YUV422_8_UYVY": CameraFormat(2, True, 8, True),         # U Y V Y
+    "YCbCr422_8_CbYCrY": CameraFormat(2, True, 8, True),     # Cb Y Cr Y
+    "RGB8": CameraFormat(3, True, 8, True),
+    "BGR8": CameraFormat(3, True, 8, True),
+    "RGBa8": CameraFormat(4, True, 8, True),
+    "BGRa8": CameraFormat(4, True, 8, True),
+}
+
+# surface formats PyNvVideoCodec accepts per codec (see PixelFormats.py for their layouts)
+ENCODER_FORMATS = {
+    "h264": ("NV12", "YUV420", "YUV444", "ARGB", "ABGR"),
+    "hevc": ("NV12", "YUV420", "YUV444", "ARGB", "ABGR", "P010", "YUV444_16BIT"),
+    "av1": ("NV12", "YUV420", "ARGB", "ABGR", "P010"),
+}
+_SURFACE_BITS = {"P010": 10, "YUV444_16BIT": 16}
+
+_BAYER_SOURCES = {"BayerRG8": "BAYER_RG", "BayerBG8": "BAYER_BG", "BayerGB8": "BAYER_GB", "BayerGR8": "BAYER_GR"}
+# byte offsets of U and V in every 4 byte group of two 4:2:2 pixels
+_YUV422_CHROMA = {"YUV422_8": (1, 3), "YCbCr422_8": (1, 3), "YUV422_8_UYVY": (0, 2), "YCbCr422_8_CbYCrY": (0, 2)}
+
+
+def _path_steps(camera_format, surface_format):
+    """Description of the host work for a pair, or None if there is no conversion path."""
+    bits = _SURFACE_BITS.get(surface_format, 8)
+    if camera_format == "Mono8":
+        if surface_format in ("ARGB", "ABGR"):
+            return "grey to BGRA"
+        return "copy luma" if bits == 8 else "shift luma to 16 bit"
+    if camera_format in PACKED_FORMATS:
+        return f"unpack {camera_format} into 16 bit luma" if bits > 8 else None
+    if bits > 8:
+        return None
+    if camera_format in _BAYER_SOURCES:
+        return f"debayer + {surface_format} conversion"
+    if camera_format in ("RGB8", "BGR8"):
+        return f"{camera_format[:3]} to {surface_format} conversion"
+    if (camera_format, surface_format) in (("BGRa8", "ARGB"), ("RGBa8", "ABGR")):
+        return "copy"  # NVENC's ARGB is stored B, G, R, A: exactly BGRa8
+    if camera_format in _YUV422_CHROMA and surface_format in ("NV12", "YUV420"):
+        return "repack 4:2:2 to 4:2:0"
+    return None
+
+
+class HostConverter:
+    """
+    Parameters:
+        - camera_format (str): camera PixelFormat, a key of CAMERA_FORMATS
+        - surface_format (str): encoder surface format
+        - width, height (int): frame size
+        - threads (int): ColorConverter threads for the colour paths
+    """
+
+    def __init__(self, camera_format, surface_format, width, height, threads=None):
+        self.steps = _path_steps(camera_format, surface_format)
+        if self.steps is None:
+            raise ValueError(f"No host conversion from {camera_format} to {surface_format}")
+        self.camera_format = camera_format
+        self.surface_format = surface_format
+        self.width = width
+        self.height = height
+        self.layout = GetFrameLayout(width, height, surface_format)
+        self._colour = None
+        shape = (height, width)
+
+        if camera_format in PACKED_FORMATS:
+            unpacker = Unpacker(camera_format)
+            self._convert = lambda data, out, planes: unpacker(data, planes[0])
+        elif camera_format == "Mono8":
+            if surface_format in ("ARGB", "ABGR"):
+                self._convert = lambda data, out, planes: cv2.cvtColor(data.reshape(shape), cv2.COLOR_GRAY2BGRA,
+                                                                  dst=planes[0])
+            elif surface_format in _SURFACE_BITS:
+                self._convert = lambda data, out, planes: np.left_shift(data.reshape(shape), 8, out=planes[0],
+                                                                   dtype=np.uint16)
+            else:
+                self._convert = lambda data, out, planes: np.copyto(planes[0], data.reshape(shape))
+        elif self.steps == "copy":
+            self._convert = lambda data, out, planes: np.copyto(planes[0], data.reshape(height, width, 4))
+        elif camera_format in _YUV422_CHROMA:
+            self._convert = self._repack_yuv422
+            self._chroma = np.empty((height // 2, width // 2, 4), np.uint8)
+        else:
+            source = _BAYER_SOURCES.get(camera_format, camera_format[:3])
+            self._colour = ColorConverter(source, surface_format, width, height, threads)
+            source_shape = shape if camera_format in _BAYER_SOURCES else (height, width, 3)
+            self._convert = lambda data, out, planes: self._colour.convert(data.reshape(source_shape), out)
+
+    def _repack_yuv422(self, data, out, planes):
+        h, w = self.height, self.width
+        luma_offset = 1 if _YUV422_CHROMA[self.camera_format][0] == 0 else 0
+        cv2.extractChannel(data.reshape(h, w, 2), luma_offset, dst=planes[0])
+        # 4:2:2 -> 4:2:0: average the chroma of every pair of rows
+        pairs = data.reshape(h // 2, 2, w // 2, 4)
+        cv2.addWeighted(pairs[:, 0], 0.5, pairs[:, 1], 0.5, 0.0, dst=self._chroma)
+        u, v = _YUV422_CHROMA[self.camera_format]
+        if self.surface_format == "NV12":
+            cv2.mixChannels([self._chroma], [planes[1]], [u, 0, v, 1])
+        else:
+            cv2.extractChannel(self._chroma, u, dst=planes[1])
+            cv2.extractChannel(self._chroma, v, dst=planes[2])
+
+    def prepare(self, buffer):
+        """Once per surface buffer (a frame or a whole pool): neutral chroma for the mono paths."""
+        if not CAMERA_FORMATS[self.camera_format].colour and self.surface_format not in ("ARGB", "ABGR"):
+            fill_neutral_chroma(buffer, self.layout)
+
+    def __call__(self, data, out):
+        """Convert raw image bytes (image_result.GetData()) into the surface buffer out."""
+        data = np.asarray(data).reshape(-1)
+        self._convert(data, out, self.layout.plane_views(out))
+        return out
+
+    def close(self):
+        if self._colour is not None:
+            self._colour.close()
+
+
+# cost table ###################################################################################
+
+def _raw_frame(camera_format, width, height, rng):
+    if camera_format in PACKED_FORMATS:
+        size = packed_size(camera_format, width * height)
+    else:
+        size = int(CAMERA_FORMATS[camera_format].bytes_per_pixel * width * height)
+    return rng.integers(0, 256, size, dtype=np.uint8)
+
+
+def measure_costs(width=1280, height=720, frames=10, threads=None):
+    """Host milliseconds per megapixel of every conversion path on this machine."""
+    from FrameTransform import FrameTransform
+    rng = np.random.default_rng(0)
+    megapixels = width * height / 1e6
+    costs = {}
+    for camera_format in CAMERA_FORMATS:
+        data = _raw_frame(camera_format, width, height, rng)
+        for surface_format in ENCODER_FORMATS["hevc"]:
+            if _path_steps(camera_format, surface_format) is None:
+                continue
+            converter = HostConverter(camera_format, surface_format, width, height, threads)
+            out = np.empty(converter.layout.frame_size, np.uint8)
+            converter(data, out)
+            start = time.perf_counter()
+            for _ in range(frames):
+                converter(data, out)
+            costs[f"{camera_format}->{surface_format}"] = (time.perf_counter() - start) * 1000 / frames / megapixels
+            converter.close()
+    # the encoder copies host surfaces to the GPU; a memcpy per megabyte stands in for it
+    src, dst = rng.integers(0, 256, (2, width * height * 4), dtype=np.uint8)
+    start = time.perf_counter()
+    for _ in range(frames):
+        np.copyto(dst, src)
+    costs["upload"] = (time.perf_counter() - start) * 1000 / frames / (src.nbytes / 1e6)
+    # software binning in FrameTransform, per megapixel of 8 bit input samples
+    frame = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    for binning in (2, 4):
+        transform = FrameTransform(binning=binning)
+        transform.apply(frame)
+        start = time.perf_counter()
+        for _ in range(frames):
+            transform.apply(frame)
+        costs[f"binning{binning}"] = (time.perf_counter() - start) * 1000 / frames / megapixels
+    return costs
+
+
+def load_costs(path=COST_CACHE_PATH, remeasure=False):
+    """Cost table of this machine, measured once and then read from path."""
+    if not remeasure:
+        try:
+            with open(path) as jsonFile:
+                return json.load(jsonFile)
+        except (OSError, ValueError):
+            pass
+    costs = measure_costs()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as jsonFile:
+        json.dump(costs, jsonFile, indent=2)
+    return costs
+
+
+# negotiation ##################################################################################
+
+class Plan:
+    """Chosen pair, the node settings that select it on the camera and the ranking behind it."""
+
+    def __init__(self, camera_format, surface_format, host_ms, link_bytes_per_second, steps, settings,
+                 candidates, rejected):
+        self.camera_format = camera_format
+        self.surface_format = surface_format
+        self.host_ms = host_ms
+        self.link_bytes_per_second = link_bytes_per_second
+        self.steps = steps
+        self.settings = settings
+        self.candidates = candidates  # [(host ms, link bytes/s, camera format, surface format, steps)], best first
+        self.rejected = rejected      # [(camera format, surface format, reason)]
+
+    def converter(self, width, height, threads=None):
+        return HostConverter(self.camera_format, self.surface_format, width, height, threads)
+
+    def report(self):
+        link = f", {self.link_bytes_per_second / 1e6:.0f} MB/s on the link" if self.link_bytes_per_second else ""
+        lines = [f"{self.camera_format} -> {self.surface_format}: {self.steps}, {self.host_ms:.2f} ms per frame "
+                 f"on the host{link}"]
+        lines += [f"  node {name} = {value}" for name, value in self.settings]
+        for host_ms, link, camera_format, surface_format, steps in self.candidates[1:]:
+            lines.append(f"  also possible: {camera_format} -> {surface_format}: {steps}, {host_ms:.2f} ms"
+                         + (f", {link / 1e6:.0f} MB/s" if link else ""))
+        for camera_format, surface_format, reason in self.rejected:
+            lines.append(f"  rejected: {camera_format} -> {surface_format}: {reason}")
+        return "\n".join(lines)
+
+
+def negotiate(camera_formats, surface_formats, width, height, fps=None, colour=None, bit_depth=8,
+              link_bytes_per_second=None, isp=True, binning=1, camera_binning=False, costs=None):
+    """
+    Rank every (camera format, surface format) pair and return the Plan of the cheapest one.
+
+    Parameters:
+        - camera_formats (list): PixelFormat entries the camera offers
+        - surface_formats (list): surface formats the encoder accepts, in order of preference
+        - width, height (int): frame size delivered by the camera (after on-camera binning)
+        - fps (float): frame rate, for the link check (None: no check)
+        - colour (bool): keep colour; None keeps it if the camera offers any colour format and a
+          colour pair is usable, and records mono otherwise (e.g. 12 bit on a camera whose colour
+          formats are all 8 bit)
+        - bit_depth (int): 8, or 10 / 12 for high bit depth recording
+        - link_bytes_per_second (int): camera link limit (None: no check)
+        - isp (bool): whether formats that need the on-camera ISP can be used
+        - binning (int): binning wanted; done on the host (FrameTransform) unless camera_binning
+        - costs (dict): cost table, default load_costs()
+    """
+    costs = load_costs() if costs is None else costs
+    offered = [f for f in camera_formats if f in CAMERA_FORMATS]
+    if colour is None:
+        if any(CAMERA_FORMATS[f].colour for f in offered):
+            try:
+                return negotiate(camera_formats, surface_formats, width, height, fps, True, bit_depth,
+                                 link_bytes_per_second, isp, binning, camera_binning, costs)
+            except ValueError:
+                pass  # no colour pair meets the other constraints, fall back to mono
+        colour = False
+    megapixels = width * height / 1e6
+    binning_ms = 0.0
+    if binning > 1 and not camera_binning:
+        binning_ms = costs.get(f"binning{binning}", 0.0) * megapixels * binning * binning
+
+    candidates, rejected = [], []
+    for camera_format in offered:
+        spec = CAMERA_FORMATS[camera_format]
+        for preference, surface_format in enumerate(surface_formats):
+            steps = _path_steps(camera_format, surface_format)
+            surface_bits = _SURFACE_BITS.get(surface_format, 8)
+            link = spec.bytes_per_pixel * width * height * (fps or 0) * (1 if camera_binning else binning * binning)
+            reason = None
+            if steps is None:
+                reason = "no conversion path"
+            elif spec.colour != colour:
+                reason = "colour camera format for mono output" if spec.colour else "mono camera format for colour output"
+            elif bit_depth <= 8 and (spec.bits > 8 or surface_bits > 8):
+                reason = "high bit depth pair for 8 bit output"
+            elif bit_depth > 8 and (spec.bits < bit_depth or surface_bits < bit_depth):
+                reason = f"fewer than {bit_depth} bits"
+            elif spec.isp and not isp:
+                reason = "needs the on-camera ISP"
+            elif binning > 1 and not camera_binning and spec.colour:
+                reason = "host binning is for mono frames only"
+            elif link_bytes_per_second and link > link_bytes_per_second:
+                reason = f"{link / 1e6:.0f} MB/s exceeds the {link_bytes_per_second / 1e6:.0f} MB/s link"
+            if reason is not None:
+                if steps is not None:
+                    rejected.append((camera_format, surface_format, reason))
+                continue
+            key = f"{camera_format}->{surface_format}"
+            if key not in costs:
+                rejected.append((camera_format, surface_format, "not in the cost table"))
+                continue
+            upload_ms = costs.get("upload", 0.0) * GetFrameLayout(width, height, surface_format).frame_size / 1e6
+            host_ms = costs[key] * megapixels + upload_ms + binning_ms
+            if binning_ms:
+                steps = f"binning {binning}x{binning} + {steps}"
+            candidates.append((host_ms, link, preference, camera_format, surface_format, steps))
+    if not candidates:
+        raise ValueError(f"No usable pixel format pair for {'colour' if colour else 'mono'} {bit_depth} bit output: "
+                         f"camera offers {list(camera_formats)}, encoder accepts {list(surface_formats)}")
+    candidates.sort()
+    candidates = [(host_ms, link, c, s, steps) for host_ms, link, _, c, s, steps in candidates]
+    host_ms, link, camera_format, surface_format, steps = candidates[0]
+    settings = []
+    if CAMERA_FORMATS[camera_format].isp:
+        settings.append(("IspEnable", True))
+    if binning > 1 and camera_binning:
+        settings += [("BinningHorizontal", binning), ("BinningVertical", binning)]
+    settings.append(("PixelFormat", camera_format))
+    return Plan(camera_format, surface_format, host_ms, link, steps, settings, candidates, rejected)
+
+
+def encoder_formats(codec="h264", width=None, height=None, probe=False):
+    """
+    Surface formats the encoder accepts for codec: from ENCODER_FORMATS, or with probe=True by
+    creating a host memory encoder of width x height for each one (needs a GPU).
+    """
+    formats = ENCODER_FORMATS[codec]
+    if not probe:
+        return formats
+    import PyNvVideoCodec as nvc
+    accepted = []
+    for fmt in formats:
+        try:
+            encoder = nvc.CreateEncoder(width, height, fmt, True, codec=codec)
+            encoder.EndEncode()
+            accepted.append(fmt)
+        except Exception:
+            pass
+    return tuple(accepted)
+
+
+def _node(nodemap, name, kind):
+    import PySpin
+    node = kind(nodemap.GetNode(name))
+    return node if PySpin.IsAvailable(node) and PySpin.IsReadable(node) else None
+
+
+def camera_formats(cam):
+    """PixelFormat entries the camera offers in its current mode."""
+    import PySpin
+    node = _node(cam.GetNodeMap(), "PixelFormat", PySpin.CEnumerationPtr)
+    if node is None:
+        return []
+    entries = [PySpin.CEnumEntryPtr(entry) for entry in node.GetEntries()]
+    return [entry.GetSymbolic() for entry in entries if PySpin.IsAvailable(entry) and PySpin.IsReadable(entry)]
+
+
+def negotiate_camera(cam, codec="h264", surface_formats=None, colour=None, bit_depth=8, binning=1,
+                     probe_encoder=False, costs=None, apply=True):
+    """
+    negotiate() for an initialised camera that is not acquiring yet: reads its formats, frame size,
+    frame rate, link limit, ISP and binning support from the node map and, with apply=True,
+    writes the chosen settings.
+    """
+    import PySpin
+    nodemap = cam.GetNodeMap()
+    width, height = cam.Width.GetValue(), cam.Height.GetValue()
+    isp_node = nodemap.GetNode("IspEnable")
+    isp = isp_node is not None and PySpin.IsAvailable(isp_node) and PySpin.IsWritable(isp_node)
+    binning_node = nodemap.GetNode("BinningHorizontal")
+    camera_binning = binning > 1 and binning_node is not None and PySpin.IsWritable(binning_node)
+    if camera_binning:
+        width, height = width // binning, height // binning
+    rate = _node(nodemap, "AcquisitionResultingFrameRate", PySpin.CFloatPtr)
+    link = _node(nodemap, "DeviceLinkThroughputLimit", PySpin.CIntegerPtr)
+    if surface_formats is None:
+        surface_formats = encoder_formats(codec, width, height, probe_encoder)
+    plan = negotiate(camera_formats(cam), surface_formats, width, height,
+                     fps=rate.GetValue() if rate is not None else None, colour=colour, bit_depth=bit_depth,
+                     link_bytes_per_second=link.GetValue() if link is not None else None, isp=isp,
+                     binning=binning, camera_binning=camera_binning, costs=costs)
+    if apply:
+        for name, value in plan.settings:
+            set_node(nodemap, name, value)
+    return plan
+
+
+if __name__ == "__main__":
+    costs = load_costs(remeasure=True)
+    print(f"host conversion cost on this machine (saved to {COST_CACHE_PATH}):")
+    for key, ms in sorted(costs.items(), key=lambda item: item[1]):
+        print(f"  {key:<30} {ms:6.2f} ms per {'megabyte' if key == 'upload' else 'megapixel'}")
+    print("\nexample: colour camera, h264")
+    print(negotiate(["Mono8", "BayerRG8", "RGB8", "BGRa8", "YCbCr422_8"], ENCODER_FORMATS["h264"],
+                    1920, 1080, fps=60, link_bytes_per_second=380_000_000, costs=costs).report())
@@ -0,0 +1,280 @@
+"""
+Cross-process frame bus on shared memory: the acquisition process publishes frames into a ring
+of slots, and any number of local processes (pose tracking, closed-loop stimulus, ...) attach by
+name and read the live frames as numpy views, without files, pipes or pickling.
+
+Layout of the shared memory block (all integers little endian 64 bit):
+
+    header       magic, version, slot count, frame bytes, dtype, ndim, shape[4], write sequence
+    subscribers  MAX_SUBSCRIBERS x (pid, last read sequence, overruns, heartbeat ns)
+    slot meta    slot count x (sequence, timestamp)
+    slot data    slot count x frame bytes (64 byte aligned)
+
+The publisher never waits for anybody: frame n goes to slot n % slots, protected by a sequence
+lock (slot sequence is odd while the slot is written, 2 * (n + 1) when frame n is complete).
+A subscriber that falls more than `slots` frames behind has been overrun; it notices from the
+sequence numbers, jumps to the newest frame and counts the skipped frames. Views stay valid only
+until the publisher comes round to the same slot again, so check frame_valid() after working on a
+view, or read with copy=True. Every subscriber reports its lag and overruns in the subscriber
+table, which the publisher's metrics() reads.
+
+The ordering of the plain stores used here is guaranteed on x86 (the acquisition PCs); other
+architectures would need explicit memory barriers. On Windows the block is a named file mapping
+that disappears when the last process closes it, so subscribers cannot outlive the publisher.
+
+Usage:
+    # acquisition process
+    bus = FrameBusPublisher("rig1", (height, width), np.uint8, slots=32)
+    bus.publish(frame, timestamp)
+    print(bus.metrics())
+    bus.close()
+
+    # any other process on the same machine
+    sub = FrameBusSubscriber("rig1")
+    frame = sub.next(timeout=1.0)            # BusFrame(seq, timestamp, array) or None
+    track(frame.array)
+    if not sub.frame_valid(frame): ...       # overwritten while in use
+
+    python FrameBus.py rig1                  # watch a bus: fps, lag and overruns
+"""
+
+import os
+import struct
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MAGIC = 0x53554246454D4152  # "RAMEFBUS"
+VERSION = 1
+MAX_SUBSCRIBERS = 16
+_HEADER = struct.Struct("<QQQQ8sQ4QQ")          # up to and including the write sequence
+_WRITE_SEQ_OFFSET = _HEADER.size - 8
+_SUBSCRIBER_FIELDS = 4                           # pid, read sequence, overruns, heartbeat ns
+
+BusFrame = namedtuple("BusFrame", ["seq", "timestamp", "array"])
+
+
+def _attach(name):
+    """Attach to an existing block without registering it for cleanup in this process."""
+    shm = shared_memory.SharedMemory(name=name)
+    # before Python 3.13 every attaching process registers the block with its resource tracker,
+    # which unlinks it when that process exits and takes the bus away from everybody else
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+class _BusLayout:
+    def __init__(self, buffer, slots, frame_nbytes, dtype, shape):
+        self.slots = slots
+        self.frame_nbytes = frame_nbytes
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        offset = _HEADER.size
+        self.subscribers = np.ndarray((MAX_SUBSCRIBERS, _SUBSCRIBER_FIELDS), np.int64, buffer, offset)
+        offset += self.subscribers.nbytes
+        self.slot_meta = np.ndarray((slots, 2), np.int64, buffer, offset)
+        offset += self.slot_meta.nbytes
+        self.data_offset = (offset + 63) & ~63
+        self.write_seq = np.ndarray((1,), np.int64, buffer, _WRITE_SEQ_OFFSET)
+        self.frames = np.ndarray((slots,) + self.shape, self.dtype, buffer, self.data_offset)
+
+    @staticmethod
+    def size(slots, frame_nbytes):
+        offset = _HEADER.size + MAX_SUBSCRIBERS * _SUBSCRIBER_FIELDS * 8 + slots * 16
+        return ((offset + 63) & ~63) + slots * frame_nbytes
+
+
+class FrameBusPublisher:
+    """
+    Parameters:
+        - name (str): bus name subscribers attach to
+        - frame_shape (tuple): shape of every frame (up to 4 dimensions)
+        - dtype: numpy dtype of the frames
+        - slots (int): ring length; a subscriber may lag this many frames before it is overrun
+    """
+
+    def __init__(self, name, frame_shape, dtype=np.uint8, slots=32):
+        frame_shape = tuple(int(n) for n in frame_shape)
+        if not 1 <= len(frame_shape) <= 4:
+            raise ValueError(f"Frames must have 1 to 4 dimensions, got shape {frame_shape}")
+        dtype = np.dtype(dtype)
+        frame_nbytes = int(np.prod(frame_shape)) * dtype.itemsize
+        self.name = name
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=_BusLayout.size(slots, frame_nbytes))
+        self.shm.buf[:_BusLayout.size(slots, 0)] = bytes(_BusLayout.size(slots, 0))
+        self.layout = _BusLayout(self.shm.buf, slots, frame_nbytes, dtype, frame_shape)
+        shape = frame_shape + (0,) * (4 - len(frame_shape))
+        _HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, slots, frame_nbytes, dtype.str.encode(),
+                          len(frame_shape), *shape, 0)
+        self.published = 0
+
+    def publish(self, frame, timestamp=None):
+        """Copy frame into the next slot; never blocks. Returns its sequence number."""
+        layout = self.layout
+        seq = self.published
+        slot = seq % layout.slots
+        meta = layout.slot_meta[slot]
+        meta[0] = 2 * seq + 1                     # odd: slot being written
+        np.copyto(layout.frames[slot], frame)
+        meta[1] = time.perf_counter_ns() if timestamp is None else timestamp
+        meta[0] = 2 * seq + 2                     # even: frame seq complete
+        layout.write_seq[0] = seq + 1
+        self.published = seq + 1
+        return seq
+
+    __call__ = publish
+
+    def metrics(self):
+        """Lag (frames behind the publisher), overruns and heartbeat age of every attached subscriber."""
+        now = time.perf_counter_ns()
+        result = []
+        for pid, read_seq, overruns, heartbeat in self.layout.subscribers.tolist():
+            if pid:
+                result.append({"pid": pid, "lag": self.published - read_seq, "overruns": overruns,
+                               "idle_ms": (now - heartbeat) / 1e6})
+        return result
+
+    def report(self):
+        lines = [f"frame bus {self.name}: published {self.published} frames into {self.layout.slots} slots"]
+        for m in self.metrics():
+            lines.append(f"  pid {m['pid']}: lag {m['lag']} frames, {m['overruns']} frames lost to overruns, "
+                         f"last read {m['idle_ms']:.0f} ms ago")
+        return "\n".join(lines)
+
+    def close(self, unlink=True):
+        del self.layout  # numpy views must go before the mapping is closed
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class FrameBusSubscriber:
+    """
+    Parameters:
+        - name (str): bus name given to FrameBusPublisher
+        - from_start (bool): start at the oldest frame still in the ring instead of the next one
+    """
+
+    def __init__(self, name, from_start=False):
+        self.name = name
+        self.shm = _attach(name)
+        (magic, version, slots, frame_nbytes, dtype, ndim, *shape, write_seq) = _HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError(f"Shared memory block {name} is not a version {VERSION} frame bus")
+        self.layout = _BusLayout(self.shm.buf, slots, frame_nbytes, dtype.rstrip(b"\0").decode(), shape[:ndim])
+        self.next_seq = max(0, write_seq - slots + 1) if from_start else write_seq
+        self.overruns = 0
+        self.received = 0
+        self._entry = self._register()
+
+    def _register(self):
+        table = self.layout.subscribers
+        pid = os.getpid()
+        for entry in range(MAX_SUBSCRIBERS):
+            if table[entry, 0] == 0:
+                table[entry] = (pid, self.next_seq, 0, time.perf_counter_ns())
+                if table[entry, 0] == pid:
+                    return entry
+        return None  # table full: reading works, the subscriber just does not show up in metrics
+
+    def _report(self):
+        if self._entry is not None:
+            self.layout.subscribers[self._entry, 1:] = (self.next_seq, self.overruns, time.perf_counter_ns())
+
+    @property
+    def frame_shape(self):
+        return self.layout.shape
+
+    @property
+    def dtype(self):
+        return self.layout.dtype
+
+    def lag(self):
+        """Frames published that this subscriber has not read yet."""
+        return int(self.layout.write_seq[0]) - self.next_seq
+
+    def next(self, timeout=None, copy=False, latest=False, poll_interval=0.0005):
+        """
+        Wait for the next frame (or the newest one if latest=True); None on timeout.
+        Returns a view into the slot unless copy=True.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        layout = self.layout
+        while True:
+            write_seq = int(layout.write_seq[0])
+            if write_seq > self.next_seq:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                self._report()
+                return None
+            time.sleep(poll_interval)
+        seq = write_seq - 1 if latest else self.next_seq
+        if write_seq - seq > layout.slots - 1:
+            # overrun: the slot of seq (and maybe more) has been reused; jump to the newest frame
+            self.overruns += write_seq - 1 - seq
+            seq = write_seq - 1
+        while True:
+            slot = seq % layout.slots
+            before = int(layout.slot_meta[slot, 0])
+            timestamp = int(layout.slot_meta[slot, 1])
+            array = layout.frames[slot].copy() if copy else layout.frames[slot]
+            if before == 2 * seq + 2 and (not copy or int(layout.slot_meta[slot, 0]) == before):
+                break
+            # overwritten before or while reading: take the newest complete frame instead
+            newest = int(layout.write_seq[0]) - 1
+            self.overruns += newest - seq
+            seq = newest
+        self.next_seq = seq + 1
+        self.received += 1
+        self._report()
+        return BusFrame(seq, timestamp, array)
+
+    def frame_valid(self, frame):
+        """True if the slot of a zero-copy frame still holds that frame."""
+        return int(self.layout.slot_meta[frame.seq % self.layout.slots, 0]) == 2 * frame.seq + 2
+
+    def __iter__(self):
+        while True:
+            frame = self.next(timeout=1.0)
+            if frame is not None:
+                yield frame
+
+    def close(self):
+        if self._entry is not None:
+            self.layout.subscribers[self._entry] = 0
+        del self.layout
+        self.shm.close()
+
+
+def watch(name, seconds=None):
+    """Print the frame rate, lag and overruns of a bus once a second."""
+    subscriber = FrameBusSubscriber(name)
+    start = last = time.perf_counter()
+    received = 0
+    try:
+        while seconds is None or time.perf_counter() - start < seconds:
+            if subscriber.next(timeout=1.0) is not None:
+                received += 1
+            now = time.perf_counter()
+            if now - last >= 1.0:
+                print(f"{name}: {received / (now - last):.1f} fps, lag {subscriber.lag()} frames, "
+                      f"{subscriber.overruns} frames lost to overruns, shape {subscriber.frame_shape}")
+                received, last = 0, now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.close()
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 2:
+        print("usage: python FrameBus.py <bus name>")
+        sys.exit(1)
+    watch(sys.argv[1])
@@ -0,0 +1,369 @@
+"""
+Random access to the frames of a recording (output.mp4, mj_*.mp4, .h264) for review and annotation.
+
+cv2.VideoCapture re-decodes from the previous keyframe on every seek, so scrubbing back and forth
+decodes the same frames over and over. GopReader decodes whole GOPs (keyframe to keyframe) instead
+and keeps them in an LRU cache bounded in bytes:
+
+    - the keyframe index comes from ffprobe (packet flags, no decoding); without ffprobe the video
+      is split into blocks of `block_frames`, which still lets every block be decoded once
+    - decoding runs on one background thread with its own VideoCapture; a requested GOP jumps
+      ahead of prefetches, and after every access the next `prefetch` GOPs in the direction of
+      playback are queued, so scrubbing forwards or backwards mostly hits the cache
+    - raw elementary streams (.h264/.hevc) cannot be seeked by frame number; they are read
+      sequentially and reopened only when going backwards
+
+Frames are returned as read-only views into the cache (slices are copied into one array).
+
+Usage:
+    with GopReader("mj_12_00_00_m1.mp4", cache_bytes=1 << 30) as reader:
+        frame = reader[1234]
+        clip = reader[1000:1100]
+        print(reader.stats)
+
+Run this file with a video path to measure seek latency (--verify also checks every sampled frame
+against a sequential read).
+"""
+
+import bisect
+import concurrent.futures
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+
+import cv2
+import numpy as np
+
+RAW_STREAM_EXTENSIONS = (".h264", ".264", ".h265", ".265", ".hevc")
+
+
+def keyframe_index(path, ffprobe="ffprobe"):
+    """
+    Display-order frame numbers of the keyframes and the frame count, from ffprobe's packet list
+    (packets are demuxed, not decoded). Returns None when ffprobe is not available.
+    """
+    executable = shutil.which(ffprobe)
+    if executable is None:
+        return None
+    result = subprocess.run([executable, "-v", "error", "-select_streams", "v:0",
+                             "-show_entries", "packet=pts,flags", "-of", "csv=p=0", path],
+                            capture_output=True, text=True, check=True)
+    packets = []
+    for decode_order, line in enumerate(result.stdout.splitlines()):
+        pts, _, flags = line.strip().partition(",")
+        # raw streams have no timestamps; their packets are already in display order
+        packets.append((int(pts) if pts not in ("", "N/A") else decode_order, "K" in flags))
+    packets.sort()
+    return [i for i, (_, key) in enumerate(packets) if key], len(packets)
+
+
+class _Decoder:
+    """One VideoCapture that remembers its position, so contiguous reads never seek."""
+
+    def __init__(self, path, gray):
+        self.path = path
+        self.gray = gray
+        self.seekable = not path.lower().endswith(RAW_STREAM_EXTENSIONS)
+        self._cap = None
+        self._position = 0
+
+    def _open(self):
+        if self._cap is not None:
+            self._cap.release()
+        self._cap = cv2.VideoCapture(self.path)
+        if not self._cap.isOpened():
+            raise IOError(f"Could not open video file {self.path}")
+        self._position = 0
+
+    def read(self, start, stop):
+        if self._cap is None or (start < self._position and not self.seekable):
+            self._open()
+        if start != self._position and self.seekable:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            if int(self._cap.get(cv2.CAP_PROP_POS_FRAMES)) == start:
+                self._position = start
+            else:
+                # the container index lied (e.g. missing or wrong timestamps): decode sequentially
+                self.seekable = False
+                self._open()
+        while self._position < start:  # raw stream: skip forward without converting frames
+            if not self._cap.grab():
+                raise IOError(f"{self.path} ended at frame {self._position}, before frame {start}")
+            self._position += 1
+        frames = None
+        for i in range(stop - start):
+            ok, frame = self._cap.read()
+            if not ok:
+                frames = frames[:i] if frames is not None else None
+                break
+            if self.gray:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if frames is None:
+                frames = np.empty((stop - start,) + frame.shape, frame.dtype)
+            frames[i] = frame
+            self._position += 1
+        if frames is None:
+            raise IOError(f"Could not decode frames {start}-{stop} of {self.path}")
+        frames.flags.writeable = False
+        return frames
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class GopReader:
+    """
+    Parameters:
+        - path (str): video file
+        - cache_bytes (int): upper bound for the decoded GOPs kept in memory
+        - prefetch (int): GOPs decoded ahead in the direction of playback
+        - gray (bool): convert frames to single channel (a third of the cache for mono recordings)
+        - block_frames (int): GOP length assumed when ffprobe is not available
+        - ffprobe (str): ffprobe executable used for the keyframe index
+    """
+
+    def __init__(self, path, cache_bytes=512 * 1024 * 1024, prefetch=2, gray=False, block_frames=30,
+                 ffprobe="ffprobe"):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self.prefetch = prefetch
+        self._decoder = _Decoder(path, gray)
+
+        index = keyframe_index(path, ffprobe)
+        if index is not None:
+            keyframes, self.frame_count = index
+            if not keyframes or keyframes[0] != 0:
+                keyframes = [0] + keyframes
+        else:
+            self.frame_count = self._count_frames()
+            keyframes = list(range(0, self.frame_count, block_frames))
+        self.gop_starts = keyframes
+        self.keyframe_index_source = "ffprobe" if index is not None else "blocks"
+
+        self._cache = OrderedDict()   # gop -> frames, least recently used first
+        self._cached_bytes = 0
+        self._inflight = {}           # gop -> Future
+        self._queue = deque()         # gops to decode, demanded ones at the left
+        self._cond = threading.Condition()
+        self._last_frame = None
+        self._closed = False
+        self.stats = {"hits": 0, "misses": 0, "decoded_gops": 0, "decode_seconds": 0.0, "evicted_gops": 0}
+        self._thread = threading.Thread(target=self._run, name="gop-decoder", daemon=True)
+        self._thread.start()
+
+    def _count_frames(self):
+        cap = cv2.VideoCapture(self.path)
+        count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if count <= 0 or self._decoder.seekable is False:
+            # demux only (no decoding) to count the packets of streams without a reliable count
+            cap.set(cv2.CAP_PROP_FORMAT, -1)
+            count = 0
+            while cap.grab():
+                count += 1
+        cap.release()
+        return count
+
+    def __len__(self):
+        return self.frame_count
+
+    def gop_of(self, frame):
+        return bisect.bisect_right(self.gop_starts, frame) - 1
+
+    def _gop_range(self, gop):
+        stop = self.gop_starts[gop + 1] if gop + 1 < len(self.gop_starts) else self.frame_count
+        return self.gop_starts[gop], stop
+
+    # background decoding #####################################################################
+
+    def _schedule(self, gop, demand):
+        """Queue gop for decoding (at the front if demanded); returns its Future, None if cached."""
+        if gop in self._cache:
+            return None
+        future = self._inflight.get(gop)
+        if future is None:
+            future = self._inflight[gop] = concurrent.futures.Future()
+            self._queue.append(gop)
+        if demand and self._queue and self._queue[0] != gop and gop in self._queue:
+            self._queue.remove(gop)
+            self._queue.appendleft(gop)
+        self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    break
+                gop = self._queue.popleft()
+                future = self._inflight[gop]
+            start = time.perf_counter()
+            try:
+                frames = self._decoder.read(*self._gop_range(gop))
+            except Exception as e:
+                with self._cond:
+                    del self._inflight[gop]
+                future.set_exception(e)
+                continue
+            with self._cond:
+                self.stats["decoded_gops"] += 1
+                self.stats["decode_seconds"] += time.perf_counter() - start
+                self._store(gop, frames)
+                del self._inflight[gop]
+            future.set_result(frames)
+        self._decoder.close()
+        with self._cond:
+            for future in self._inflight.values():
+                future.cancel()
+
+    def _store(self, gop, frames):
+        self._cache[gop] = frames
+        self._cached_bytes += frames.nbytes
+        # never evict the GOP just decoded, even if it alone exceeds the budget
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._cached_bytes -= old.nbytes
+            self.stats["evicted_gops"] += 1
+
+    # access ##################################################################################
+
+    def _get_gops(self, gops):
+        """Frames of every GOP in gops, decoding missing ones in order; updates the LRU order."""
+        with self._cond:
+            if self._closed:
+                raise ValueError("Reader is closed")
+            results, futures = {}, {}
+            for gop in gops:
+                if gop in self._cache:
+                    self._cache.move_to_end(gop)
+                    results[gop] = self._cache[gop]
+                    self.stats["hits"] += 1
+                else:
+                    self.stats["misses"] += 1
+            for gop in reversed([g for g in gops if g not in results]):
+                futures[gop] = self._schedule(gop, demand=True)
+        for gop, future in futures.items():
+            results[gop] = future.result()
+        return results
+
+    def _prefetch_after(self, frame):
+        direction = -1 if self._last_frame is not None and frame < self._last_frame else 1
+        self._last_frame = frame
+        gop = self.gop_of(frame)
+        with self._cond:
+            for step in range(1, self.prefetch + 1):
+                target = gop + direction * step
+                if 0 <= target < len(self.gop_starts):
+                    self._schedule(target, demand=False)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            indices = range(*key.indices(self.frame_count))
+            if not indices:
+                return np.empty((0,), np.uint8)
+            gops = sorted({self.gop_of(i) for i in (indices[0], indices[-1])})
+            gops = list(range(gops[0], gops[-1] + 1))
+            if indices.step < 0:
+                gops.reverse()
+            gop_frames = self._get_gops(gops)
+            first = gop_frames[gops[0]]
+            out = np.empty((len(indices),) + first.shape[1:], first.dtype)
+            for n, i in enumerate(indices):
+                gop = self.gop_of(i)
+                out[n] = gop_frames[gop][i - self.gop_starts[gop]]
+            self._prefetch_after(indices[-1])
+            return out
+        index = int(key)
+        if index < 0:
+            index += self.frame_count
+        if not 0 <= index < self.frame_count:
+            raise IndexError(f"Frame {key} out of range for {self.frame_count} frames")
+        gop = self.gop_of(index)
+        frames = self._get_gops([gop])[gop]
+        self._prefetch_after(index)
+        offset = index - self.gop_starts[gop]
+        if offset >= len(frames):
+            raise IndexError(f"Frame {index} could not be decoded from {self.path}")
+        return frames[offset]
+
+    @property
+    def cached_bytes(self):
+        return self._cached_bytes
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def benchmark(path, seeks=50, seed=0, **kwargs):
+    """Latency of random seeks, then of stepping backwards frame by frame (annotation scrubbing)."""
+    rng = np.random.default_rng(seed)
+    with GopReader(path, **kwargs) as reader:
+        random_ms = []
+        for index in rng.integers(0, len(reader), seeks):
+            start = time.perf_counter()
+            reader[int(index)]
+            random_ms.append((time.perf_counter() - start) * 1000)
+        scrub_ms = []
+        for index in range(min(len(reader) - 1, 300), -1, -1):
+            start = time.perf_counter()
+            reader[index]
+            scrub_ms.append((time.perf_counter() - start) * 1000)
+        stats = dict(reader.stats)
+    return {"frames": len(reader), "gops": len(reader.gop_starts), "index": reader.keyframe_index_source,
+            "random_median_ms": float(np.median(random_ms)), "random_max_ms": float(np.max(random_ms)),
+            "scrub_median_ms": float(np.median(scrub_ms)), "scrub_max_ms": float(np.max(scrub_ms)), **stats}
+
+
+def verify(path, seeks=50, seed=0, **kwargs):
+    """
+    Compare reader[i] with the i-th frame of a plain sequential cv2 read, for random i.
+    Returns the indices that differ (empty when every seek landed on the right frame).
+    """
+    cap = cv2.VideoCapture(path)
+    expected = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        if kwargs.get("gray"):
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        expected.append(frame)
+    cap.release()
+    rng = np.random.default_rng(seed)
+    wrong = []
+    with GopReader(path, **kwargs) as reader:
+        for index in rng.integers(0, min(len(reader), len(expected)), seeks):
+            if not np.array_equal(reader[int(index)], expected[index]):
+                wrong.append(int(index))
+    return wrong
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Measure GopReader seek latency on a video file")
+    parser.add_argument("path")
+    parser.add_argument("--seeks", type=int, default=50)
+    parser.add_argument("--verify", action="store_true", help="check random frames against a sequential read")
+    args = parser.parse_args()
+    if args.verify:
+        wrong = verify(args.path, args.seeks)
+        print(f"{len(wrong)} of {args.seeks} frames differ from a sequential read" + (f": {wrong}" if wrong else ""))
+    for name, value in benchmark(args.path, args.seeks).items():
+        print(f"{name:>16}: {value:.2f}" if isinstance(value, float) else f"{name:>16}: {value}")
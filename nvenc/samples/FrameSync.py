@@ -0,0 +1,117 @@
+"""
+Groups frames from several cameras into matched sets by timestamp.
+
+Every camera pushes (timestamp, frame) pairs from its own acquisition thread. The synchroniser
+keeps a small reorder buffer per camera and emits a FrameSet as soon as every camera has a frame
+within `tolerance` of the others, so the added latency is bounded by the slowest camera's delivery
+and never by a timer. Frames that can no longer be matched are dropped and counted:
+
+    - unmatched: another camera has no frame close enough in time (dropped trigger, exposure skip)
+    - late:      the frame arrived after a newer set had already been emitted
+    - overflow:  the camera's reorder buffer was full because another camera stalled
+
+Timestamps must share one time base: a hardware trigger counter (tolerance 0), PTP synchronised
+camera clocks, or host receive time (time.perf_counter_ns()) with a tolerance of about half a
+frame interval.
+
+Usage:
+    sync = FrameSynchroniser([0, 1], tolerance=5_000_000)     # 5 ms, in timestamp units
+    # in each acquisition thread
+    for frame_set in sync.push(cam_index, timestamp, frame):
+        process(frame_set.frames[0], frame_set.frames[1])
+"""
+
+import threading
+from collections import deque, namedtuple
+
+# key: timestamp of the set (the newest of its frames), frames / timestamps: dicts by camera id
+FrameSet = namedtuple("FrameSet", ["key", "frames", "timestamps"])
+
+
+class FrameSynchroniser:
+    """
+    Parameters:
+        - camera_ids (iterable): ids the cameras will push with, e.g. indices or serial numbers
+        - tolerance (int/float): largest timestamp spread allowed inside one set
+        - max_buffer (int): frames held per camera before the oldest is dropped
+        - output (queue.Queue): optional queue every emitted FrameSet is also put on
+    """
+
+    def __init__(self, camera_ids, tolerance, max_buffer=8, output=None):
+        self.camera_ids = list(camera_ids)
+        if not self.camera_ids:
+            raise ValueError("FrameSynchroniser needs at least one camera")
+        self.tolerance = tolerance
+        self.max_buffer = max_buffer
+        self.output = output
+        self._buffers = {cam_id: deque() for cam_id in self.camera_ids}
+        self._last_key = None
+        self._lock = threading.Lock()
+        self.stats = {"matched": 0, "unmatched": 0, "late": 0, "overflow": 0}
+        self.per_camera = {cam_id: {"unmatched": 0, "late": 0, "overflow": 0} for cam_id in self.camera_ids}
+
+    def _drop(self, cam_id, reason):
+        self.stats[reason] += 1
+        self.per_camera[cam_id][reason] += 1
+
+    def push(self, cam_id, timestamp, frame):
+        """Add one frame and return the list of FrameSets (usually zero or one) it completed."""
+        with self._lock:
+            buffer = self._buffers[cam_id]
+            if self._last_key is not None and timestamp < self._last_key - self.tolerance:
+                self._drop(cam_id, "late")
+                return []
+            if buffer and timestamp < buffer[-1][0]:
+                # out of order within one camera, keep the buffer sorted
+                index = next(i for i, (ts, _) in enumerate(buffer) if ts > timestamp)
+                buffer.insert(index, (timestamp, frame))
+            else:
+                buffer.append((timestamp, frame))
+            if len(buffer) > self.max_buffer:
+                buffer.popleft()
+                self._drop(cam_id, "overflow")
+            sets = self._match()
+
+        if self.output is not None:
+            for frame_set in sets:
+                self.output.put(frame_set)
+        return sets
+
+    def _match(self):
+        sets = []
+        buffers = self._buffers
+        while all(buffers.values()):
+            newest = max(buffer[0][0] for buffer in buffers.values())
+            # heads too old to ever pair with the newest head are unmatched
+            stale = [cam_id for cam_id, buffer in buffers.items() if buffer[0][0] < newest - self.tolerance]
+            if stale:
+                for cam_id in stale:
+                    buffers[cam_id].popleft()
+                    self._drop(cam_id, "unmatched")
+                continue
+            heads = {cam_id: buffer.popleft() for cam_id, buffer in buffers.items()}
+            sets.append(FrameSet(newest,
+                                 {cam_id: head[1] for cam_id, head in heads.items()},
+                                 {cam_id: head[0] for cam_id, head in heads.items()}))
+            self._last_key = newest
+            self.stats["matched"] += 1
+        return sets
+
+    def pending(self):
+        """Number of frames currently waiting in the reorder buffers, by camera."""
+        with self._lock:
+            return {cam_id: len(buffer) for cam_id, buffer in self._buffers.items()}
+
+    def close(self):
+        """Drop everything still buffered (counted as unmatched) and signal the output queue."""
+        with self._lock:
+            for cam_id, buffer in self._buffers.items():
+                while buffer:
+                    buffer.popleft()
+                    self._drop(cam_id, "unmatched")
+        if self.output is not None:
+            self.output.put(None)
+
+    def report(self):
+        return (f"matched sets: {self.stats['matched']}, unmatched: {self.stats['unmatched']}, "
+                f"late: {self.stats['late']}, overflow: {self.stats['overflow']}")
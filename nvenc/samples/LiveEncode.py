@@ -1,66 +1,20 @@
 import PyNvVideoCodec as nvc
-import numpy as np
 import json
+import time
+from collections import deque
 import argparse
 from pathlib import Path
 import PySpin
 import cv2
 from PIL import Image
 
-def GetFrameSize(width, height, surface_format):
-    '''
-    Explanation of the width and height calcalations for different surface formats:
-    
-    YUV420 (also known as YUV 4:2:0):
-
-    Calculation: width * height * 3 / 2
-    Explanation: This is a chroma subsampled format, meaning that the color information 
-    (chroma) is stored at a lower resolution than the brightness (luma). Specifically, 
-    the luma (Y) takes up width * height bytes, and the chroma (U and V) takes up half 
-    that amount (width * height / 2), making the total size 1.5 * width * height.
-
-    ARGB and ABGR:
-
-    Calculation: width * height * 4
-    Explanation: In these formats, each pixel contains 4 bytes of information: one byte
-    each for alpha (transparency), red, green, and blue. Since each pixel has 4 components 
-    and each component is 1 byte, the total size is 4 * width * height.
-
-    YUV444:
-
-    Calculation: width * height * 3
-    Explanation: In YUV 4:4:4, there’s no chroma subsampling. Each pixel has 3 components
-    (Y, U, and V), each taking up 1 byte, so the size is 3 * width * height.
-
-    P010:
+from SurfacePool import SurfacePool
+from Pipeline import Pipeline, Stage
+from FormatNegotiation import HostConverter, negotiate_camera
+from StageTimer import StageTimer
+from NetworkStream import split_access_units
 
-    Calculation: width * height * 3 / 2 * 2
-    Explanation: This is a 10-bit format, but typically stored in 16-bit words for each 
-    Y, U, and V component. The structure is similar to YUV420, but because it's 10-bit, each pixel takes more space. To account for this, you multiply the YUV420 size by 2, making the final size 1.5 * 2 * width * height.
-
-    YUV444_16BIT:
-
-    Calculation: width * height * 3 * 2
-    Explanation: This is YUV444, but with 16 bits (2 bytes) per component (Y, U, and V).
-    Since each component is now 2 bytes, you multiply the usual width * height * 3 by 2,
-    making the total 6 * width * height.
-    
-    '''
-    
-    frame_size = int(width * height * 3 / 2)
-    if surface_format == "ARGB" or surface_format == "ABGR":
-        frame_size = width * height * 4
-    if surface_format == "YUV444":
-        frame_size = width * height * 3
-    if surface_format == "YUV420":
-        frame_size = int(width * height * 3 / 2)
-    if surface_format == "P010":
-        frame_size = int(width * height * 3 / 2 * 2)
-    if surface_format == "YUV444_16BIT":
-        frame_size = int(width * height * 3 * 2)
-    return frame_size
-
-def initialize_camera():
+def initialize_camera(begin_acquisition=True):
     system = PySpin.System.GetInstance()
     cam_list = system.GetCameras()
     if cam_list.GetSize() == 0:
@@ -68,11 +22,23 @@ def initialize_camera():
         return None
     cam = cam_list[0]
     cam.Init()
-    cam.BeginAcquisition()
+    if begin_acquisition:  # PixelFormat can only be changed before acquisition starts
+        cam.BeginAcquisition()
     return cam, system
 
-def stream_frames(cam, frame_count, width, height, fmt):
-    frame_size = GetFrameSize(width, height, fmt)
+def stream_frames(cam, frame_count, width, height, fmt, pixel_format="Mono8"):
+    """
+    Capture frame_count images into a preallocated pool of host surfaces.
+
+    Each image is converted from the camera's pixel_format straight into its surface by a
+    FormatNegotiation.HostConverter. For mono images only the luma plane is written; the chroma
+    planes are set to neutral grey (128, or 0x8000 for 16 bit surfaces) once when the pool is
+    created, which is exactly what a GRAY -> BGR -> YUV conversion would produce, without
+    allocating anything per frame.
+    """
+    pool = SurfacePool(width, height, fmt, count=frame_count)
+    convert = HostConverter(pixel_format, fmt, width, height)
+    convert.prepare(pool.buffer)
     frames = []
 
     try:
@@ -80,37 +46,122 @@ def stream_frames(cam, frame_count, width, height, fmt):
             image_result = cam.GetNextImage()
             if image_result.IsIncomplete():
                 print("Image incomplete with image status %d..." % image_result.GetImageStatus())
+                image_result.Release()
                 continue
-            
-            image_data = image_result.GetNDArray()
-            # convert to three channel to grayscale
-            image_data = cv2.cvtColor(image_data, cv2.COLOR_GRAY2BGR)
-            # convert to grayscale to yuv
-            image_data = cv2.cvtColor(image_data, cv2.COLOR_BGR2YUV)
-            # split the yuv image
-            y, u, v = cv2.split(image_data)
-            frames.append(y.flatten())  # Flatten the colour image data to 1D array
+
+            surface = pool.acquire()
+            convert(image_result.GetData(), surface.data)
+            frames.append(surface)
             image_result.Release() # Release the image buffer
 
     except Exception as e:
         print(f"Error capturing frames: {e}")
 
-    return np.array(frames)
+    return frames
 
-def encode(gpuID, frames: np.array , enc_file_path, width, height, fmt, use_cpu_memory, config_params):
-    frame_size = GetFrameSize(width, height, fmt)
+def encode(gpuID, frames, enc_file_path, width, height, fmt, use_cpu_memory, config_params):
     with open(enc_file_path, "wb") as enc_file:
         nvenc = nvc.CreateEncoder(width, height, fmt, use_cpu_memory, **config_params)  # create encoder object
-        for frame in frames:
-            if frame.size != 0:
-                bitstream = nvenc.Encode(frame)  # encode frame one by one
-                bitstream = bytearray(bitstream)
-                enc_file.write(bitstream)
+        for surface in frames:
+            bitstream = nvenc.Encode(surface.data)  # encode frame one by one
+            bitstream = bytearray(bitstream)
+            enc_file.write(bitstream)
+            surface.pool.release(surface)
         print("Flushing encoder queue")
         bitstream = nvenc.EndEncode()  # flush encoder queue
         bitstream = bytearray(bitstream)
         enc_file.write(bitstream)
 
+def stream_encode(cam, frame_count, enc_file_path, width, height, fmt, config_params, pipeline_config=None,
+                  pixel_format="Mono8", stream=None, timing=None):
+    """
+    Grab, encode and write concurrently instead of capturing everything first.
+
+    grab (camera thread) -> encode (one thread, NVENC sessions are not thread safe) -> write.
+    Stage sizes can be tuned through pipeline_config / PIPELINE_CONFIG, see Pipeline.py.
+    If stream (a NetworkStream.StreamSink) is given, every packet is also sent to the network
+    together with the time its frame was grabbed.
+    Time spent in GetNextImage, the conversion, Encode and the write is recorded per frame into
+    timing (a StageTimer, one is created if None) and its report is printed at the end.
+    """
+    nvenc = nvc.CreateEncoder(width, height, fmt, True, **config_params)
+    grabbed = [0]
+    capture_times = deque()  # grab time of every frame not yet out of the encoder, in encode order
+    codec = config_params.get("codec", "h264")
+    if timing is None:
+        timing = StageTimer(("grab", "convert", "encode", "write"))
+    GRAB, CONVERT, ENCODE, WRITE = (timing.index[name] for name in ("grab", "convert", "encode", "write"))
+
+    def grab():
+        while grabbed[0] < frame_count:
+            t = time.perf_counter_ns()
+            image_result = cam.GetNextImage()
+            timing.record(GRAB, t)
+            capture_ns = time.time_ns()
+            if image_result.IsIncomplete():
+                print("Image incomplete with image status %d..." % image_result.GetImageStatus())
+                image_result.Release()
+                continue
+            surface = pool.acquire()
+            t = time.perf_counter_ns()  # waiting for a free surface is back-pressure, not conversion
+            convert(image_result.GetData(), surface.data)
+            timing.record(CONVERT, t)
+            image_result.Release()
+            grabbed[0] += 1
+            capture_times.append(capture_ns)
+            return surface
+        return None
+
+    def access_units(bitstream):
+        # with B-frames or lookahead the first Encode calls return nothing and later calls (and
+        # EndEncode) can return several frames; every access unit is the oldest frame still inside
+        # the encoder, so it gets that frame's grab time
+        if not bitstream:
+            return []
+        return [(unit, capture_times.popleft() if capture_times else time.time_ns())
+                for unit in split_access_units(bitstream, codec)]
+
+    def encode_surface(surface):
+        t = time.perf_counter_ns()
+        bitstream = bytearray(nvenc.Encode(surface.data))
+        timing.record(ENCODE, t)
+        pool.release(surface)
+        return access_units(bitstream)
+
+    def write(packets):
+        if not packets:
+            return  # frame still inside the encoder
+        t = time.perf_counter_ns()
+        enc_file.write(b"".join(unit for unit, _ in packets))
+        timing.record(WRITE, t)
+        if stream is not None:
+            for unit, capture_ns in packets:
+                stream.send(unit, capture_ns)  # never blocks, congestion is handled per receiver
+
+    pipeline = Pipeline(grab, [Stage("encode", encode_surface),
+                               Stage("write", write)], config=pipeline_config)
+    encode_stage = pipeline.stage("encode")
+    if encode_stage.workers != 1 or encode_stage.mode != "thread":
+        # one NVENC session, and capture times are matched to packets in submission order
+        raise ValueError(f"The encode stage must run on exactly one thread, got {encode_stage!r}")
+    # a surface is in flight from grab until Encode has copied it: one held by grab while it waits
+    # to enqueue, every slot of the encode queue and the one being encoded (queue size after overrides)
+    pool = SurfacePool(width, height, fmt, count=1 + encode_stage.queue_size + 1)
+    convert = HostConverter(pixel_format, fmt, width, height)
+    convert.prepare(pool.buffer)
+
+    with open(enc_file_path, "wb") as enc_file:
+        try:
+            pipeline.run()
+        except KeyboardInterrupt:
+            print("Interrupted, flushing what was encoded so far")
+        print("Flushing encoder queue")
+        # the frames still inside the encoder come out together, one grab time per access unit
+        write(access_units(bytearray(nvenc.EndEncode())))
+        capture_times.clear()
+    print(pipeline.report())
+    print(timing.report())
+
 def sample_usage():
     output_file_path = "C:/Users/alifa/Documents/aquire-video/test_files/streamed_video.h264"
     
@@ -118,28 +169,32 @@ def sample_usage():
     total_num_frames = 1000
     
     # Initialize camera
-    cam, system = initialize_camera()
+    cam, system = initialize_camera(begin_acquisition=False)
     if not cam:
         return
 
-    # Camera settings
-    format = "NV12"  # NV12, YUV444, 
+    # Camera settings: choose the camera PixelFormat / surface format pair with the least host work
+    bit_depth = 8  # 10 or 12 records packed mono formats into P010 / YUV444_16BIT surfaces
+    codec = "hevc" if bit_depth > 8 else "h264"  # high bit depth encoding is HEVC only
+    plan = negotiate_camera(cam, codec, bit_depth=bit_depth)  # sets PixelFormat on the camera
+    print(plan.report())
+    cam.BeginAcquisition()
+    format = plan.surface_format
+    config_params = {"codec": codec}
+    pixel_format = plan.camera_format
     width  = cam.Width.GetValue()
     height = cam.Height.GetValue()
     
-    # Capture frames
-    frames = stream_frames(cam, total_num_frames, width, height, format)
-
-    # Encode captured frames
-    encode(
-        0,                      
-        frames,                  # np.array of frames 
+    # Capture and encode frames concurrently
+    stream_encode(
+        cam,
+        total_num_frames,
         output_file_path,        # Output file path
         width,                   # pixel width
         height,                  # pixel height
-        format,                  # 
-        use_cpu_memory=True, 
-        config_params={}
+        format,                  #
+        config_params=config_params,
+        pixel_format=pixel_format
     )
 
     # print(f"Encoding {len(frames)} frames to {enc_file_path}")
@@ -0,0 +1,304 @@
+"""
+Capacity planning for a recording PC: how many cameras, at which resolution and frame rate, can
+it acquire, encode and write without losing frames, and what gives out first?
+
+Every step of the ramp runs the acquisition pipeline of run_multiple_cameras, one thread per
+camera, on simulated cameras: ReplayCameras playing a SyntheticVideo clip in real time through
+10 OldestFirst stream buffers, so a slow pipeline loses frames the way a real camera would.
+Each camera thread runs
+    grab      get_next() on its virtual camera
+    convert   FormatNegotiation.HostConverter, camera pixel format -> encoder surface
+    encode    one NVENC session per camera (backend "nvenc"), or JPEG of the luma plane as a CPU
+              stand-in when PyNvVideoCodec is not available (backend "cpu")
+    write     the packets (store "encoded") or the whole surfaces (store "raw", like a lossless
+              recording) to one file per camera, fsynced once a second so the disk is measured,
+              not the page cache
+timed by a StageTimer. For every resolution and frame rate the camera count goes up until a step
+fails: a frame is lost, the p99 latency from frame arrival to written exceeds the budget, or an
+encoder session cannot be opened. The limiting stage of a failed step is
+    encoder sessions     CreateEncoder failed (consumer GPUs allow only a few sessions)
+    CPU                  the process used >= 85 % of all cores, or convert / CPU encode was busiest
+    CPU (GIL)            about one core in use on a multi-core machine: Python threads serialised
+    encoder throughput   NVENC encode was the busiest stage
+    disk bandwidth       write was the busiest stage (the disk's measured MB/s is in the report)
+
+The JSON report (default loadramp_<host>.json) holds the host, the settings and seeds, every step
+and, per resolution and frame rate, the most cameras that passed; running it again with the same
+settings repeats the same ramp.
+
+Usage:
+    python LoadRamp.py --resolutions 1280x720 1920x1080 --fps 30 60 --max_cameras 8 --seconds 10
+
+    report = ramp([(1920, 1080)], [60.0], max_cameras=8, seconds=10)
+    print(summary(report))
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from FormatNegotiation import HostConverter
+from ReplaySource import ReplayClip, virtual_cameras
+from StageTimer import StageTimer
+from SurfacePool import SurfacePool
+from SyntheticVideo import SyntheticVideo
+
+STAGES = ("grab", "convert", "encode", "write")
+CPU_SATURATED = 0.85      # share of all cores
+BUSY_STAGE = 0.5          # share of a camera thread's time that makes a stage the suspect
+
+
+def measure_disk(directory, megabytes=128, block_bytes=4 << 20):
+    """Sequential write bandwidth of the disk holding directory (MB/s, fsynced)."""
+    path = os.path.join(directory, "loadramp_disk_probe.bin")
+    block = np.random.default_rng(0).integers(0, 256, block_bytes, np.uint8).tobytes()
+    start = time.perf_counter()
+    with open(path, "wb") as probe:
+        for _ in range(max(1, (megabytes << 20) // block_bytes)):
+            probe.write(block)
+        probe.flush()
+        os.fsync(probe.fileno())
+    seconds = time.perf_counter() - start
+    os.remove(path)
+    return megabytes / seconds
+
+
+def _encoder(backend, width, height, surface_format, codec):
+    """(encode(surface) -> bytes, flush() -> bytes) for one camera."""
+    if backend == "nvenc":
+        import PyNvVideoCodec as nvc
+        session = nvc.CreateEncoder(width, height, surface_format, True, codec=codec)
+        return (lambda surface: bytearray(session.Encode(surface.data)),
+                lambda: bytearray(session.EndEncode()))
+    parameters = [cv2.IMWRITE_JPEG_QUALITY, 85]
+    return (lambda surface: cv2.imencode(".jpg", surface.planes[0], parameters)[1],
+            lambda: b"")
+
+
+def _camera_thread(camera, convert, pool, encode, flush, output, store, timing, latencies, errors):
+    GRAB, CONVERT, ENCODE, WRITE = (timing.index[name] for name in STAGES)
+    surface = pool.acquire()
+    next_sync = time.perf_counter() + 1.0
+    try:
+        with open(output, "wb") as writer:
+            while True:
+                t = time.perf_counter_ns()
+                frame = camera.get_next()
+                if frame is None:
+                    break
+                t = timing.record(GRAB, t, frame.index)
+                convert(frame.data, surface.data)
+                t = timing.record(CONVERT, t, frame.index)
+                packet = encode(surface)
+                t = timing.record(ENCODE, t, frame.index)
+                writer.write(surface.data if store == "raw" else packet)
+                if time.perf_counter() >= next_sync:
+                    writer.flush()
+                    os.fsync(writer.fileno())
+                    next_sync += 1.0
+                t = timing.record(WRITE, t, frame.index)
+                latencies.append(t - frame.timestamp_ns)
+            writer.write(flush())
+    except Exception as ex:
+        errors.append(f"{camera.name}: {ex!r}")
+        camera.stop()
+    finally:
+        pool.release(surface)
+
+
+def _limiting_stage(step, backend):
+    if step["session_error"]:
+        return "encoder sessions"
+    cores = step["cpu_cores"]
+    if step["cpu_core_seconds_per_second"] >= CPU_SATURATED * cores:
+        return "CPU"
+    busy = {name: stage["busy_per_camera"] for name, stage in step["stages"].items() if name != "grab"}
+    busiest = max(busy, key=busy.get)
+    if cores > 1 and 0.85 <= step["cpu_core_seconds_per_second"] <= 1.15 and busy[busiest] >= BUSY_STAGE:
+        return "CPU (GIL)"
+    if busiest == "write":
+        return "disk bandwidth"
+    if busiest == "encode" and backend == "nvenc":
+        return "encoder throughput"
+    return "CPU"
+
+
+def run_step(clip, width, height, fps, cameras, seconds, budget_ms, camera_format="Mono8", surface_format="NV12",
+             backend="cpu", codec="h264", store="encoded", workdir=None):
+    """One configuration: returns the step dict with passed, lost frames, latency and stage utilisation."""
+    workdir = tempfile.mkdtemp(prefix="loadramp_", dir=workdir)
+    timing = StageTimer(STAGES)
+    step = {"width": width, "height": height, "fps": fps, "cameras": cameras, "session_error": None}
+    replays = virtual_cameras(clip, cameras, rate=1.0, count=round(fps * seconds), loop=True, log=lambda message: None)
+    pipelines = []
+    try:
+        for camera in replays:
+            pool = SurfacePool(width, height, surface_format, count=1)
+            convert = HostConverter(camera_format, surface_format, width, height, threads=1)
+            convert.prepare(pool.buffer)
+            try:
+                encode, flush = _encoder(backend, width, height, surface_format, codec)
+            except Exception as ex:  # e.g. NV_ENC_ERR_OUT_OF_MEMORY once the session limit is reached
+                step["session_error"] = f"encoder {len(pipelines) + 1}: {ex!r}"
+                convert.close()
+                break
+            pipelines.append((camera, convert, pool, encode, flush))
+        if step["session_error"] is None:
+            latencies = [[] for _ in pipelines]
+            errors = []
+            threads = [threading.Thread(target=_camera_thread, name=camera.name,
+                                        args=(camera, convert, pool, encode, flush,
+                                              os.path.join(workdir, f"{camera.name}.bin"), store, timing,
+                                              latencies[i], errors))
+                       for i, (camera, convert, pool, encode, flush) in enumerate(pipelines)]
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            for camera, thread in zip(replays, threads):
+                camera.start()
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            written = sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir))
+            latency = np.concatenate([np.asarray(values, np.float64) for values in latencies]) / 1e6
+            snapshot = timing.snapshot()
+            step.update(
+                lost=sum(camera.stats["lost"] for camera in replays),
+                delivered=sum(camera.stats["delivered"] for camera in replays),
+                replay_late=sum(camera.stats["source_late"] for camera in replays),
+                latency_p50_ms=float(np.percentile(latency, 50)) if len(latency) else None,
+                latency_p99_ms=float(np.percentile(latency, 99)) if len(latency) else None,
+                cpu_cores=os.cpu_count(),
+                cpu_core_seconds_per_second=cpu / wall,
+                write_MBps=written / wall / 1e6,
+                errors=errors,
+                stages={name: {"p99_ms": stage["p99_ms"], "busy_per_camera": stage["utilisation"] / cameras}
+                        for name, stage in snapshot["stages"].items()})
+    finally:
+        for camera in replays:
+            camera.stop()
+        for _, convert, _, _, _ in pipelines:
+            convert.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if step["session_error"] is not None:
+        step.update(passed=False, limiting="encoder sessions")
+        return step
+    failures = []
+    if step["lost"]:
+        failures.append(f"{step['lost']} frames lost")
+    if step["latency_p99_ms"] is None or step["latency_p99_ms"] > budget_ms:
+        failures.append(f"p99 latency {step['latency_p99_ms']} ms over {budget_ms} ms")
+    if step["errors"]:
+        failures.append("; ".join(step["errors"]))
+    step["passed"] = not failures
+    step["failures"] = failures
+    step["limiting"] = None if step["passed"] else _limiting_stage(step, backend)
+    return step
+
+
+def ramp(resolutions, frame_rates, max_cameras=8, seconds=5.0, budget_ms=100.0, camera_format="Mono8",
+         surface_format="NV12", backend=None, codec="h264", store="encoded", workdir=None, seed=0,
+         clip_frames=30, log=print):
+    """Ramp every resolution / frame rate from one camera up to the first failing step."""
+    if backend is None:
+        try:
+            import PyNvVideoCodec  # noqa: F401
+            backend = "nvenc"
+        except ImportError:
+            backend = "cpu"
+    settings = dict(resolutions=[list(resolution) for resolution in resolutions], frame_rates=list(frame_rates),
+                    max_cameras=max_cameras, seconds=seconds, budget_ms=budget_ms, camera_format=camera_format,
+                    surface_format=surface_format, backend=backend, codec=codec, store=store, seed=seed,
+                    clip_frames=clip_frames)
+    disk_directory = workdir or tempfile.gettempdir()
+    report = {"host": platform.node(), "platform": platform.platform(), "processor": platform.processor(),
+              "cpu_cores": os.cpu_count(), "python": sys.version.split()[0],
+              "date": datetime.datetime.now().isoformat(timespec="seconds"),
+              "disk_MBps": measure_disk(disk_directory), "settings": settings, "steps": [], "max_sustainable": []}
+    session_limit = None
+    for width, height in resolutions:
+        for fps in frame_rates:
+            video = SyntheticVideo(width, height, camera_format, fps=fps, seed=seed)
+            clip = ReplayClip(video.clip(clip_frames), np.arange(clip_frames) * round(1e9 / fps))
+            video.close()
+            best, limiting = 0, None
+            for cameras in range(1, max_cameras + 1):
+                if session_limit is not None and cameras > session_limit:
+                    limiting = "encoder sessions"
+                    break
+                step = run_step(clip, width, height, fps, cameras, seconds, budget_ms, camera_format, surface_format,
+                                backend, codec, store, workdir)
+                report["steps"].append(step)
+                log(_step_line(step))
+                if not step["passed"]:
+                    limiting = step["limiting"]
+                    if limiting == "encoder sessions":
+                        session_limit = cameras - 1
+                    break
+                best = cameras
+            report["max_sustainable"].append({"width": width, "height": height, "fps": fps, "cameras": best,
+                                              "limiting": limiting,  # None: max_cameras all passed
+                                              "megapixels_per_second": best * width * height * fps / 1e6})
+    passed = [entry for entry in report["max_sustainable"] if entry["cameras"]]
+    report["best"] = max(passed, key=lambda entry: entry["megapixels_per_second"]) if passed else None
+    return report
+
+
+def _step_line(step):
+    line = f"{step['cameras']:>2} x {step['width']}x{step['height']} @ {step['fps']:g} fps: "
+    if step["session_error"]:
+        return line + "encoder session failed - " + step["session_error"]
+    line += (f"{'ok  ' if step['passed'] else 'FAIL'} lost {step['lost']}, latency p99 {step['latency_p99_ms']:.1f} ms, "
+             f"CPU {step['cpu_core_seconds_per_second']:.2f} cores, write {step['write_MBps']:.1f} MB/s, busy "
+             + " ".join(f"{name} {stage['busy_per_camera']:.0%}" for name, stage in step["stages"].items()
+                        if name != "grab"))  # grab is mostly waiting for the next frame
+    return line + (f" -> limited by {step['limiting']}" if step["limiting"] else "")
+
+
+def summary(report):
+    lines = [f"{report['host']}: {report['cpu_cores']} cores, disk {report['disk_MBps']:.0f} MB/s, "
+             f"backend {report['settings']['backend']}, store {report['settings']['store']}"]
+    for entry in report["max_sustainable"]:
+        limit = f"limited by {entry['limiting']}" if entry["limiting"] else "no limit reached"
+        lines.append(f"  {entry['width']}x{entry['height']} @ {entry['fps']:g} fps: {entry['cameras']} camera(s), {limit}")
+    best = report["best"]
+    if best:
+        lines.append(f"  highest sustained load: {best['cameras']} x {best['width']}x{best['height']} @ "
+                     f"{best['fps']:g} fps ({best['megapixels_per_second']:.0f} MP/s)")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Find the most cameras this PC can acquire, encode and write without losses")
+    parser.add_argument("--resolutions", nargs="+", default=["640x480", "1280x720", "1920x1080"], help="widthxheight")
+    parser.add_argument("--fps", type=float, nargs="+", default=[30.0, 60.0])
+    parser.add_argument("--max_cameras", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of every step")
+    parser.add_argument("--budget_ms", type=float, default=100.0, help="p99 arrival-to-written latency budget")
+    parser.add_argument("--camera_format", default="Mono8", help="Mono8 or BayerRG8/BG8/GB8/GR8")
+    parser.add_argument("--surface_format", default="NV12")
+    parser.add_argument("--backend", choices=("nvenc", "cpu"), default=None, help="default: nvenc if available")
+    parser.add_argument("--codec", default="h264")
+    parser.add_argument("--store", choices=("encoded", "raw"), default="encoded")
+    parser.add_argument("--workdir", default=None, help="directory on the recording disk (default: temp)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default=None, help="JSON report (default loadramp_<host>.json)")
+    args = parser.parse_args()
+    resolutions = [tuple(int(value) for value in resolution.split("x")) for resolution in args.resolutions]
+    report = ramp(resolutions, args.fps, args.max_cameras, args.seconds, args.budget_ms, args.camera_format,
+                  args.surface_format, args.backend, args.codec, args.store, args.workdir, args.seed)
+    output = args.output or f"loadramp_{report['host'] or 'host'}.json"
+    with open(output, "w") as jsonFile:
+        json.dump(report, jsonFile, indent=2)
+    print(summary(report))
+    print(f"report written to {output}")
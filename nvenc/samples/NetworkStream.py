@@ -0,0 +1,563 @@
+"""
+Low-latency network output for encoded H.264 / HEVC: the bitstream returned by nvenc.Encode() is
+sent as RTP (RFC 6184 / RFC 7798 packetization) to any number of receivers, over UDP or over TCP
+with RFC 4571 framing (2 byte length before every RTP packet), so a control room PC can watch a
+rig with ffplay / VLC (see sdp()) or with RtpReceiver below.
+
+StreamSink.send() never blocks the encoder: an access unit is split into NAL units and RTP
+payloads once, then offered to every receiver's own bounded queue, and a sender thread per
+receiver does the socket I/O. When a receiver falls behind (queue full in frames or bytes):
+
+    1. non-reference frames (H.264 nal_ref_idc 0, HEVC *_N slice types) are dropped first, queued
+       ones before the new one
+    2. if a reference frame still does not fit, it is dropped and everything up to the next
+       keyframe is skipped, since nothing in between can be decoded; a keyframe that does not
+       fit replaces the whole queue
+
+Every RTP packet carries the capture time of its frame (wall clock ns, RFC 8285 one-byte header
+extension, id 1), so the receiver measures glass-to-receiver latency directly; across machines
+that needs NTP-synchronised clocks.
+
+Usage:
+    sink = StreamSink("h264")
+    sink.add_udp("192.168.1.20", 5004)   # and/or sink.listen_tcp(5004)
+    sink.send(bytearray(nvenc.Encode(surface.data)), capture_ns)
+    ...
+    sink.close()
+
+Run this file for a loopback test with a synthetic stream; it prints the latency distribution.
+"""
+
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+RTP_PAYLOAD_TYPE = 96
+RTP_CLOCK_RATE = 90000
+MAX_PAYLOAD = 1400               # keeps every UDP datagram below a 1500 byte Ethernet MTU
+_EXTENSION_ID = 1                # header extension element carrying the capture time
+
+
+# bitstream parsing ###########################################################################
+
+def split_nal_units(data):
+    """NAL units (without start codes) of an Annex-B access unit."""
+    data = bytes(data)
+    starts = []
+    i = data.find(b"\x00\x00\x01")
+    while i >= 0:
+        starts.append(i + 3)
+        i = data.find(b"\x00\x00\x01", i + 3)
+    units = []
+    for n, start in enumerate(starts):
+        end = starts[n + 1] - 3 if n + 1 < len(starts) else len(data)
+        if n + 1 < len(starts) and data[end - 1] == 0:
+            end -= 1  # 4 byte start code of the next unit
+        if end > start:
+            units.append(data[start:end])
+    return units
+
+
+def _starts_access_unit(nal, codec, after_vcl):
+    """Whether this NAL unit begins a new access unit, given that the current one has a picture."""
+    if not after_vcl:
+        return False
+    if codec == "h264":
+        nal_type = nal[0] & 0x1F
+        if 1 <= nal_type <= 5:
+            return len(nal) > 1 and bool(nal[1] & 0x80)  # first_mb_in_slice == 0: a new picture
+        return nal_type in (6, 7, 8, 9) or 14 <= nal_type <= 18
+    nal_type = (nal[0] >> 1) & 0x3F
+    if nal_type < 32:
+        return len(nal) > 2 and bool(nal[2] & 0x80)  # first_slice_segment_in_pic_flag
+    return 32 <= nal_type <= 35 or nal_type == 39 or 41 <= nal_type <= 44 or 48 <= nal_type <= 55
+
+
+def _split_temporal_units(data):
+    """AV1 low overhead OBU stream split at its temporal delimiters."""
+    units, begin, i = [], 0, 0
+    while i < len(data):
+        header = data[i]
+        if not header & 0x02:
+            raise ValueError("AV1 OBUs without a size field cannot be split")
+        position = i + 1 + ((header >> 2) & 1)  # optional extension byte
+        size, shift = 0, 0
+        while True:  # leb128
+            byte = data[position]
+            position += 1
+            size |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        if (header >> 3) & 0x0F == 2 and i > begin:  # OBU_TEMPORAL_DELIMITER
+            units.append(data[begin:i])
+            begin = i
+        i = position + size
+    if begin < len(data):
+        units.append(data[begin:])
+    return units
+
+
+def split_access_units(data, codec):
+    """
+    Split encoder output holding one or more frames into access units (Annex-B for h264 / hevc,
+    temporal units for av1), each with its start codes / OBU headers, in stream order.
+    """
+    data = bytes(data)
+    codec = codec.lower()
+    if codec == "av1":
+        return _split_temporal_units(data)
+    if codec not in ("h264", "hevc"):
+        raise ValueError(f"Cannot split {codec} streams into access units")
+    units, begin, after_vcl = [], None, False
+    i = data.find(b"\x00\x00\x01")
+    while i >= 0:
+        start = i - 1 if i > 0 and data[i - 1] == 0 else i  # 4 byte start code
+        nal = data[i + 3:i + 6]
+        if nal:
+            if begin is None:
+                begin = 0
+            elif _starts_access_unit(nal, codec, after_vcl):
+                units.append(data[begin:start])
+                begin, after_vcl = start, False
+            nal_type = nal[0] & 0x1F if codec == "h264" else (nal[0] >> 1) & 0x3F
+            if (1 <= nal_type <= 5) if codec == "h264" else nal_type < 32:
+                after_vcl = True
+        i = data.find(b"\x00\x00\x01", i + 3)
+    if begin is not None:
+        units.append(data[begin:])
+    return units
+
+
+def classify(nal_units, codec):
+    """(is_keyframe, is_reference) of an access unit."""
+    keyframe, reference = False, False
+    for nal in nal_units:
+        if codec == "h264":
+            nal_type = nal[0] & 0x1F
+            if nal_type == 5:
+                keyframe = True
+            if 1 <= nal_type <= 5 and nal[0] & 0x60:
+                reference = True
+        else:
+            nal_type = (nal[0] >> 1) & 0x3F
+            if 16 <= nal_type <= 21:
+                keyframe = True
+            # VCL types 0-14: even types are sub-layer non-reference pictures (TRAIL_N, RASL_N, ...)
+            if nal_type < 32 and not (nal_type <= 14 and nal_type % 2 == 0):
+                reference = True
+    return keyframe, reference or keyframe
+
+
+def packetize(nal_units, codec, max_payload=MAX_PAYLOAD):
+    """RTP payloads of an access unit: single NAL unit packets and fragmentation units."""
+    payloads = []
+    for nal in nal_units:
+        if len(nal) <= max_payload:
+            payloads.append(nal)
+            continue
+        if codec == "h264":
+            header = bytes([(nal[0] & 0xE0) | 28])   # FU-A indicator
+            nal_type, body = nal[0] & 0x1F, nal[1:]
+        else:
+            header = bytes([(nal[0] & 0x81) | (49 << 1), nal[1]])  # FU payload header
+            nal_type, body = (nal[0] >> 1) & 0x3F, nal[2:]
+        chunk = max_payload - len(header) - 1
+        for offset in range(0, len(body), chunk):
+            fu_header = nal_type | (0x80 if offset == 0 else 0) | (0x40 if offset + chunk >= len(body) else 0)
+            payloads.append(header + bytes([fu_header]) + body[offset:offset + chunk])
+    return payloads
+
+
+def _rtp_header(seq, timestamp, ssrc, marker, capture_ns):
+    header = struct.pack("!BBHII", 0x90, (0x80 if marker else 0) | RTP_PAYLOAD_TYPE, seq & 0xFFFF,
+                         timestamp & 0xFFFFFFFF, ssrc)
+    # one-byte header extension: element id 1, 8 bytes of capture time, 3 bytes padding
+    return header + struct.pack("!HHBQ3x", 0xBEDE, 3, (_EXTENSION_ID << 4) | 7, capture_ns)
+
+
+def sdp(codec="h264", port=5004, address="127.0.0.1"):
+    """Session description for receiving the UDP stream with ffplay / VLC."""
+    encoding = "H264" if codec == "h264" else "H265"
+    return (f"v=0\r\no=- 0 0 IN IP4 {address}\r\ns=aquire-video\r\nc=IN IP4 {address}\r\nt=0 0\r\n"
+            f"m=video {port} RTP/AVP {RTP_PAYLOAD_TYPE}\r\na=rtpmap:{RTP_PAYLOAD_TYPE} {encoding}/{RTP_CLOCK_RATE}\r\n"
+            + ("a=fmtp:96 packetization-mode=1\r\n" if codec == "h264" else ""))
+
+
+# sending #####################################################################################
+
+class _Frame:
+    __slots__ = ("payloads", "nbytes", "keyframe", "reference", "timestamp", "capture_ns")
+
+    def __init__(self, payloads, keyframe, reference, timestamp, capture_ns):
+        self.payloads = payloads
+        self.nbytes = sum(len(p) for p in payloads)
+        self.keyframe = keyframe
+        self.reference = reference
+        self.timestamp = timestamp
+        self.capture_ns = capture_ns
+
+
+class _Receiver:
+    """Bounded frame queue plus sender thread for one destination."""
+
+    def __init__(self, name, send_func, max_frames, max_bytes, on_error):
+        self.name = name
+        self._send = send_func
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self._on_error = on_error
+        self._queue = deque()
+        self._bytes = 0
+        self._cond = threading.Condition()
+        self._need_keyframe = True     # a receiver can only start decoding at a keyframe
+        self._closed = False
+        self._seq = random.randrange(1 << 16)
+        self._ssrc = random.getrandbits(32)
+        self.stats = {"frames_sent": 0, "bytes_sent": 0, "dropped_nonref": 0, "dropped_ref": 0}
+        self._thread = threading.Thread(target=self._run, name=f"rtp-send-{name}", daemon=True)
+        self._thread.start()
+
+    def _fits(self, frame):
+        return len(self._queue) < self.max_frames and self._bytes + frame.nbytes <= self.max_bytes
+
+    def _evict_nonref(self, frame):
+        for queued in list(self._queue):
+            if self._fits(frame):
+                break
+            if not queued.reference:
+                self._queue.remove(queued)
+                self._bytes -= queued.nbytes
+                self.stats["dropped_nonref"] += 1
+
+    def offer(self, frame):
+        with self._cond:
+            if self._closed:
+                return
+            if self._need_keyframe and not frame.keyframe:
+                self.stats["dropped_ref" if frame.reference else "dropped_nonref"] += 1
+                return
+            if not self._fits(frame):
+                if not frame.reference:
+                    self.stats["dropped_nonref"] += 1
+                    return
+                self._evict_nonref(frame)
+                if not self._fits(frame):
+                    if not frame.keyframe:
+                        # the reference chain is broken: skip everything up to the next keyframe
+                        self.stats["dropped_ref"] += 1
+                        self._need_keyframe = True
+                        return
+                    self.stats["dropped_ref"] += sum(f.reference for f in self._queue)
+                    self.stats["dropped_nonref"] += sum(not f.reference for f in self._queue)
+                    self._queue.clear()
+                    self._bytes = 0
+            self._need_keyframe = False
+            self._queue.append(frame)
+            self._bytes += frame.nbytes
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    break
+                frame = self._queue.popleft()
+                self._bytes -= frame.nbytes
+            try:
+                last = len(frame.payloads) - 1
+                for n, payload in enumerate(frame.payloads):
+                    self._send(_rtp_header(self._seq, frame.timestamp, self._ssrc, n == last, frame.capture_ns) + payload)
+                    self._seq += 1
+            except OSError as e:
+                self._on_error(self, e)
+                break
+            self.stats["frames_sent"] += 1
+            self.stats["bytes_sent"] += frame.nbytes
+
+    def close(self, wait=True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if wait and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+class StreamSink:
+    """
+    Parameters:
+        - codec (str): "h264" or "hevc" (the codec the encoder was created with)
+        - fps (float): nominal frame rate, used for RTP timestamps when no capture time is given
+        - max_queue_frames (int): per receiver queue depth in frames
+        - max_queue_bytes (int): per receiver queue depth in bytes
+        - max_payload (int): largest RTP payload, FU fragmentation above that
+    """
+
+    def __init__(self, codec="h264", fps=30.0, max_queue_frames=30, max_queue_bytes=4 * 1024 * 1024,
+                 max_payload=MAX_PAYLOAD):
+        codec = codec.lower()
+        if codec not in ("h264", "hevc"):
+            raise ValueError(f"Unsupported codec {codec} for RTP streaming, expected h264 or hevc")
+        self.codec = codec
+        self.fps = fps
+        self.max_queue_frames = max_queue_frames
+        self.max_queue_bytes = max_queue_bytes
+        self.max_payload = max_payload
+        self._receivers = []
+        self._lock = threading.Lock()
+        self._first_capture_ns = None
+        self._frames = 0
+        self._udp = None
+        self._servers = []
+        self.errors = []
+
+    @property
+    def receivers(self):
+        with self._lock:
+            return list(self._receivers)
+
+    def _add(self, name, send_func):
+        receiver = _Receiver(name, send_func, self.max_queue_frames, self.max_queue_bytes, self._remove)
+        with self._lock:
+            self._receivers.append(receiver)
+        return receiver
+
+    def _remove(self, receiver, error=None):
+        with self._lock:
+            if receiver in self._receivers:
+                self._receivers.remove(receiver)
+        if error is not None:
+            self.errors.append((receiver.name, error))
+        receiver.close(wait=False)
+
+    def add_udp(self, host, port):
+        """Send to host:port over UDP (one datagram per RTP packet)."""
+        if self._udp is None:
+            self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        address = (host, port)
+        return self._add(f"udp:{host}:{port}", lambda packet: self._udp.sendto(packet, address))
+
+    def connect_tcp(self, host, port):
+        """Push the stream to a receiver listening on host:port (RFC 4571 framing)."""
+        sock = socket.create_connection((host, port))
+        return self._add_tcp(sock, f"tcp:{host}:{port}")
+
+    def listen_tcp(self, port, host="0.0.0.0"):
+        """Accept any number of receivers on port; each one starts at the next keyframe."""
+        server = socket.create_server((host, port))
+        self._servers.append(server)
+
+        def accept():
+            while True:
+                try:
+                    sock, address = server.accept()
+                except OSError:
+                    break  # server closed
+                self._add_tcp(sock, f"tcp:{address[0]}:{address[1]}")
+        threading.Thread(target=accept, name=f"rtp-accept-{port}", daemon=True).start()
+        return server.getsockname()[1]
+
+    def _add_tcp(self, sock, name):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self._add(name, lambda packet: sock.sendall(struct.pack("!H", len(packet)) + packet))
+
+    def send(self, access_unit, capture_ns=None):
+        """Queue one encoded access unit for every receiver; never blocks."""
+        if not len(access_unit):
+            return  # the encoder returns empty buffers while it is still filling its pipeline
+        if capture_ns is None:
+            # no grab time: frames are spaced at the nominal rate, the send time goes in the header
+            # extension so receivers still see a latency
+            timestamp = round(self._frames * RTP_CLOCK_RATE / self.fps)
+            capture_ns = time.time_ns()
+        else:
+            if self._first_capture_ns is None:
+                self._first_capture_ns = capture_ns
+            timestamp = (capture_ns - self._first_capture_ns) * RTP_CLOCK_RATE // 1_000_000_000
+        self._frames += 1
+        nal_units = split_nal_units(access_unit)
+        keyframe, reference = classify(nal_units, self.codec)
+        frame = _Frame(packetize(nal_units, self.codec, self.max_payload), keyframe, reference, timestamp, capture_ns)
+        for receiver in self.receivers:
+            receiver.offer(frame)
+
+    __call__ = send
+
+    def stats(self):
+        return {receiver.name: dict(receiver.stats) for receiver in self.receivers}
+
+    def close(self):
+        for server in self._servers:
+            server.close()
+        for receiver in self.receivers:
+            receiver.close()
+        if self._udp is not None:
+            self._udp.close()
+
+
+# receiving ###################################################################################
+
+class RtpReceiver:
+    """
+    Receives the stream of a StreamSink, reassembles Annex-B access units and measures latency.
+
+    Parameters:
+        - codec (str): "h264" or "hevc"
+        - port (int): UDP port to bind, or TCP port to listen on (0 picks a free port, see .port)
+        - protocol (str): "udp" or "tcp"
+        - on_frame (callable): optional (access unit bytes, capture_ns, latency_ns) -> None
+    """
+
+    def __init__(self, codec="h264", port=5004, protocol="udp", host="127.0.0.1", on_frame=None):
+        self.codec = codec.lower()
+        self.protocol = protocol
+        self.on_frame = on_frame
+        self.latencies_ns = []
+        self.frames = 0
+        self.lost_packets = 0
+        self._nal_units = []
+        self._fragment = None
+        self._broken = False
+        self._expected_seq = None
+        if protocol == "udp":
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            self._sock.bind((host, port))
+        else:
+            self._sock = socket.create_server((host, port))
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._run, name=f"rtp-receive-{self.port}", daemon=True)
+        self._thread.start()
+
+    def _packets(self):
+        if self.protocol == "udp":
+            while True:
+                yield self._sock.recv(65536)
+        connection, _ = self._sock.accept()
+        stream = connection.makefile("rb")
+        while True:
+            length = stream.read(2)
+            if len(length) < 2:
+                return
+            yield stream.read(struct.unpack("!H", length)[0])
+
+    def _run(self):
+        try:
+            for packet in self._packets():
+                self._handle(packet)
+        except OSError:
+            pass  # socket closed
+
+    def _handle(self, packet):
+        seq = struct.unpack_from("!H", packet, 2)[0]
+        marker = packet[1] & 0x80
+        offset = 12 + 4 * (packet[0] & 0x0F)
+        capture_ns = None
+        if packet[0] & 0x10:
+            words = struct.unpack_from("!H", packet, offset + 2)[0]
+            if packet[offset + 4] >> 4 == _EXTENSION_ID:
+                capture_ns = struct.unpack_from("!Q", packet, offset + 5)[0]
+            offset += 4 + 4 * words
+        if self._expected_seq is not None and seq != self._expected_seq:
+            self.lost_packets += (seq - self._expected_seq) & 0xFFFF
+            self._broken = True
+        self._expected_seq = (seq + 1) & 0xFFFF
+        self._depacketize(packet[offset:])
+        if marker:
+            if not self._broken and self._nal_units:
+                self._deliver(capture_ns)
+            self._nal_units, self._fragment, self._broken = [], None, False
+
+    def _depacketize(self, payload):
+        if self.codec == "h264":
+            nal_type = payload[0] & 0x1F
+            if nal_type != 28:
+                self._nal_units.append(payload)
+                return
+            fu_header, body = payload[1], payload[2:]
+            header = bytes([(payload[0] & 0xE0) | (fu_header & 0x1F)])
+        else:
+            nal_type = (payload[0] >> 1) & 0x3F
+            if nal_type != 49:
+                self._nal_units.append(payload)
+                return
+            fu_header, body = payload[2], payload[3:]
+            header = bytes([(payload[0] & 0x81) | ((fu_header & 0x3F) << 1), payload[1]])
+        if fu_header & 0x80:
+            self._fragment = bytearray(header) + body
+        elif self._fragment is not None:
+            self._fragment += body
+        else:
+            self._broken = True  # start of the fragmented unit was lost
+        if fu_header & 0x40 and self._fragment is not None:
+            self._nal_units.append(bytes(self._fragment))
+            self._fragment = None
+
+    def _deliver(self, capture_ns):
+        now = time.time_ns()
+        latency = now - capture_ns if capture_ns is not None else None
+        self.frames += 1
+        if latency is not None:
+            self.latencies_ns.append(latency)
+        if self.on_frame is not None:
+            self.on_frame(b"".join(b"\x00\x00\x00\x01" + nal for nal in self._nal_units), capture_ns, latency)
+
+    def latency_report(self):
+        if not self.latencies_ns:
+            return "no frames received"
+        ms = np.array(self.latencies_ns) / 1e6
+        return (f"{self.frames} frames, latency median {np.median(ms):.2f} ms, p99 {np.percentile(ms, 99):.2f} ms, "
+                f"max {ms.max():.2f} ms, {self.lost_packets} packets lost")
+
+    def close(self):
+        self._sock.close()
+
+
+# loopback test ###############################################################################
+
+def synthetic_h264(frames, gop=30, b_frames=1, frame_bytes=20000, seed=0):
+    """Annex-B access units with the NAL structure of an IPB.. stream (payload is random)."""
+    rng = random.Random(seed)
+    for i in range(frames):
+        if i % gop == 0:
+            header, size = bytes([0x65]), frame_bytes * 4          # IDR, nal_ref_idc 3
+        elif b_frames and i % (b_frames + 1):
+            header, size = bytes([0x01]), frame_bytes // 2          # non-reference slice
+        else:
+            header, size = bytes([0x41]), frame_bytes               # reference P slice
+        body = bytes(rng.getrandbits(8) | 1 for _ in range(64)) * (size // 64)  # no start code emulation
+        yield b"\x00\x00\x00\x01" + header + body
+
+
+def loopback_test(frames=300, fps=100.0, protocol="udp", **kwargs):
+    """Stream a synthetic H.264 sequence to a local RtpReceiver and return (receiver, sink stats)."""
+    receiver = RtpReceiver("h264", port=0, protocol=protocol)
+    sink = StreamSink("h264", fps=fps, **kwargs)
+    if protocol == "udp":
+        sink.add_udp("127.0.0.1", receiver.port)
+    else:
+        sink.connect_tcp("127.0.0.1", receiver.port)
+    period = 1.0 / fps
+    next_time = time.perf_counter()
+    for access_unit in synthetic_h264(frames):
+        sink.send(access_unit)
+        next_time += period
+        time.sleep(max(0.0, next_time - time.perf_counter()))
+    sink.close()  # waits until every queued frame is sent
+    stats = sink.stats()
+    time.sleep(0.2)
+    receiver.close()
+    return receiver, stats
+
+
+if __name__ == "__main__":
+    for protocol in ("udp", "tcp"):
+        receiver, stats = loopback_test(protocol=protocol)
+        print(f"{protocol}: {receiver.latency_report()}; sender {stats}")
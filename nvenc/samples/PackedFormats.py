@@ -0,0 +1,212 @@
+"""
+Vectorized unpacking of Spinnaker's packed 10/12 bit mono formats into 16 bit surfaces.
+
+    Mono10p       4 pixels in 5 bytes, LSB first (GenICam PFNC)
+    Mono12p       2 pixels in 3 bytes, LSB first (GenICam PFNC)
+    Mono10Packed  2 pixels in 3 bytes, legacy GigE Vision layout
+    Mono12Packed  2 pixels in 3 bytes, legacy GigE Vision layout
+    Mono10/Mono12/Mono16  one pixel per little endian 16 bit word
+
+Instead of extracting bit fields pixel by pixel, every pixel of a group is read through an
+unaligned 16 bit numpy view of the packed bytes (offset k, stride = bytes per group) that already
+holds all of its bits, so each output column is one or two in-place ufunc calls straight into the
+destination plane. By default samples are MSB aligned (value << (16 - bits)), which is what the
+NVENC P010 and YUV444_16BIT formats expect; msb_aligned=False gives the plain sensor values.
+
+Usage:
+    pool = SurfacePool(width, height, "P010")
+    fill_neutral_chroma(pool.buffer, pool.layout)        # once: grey chroma for a mono image
+    surface = pool.acquire()
+    unpack(image_result.GetData(), "Mono12p", surface.planes[0])
+
+Run this file for throughput numbers on the current machine.
+"""
+
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# (significant bits, pixels per group, bytes per group)
+PackedSpec = namedtuple("PackedSpec", ["bits", "pixels", "bytes"])
+
+PACKED_FORMATS = {
+    "Mono10p": PackedSpec(10, 4, 5),
+    "Mono12p": PackedSpec(12, 2, 3),
+    "Mono10Packed": PackedSpec(10, 2, 3),
+    "Mono12Packed": PackedSpec(12, 2, 3),
+    "Mono10": PackedSpec(10, 1, 2),
+    "Mono12": PackedSpec(12, 1, 2),
+    "Mono16": PackedSpec(16, 1, 2),
+}
+
+
+def packed_size(pixel_format, pixel_count):
+    """Bytes taken by pixel_count pixels of pixel_format."""
+    spec = PACKED_FORMATS[pixel_format]
+    if pixel_count % spec.pixels:
+        raise ValueError(f"{pixel_format} packs {spec.pixels} pixels per group, {pixel_count} pixels do not fit")
+    return pixel_count // spec.pixels * spec.bytes
+
+
+def _words(src, groups, spec, offset, byteorder="<"):
+    """Unaligned 16 bit view of bytes (offset, offset + 1) of every group."""
+    return np.ndarray((groups,), dtype=byteorder + "u2", buffer=src, offset=offset, strides=(spec.bytes,))
+
+
+def _unpack_mono10p(src, out, groups, spec, scratch):
+    # bits of pixel k start at bit 10 * k: inside the word at byte k they start at bit 2 * k
+    np.left_shift(_words(src, groups, spec, 0), 6, out=out[:, 0])
+    np.left_shift(_words(src, groups, spec, 1), 4, out=out[:, 1])
+    np.left_shift(_words(src, groups, spec, 2), 2, out=out[:, 2])
+    np.bitwise_and(_words(src, groups, spec, 3), 0xFFC0, out=out[:, 3])
+    # one column at a time: a 2-D masked ufunc over out[:, 1:3] is several times slower
+    np.bitwise_and(out[:, 1], 0xFFC0, out=out[:, 1])
+    np.bitwise_and(out[:, 2], 0xFFC0, out=out[:, 2])
+
+
+def _unpack_mono12p(src, out, groups, spec, scratch):
+    # pixel 0: bits 0-11 of the word at byte 0, pixel 1: bits 4-15 of the word at byte 1
+    np.left_shift(_words(src, groups, spec, 0), 4, out=out[:, 0])
+    np.bitwise_and(_words(src, groups, spec, 1), 0xFFF0, out=out[:, 1])
+
+
+def _unpack_mono12packed(src, out, groups, spec, scratch):
+    # byte 0 = pixel 0 bits 11-4, byte 1 = pixel 0 bits 3-0 | pixel 1 bits 3-0 << 4, byte 2 = pixel 1 bits 11-4
+    np.bitwise_and(_words(src, groups, spec, 1), 0xFFF0, out=out[:, 1])
+    np.bitwise_and(_words(src, groups, spec, 0, ">"), 0xFF00, out=scratch)
+    # the low nibble of byte 1 belongs to pixel 0 and sits at bits 0-3 of its big endian word
+    np.left_shift(_words(src, groups, spec, 0, ">"), 4, out=out[:, 0])
+    np.bitwise_and(out[:, 0], 0x00F0, out=out[:, 0])
+    np.bitwise_or(out[:, 0], scratch, out=out[:, 0])
+
+
+def _unpack_mono10packed(src, out, groups, spec, scratch):
+    # byte 0 = pixel 0 bits 9-2, byte 1 = pixel 0 bits 1-0 | pixel 1 bits 1-0 << 4, byte 2 = pixel 1 bits 9-2
+    middle = np.ndarray((groups,), dtype=np.uint8, buffer=src, offset=1, strides=(spec.bytes,))
+    np.bitwise_and(_words(src, groups, spec, 0, ">"), 0xFF00, out=out[:, 0])
+    np.bitwise_and(middle, 0x03, out=scratch)
+    np.left_shift(scratch, 6, out=scratch)
+    np.bitwise_or(out[:, 0], scratch, out=out[:, 0])
+    np.bitwise_and(_words(src, groups, spec, 1), 0xFF00, out=out[:, 1])
+    np.bitwise_and(middle, 0x30, out=scratch)
+    np.left_shift(scratch, 2, out=scratch)
+    np.bitwise_or(out[:, 1], scratch, out=out[:, 1])
+
+
+def _unpack_words(src, out, groups, spec, scratch):
+    np.left_shift(_words(src, groups, spec, 0), 16 - spec.bits, out=out[:, 0])
+
+
+_UNPACKERS = {
+    "Mono10p": _unpack_mono10p,
+    "Mono12p": _unpack_mono12p,
+    "Mono10Packed": _unpack_mono10packed,
+    "Mono12Packed": _unpack_mono12packed,
+    "Mono10": _unpack_words,
+    "Mono12": _unpack_words,
+    "Mono16": _unpack_words,
+}
+
+
+class Unpacker:
+    """
+    Unpacks one pixel format into preallocated uint16 arrays; keeps the small scratch buffer
+    some layouts need, so repeated calls allocate nothing.
+
+    Parameters:
+        - pixel_format (str): any key of PACKED_FORMATS
+        - msb_aligned (bool): left align samples in 16 bits (P010 / YUV444_16BIT), else plain values
+    """
+
+    def __init__(self, pixel_format, msb_aligned=True):
+        if pixel_format not in PACKED_FORMATS:
+            raise ValueError(f"Unsupported pixel format {pixel_format}, expected one of {sorted(PACKED_FORMATS)}")
+        self.pixel_format = pixel_format
+        self.spec = PACKED_FORMATS[pixel_format]
+        self.msb_aligned = msb_aligned
+        self._scratch = None
+
+    def __call__(self, src, out):
+        """Unpack the packed bytes src (buffer protocol) into out, a C-contiguous uint16 array."""
+        if out.dtype != np.uint16 or not out.flags.c_contiguous:
+            raise ValueError("Output must be a C-contiguous uint16 array, e.g. the luma plane of a P010 surface")
+        spec = self.spec
+        src = memoryview(src).cast("B")
+        size = packed_size(self.pixel_format, out.size)
+        if src.nbytes < size:
+            raise ValueError(f"{self.pixel_format} image of {out.size} pixels needs {size} bytes, got {src.nbytes}")
+        groups = out.size // spec.pixels
+        flat = out.reshape(groups, spec.pixels)
+        if self._scratch is None or len(self._scratch) != groups:
+            self._scratch = np.empty(groups, np.uint16)
+        _UNPACKERS[self.pixel_format](src, flat, groups, spec, self._scratch)
+        if not self.msb_aligned and spec.bits < 16:
+            np.right_shift(out, 16 - spec.bits, out=out)
+        return out
+
+
+_unpackers = {}
+
+
+def unpack(src, pixel_format, out, msb_aligned=True):
+    """Unpack src into the uint16 array out with a cached Unpacker (not thread safe per format)."""
+    key = (pixel_format, msb_aligned)
+    unpacker = _unpackers.get(key)
+    if unpacker is None:
+        unpacker = _unpackers[key] = Unpacker(pixel_format, msb_aligned)
+    return unpacker(src, out)
+
+
+def fill_neutral_chroma(buffer, layout):
+    """
+    Set every chroma plane of each frame in buffer (one frame or a (count, frame_size) pool
+    buffer) to neutral grey: 128 for 8 bit formats, 0x8000 for P010 / YUV444_16BIT.
+    """
+    frames = np.asarray(buffer).reshape(-1, layout.frame_size)
+    for frame in frames:
+        for plane, view in zip(layout.planes[1:], layout.plane_views(frame)[1:]):
+            view[...] = 128 if plane.dtype == np.uint8 else 0x8000
+
+
+def pack_reference(values, pixel_format):
+    """Pack plain sample values into pixel_format bytes, pixel by pixel (for tests and benchmarks)."""
+    spec = PACKED_FORMATS[pixel_format]
+    values = [int(v) for v in np.asarray(values).reshape(-1)]
+    out = bytearray()
+    for i in range(0, len(values), spec.pixels):
+        group = values[i:i + spec.pixels]
+        if pixel_format in ("Mono10p", "Mono12p"):
+            bits = sum(v << (spec.bits * k) for k, v in enumerate(group))
+            out += bits.to_bytes(spec.bytes, "little")
+        elif pixel_format == "Mono12Packed":
+            p0, p1 = group
+            out += bytes([p0 >> 4, (p0 & 0xF) | (p1 & 0xF) << 4, p1 >> 4])
+        elif pixel_format == "Mono10Packed":
+            p0, p1 = group
+            out += bytes([p0 >> 2, (p0 & 0x3) | (p1 & 0x3) << 4, p1 >> 2])
+        else:
+            out += group[0].to_bytes(2, "little")
+    return bytes(out)
+
+
+def benchmark(width=1920, height=1080, frames=50):
+    """Unpack throughput per format in megapixels per second."""
+    rng = np.random.default_rng(0)
+    out = np.empty((height, width), np.uint16)
+    results = {}
+    for pixel_format, spec in PACKED_FORMATS.items():
+        src = rng.integers(0, 256, packed_size(pixel_format, width * height), dtype=np.uint8)
+        unpacker = Unpacker(pixel_format)
+        unpacker(src, out)
+        start = time.perf_counter()
+        for _ in range(frames):
+            unpacker(src, out)
+        elapsed = time.perf_counter() - start
+        results[pixel_format] = width * height * frames / elapsed / 1e6
+    return results
+
+
+if __name__ == "__main__":
+    for pixel_format, mpix in benchmark().items():
+        print(f"{pixel_format:>13}: {mpix:7.1f} Mpix/s ({1920 * 1080 / mpix / 1e3:.2f} ms per 1080p frame)")
@@ -0,0 +1,213 @@
+"""
+Small asyncio runtime for acquisition pipelines (grab -> convert -> encode -> write -> preview).
+
+A pipeline is a source followed by stages. Each stage declares how its work runs:
+
+    - "async":   func is a coroutine function awaited on the event loop (cheap, non-blocking work)
+    - "thread":  func runs in a thread pool; use for blocking calls that release the GIL
+                 (GetNextImage, cv2, NVENC, file writes)
+    - "process": func runs in a process pool; func, its input and its result must be picklable
+
+and how many workers it gets. Stages are connected by bounded asyncio queues, so a slow stage
+applies back-pressure all the way to the source instead of letting memory grow. A stage function
+returning None drops the item. With more than one worker a stage may reorder items.
+
+stop() ends the source and drains: every item already grabbed flows through the remaining
+stages before run() returns. cancel() abandons in-flight items. An exception in any stage
+cancels the pipeline and is re-raised from run().
+
+Worker counts, modes and queue sizes can be overridden without code changes through a JSON file
+(`config` argument, or the path in the PIPELINE_CONFIG environment variable):
+
+    {"encode": {"workers": 1}, "convert": {"workers": 4, "mode": "process"}, "write": {"queue_size": 32}}
+
+Usage:
+    pipeline = Pipeline(grab_frame, [Stage("convert", to_nv12, workers=2),
+                                     Stage("encode", encoder.Encode),
+                                     Stage("write", out_file.write)])
+    pipeline.run()   # or: await pipeline.run_async()
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import time
+
+_DONE = object()
+_MODES = ("async", "thread", "process")
+
+
+class Stage:
+    """
+    Parameters:
+        - name (str): stage name, used for config overrides and stats
+        - func (callable): item -> result; None drops the item
+        - workers (int): number of concurrent workers
+        - mode (str): "async", "thread" or "process"
+        - queue_size (int): capacity of the queue feeding this stage
+    """
+
+    def __init__(self, name, func, workers=1, mode="thread", queue_size=8):
+        if mode not in _MODES:
+            raise ValueError(f"Unknown stage mode {mode}, expected one of {_MODES}")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.mode = mode
+        self.queue_size = queue_size
+        self.processed = 0
+        self.dropped = 0
+        self.busy_seconds = 0.0
+
+    def configure(self, workers=None, mode=None, queue_size=None):
+        if mode is not None and mode not in _MODES:
+            raise ValueError(f"Unknown stage mode {mode}, expected one of {_MODES}")
+        self.workers = workers if workers is not None else self.workers
+        self.mode = mode if mode is not None else self.mode
+        self.queue_size = queue_size if queue_size is not None else self.queue_size
+
+    def __repr__(self):
+        return f"Stage({self.name}, {self.mode} x{self.workers}, queue {self.queue_size})"
+
+
+def load_stage_config(config=None):
+    """Stage overrides from a dict, a JSON file path, or the PIPELINE_CONFIG environment variable."""
+    if config is None:
+        config = os.environ.get("PIPELINE_CONFIG")
+    if config is None:
+        return {}
+    if isinstance(config, dict):
+        return config
+    with open(config) as jsonFile:
+        return json.load(jsonFile)
+
+
+class Pipeline:
+    """
+    Parameters:
+        - source (callable): blocking call returning the next item, or None when the stream ends;
+          run in a thread of its own so the event loop is never blocked (e.g. cam.GetNextImage)
+        - stages (list of Stage): processing stages in order
+        - config (dict or str): stage overrides, see load_stage_config()
+    """
+
+    def __init__(self, source, stages, config=None, source_name="grab"):
+        self.source = Stage(source_name, source, workers=1, mode="thread")
+        self.stages = list(stages)
+        if not self.stages:
+            raise ValueError("A pipeline needs at least one stage after the source")
+        names = [stage.name for stage in self.stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Stage names must be unique, got {names}")
+        for name, overrides in load_stage_config(config).items():
+            stage = self.stage(name)
+            if stage is None:
+                raise ValueError(f"Config refers to unknown stage {name}")
+            stage.configure(**overrides)
+        self._stopping = False
+        self._tasks = []
+        self._thread_pool = None
+        self._process_pool = None
+
+    def stage(self, name):
+        for stage in [self.source] + self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def stop(self):
+        """End the source; items already grabbed are drained through the remaining stages."""
+        self._stopping = True
+
+    def cancel(self):
+        """Abandon the pipeline immediately, dropping in-flight items."""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+
+    async def _call(self, stage, item, loop):
+        if stage.mode == "async":
+            return await stage.func(item)
+        pool = self._process_pool if stage.mode == "process" else self._thread_pool
+        return await loop.run_in_executor(pool, stage.func, item)
+
+    async def _source_worker(self, output, loop):
+        stage = self.source
+        while not self._stopping:
+            start = time.perf_counter()
+            item = await loop.run_in_executor(self._thread_pool, stage.func)
+            stage.busy_seconds += time.perf_counter() - start
+            if item is None:
+                break
+            stage.processed += 1
+            await output.put(item)
+
+    async def _stage_worker(self, stage, inbox, output, loop):
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            start = time.perf_counter()
+            result = await self._call(stage, item, loop)
+            stage.busy_seconds += time.perf_counter() - start
+            stage.processed += 1
+            if output is None:
+                continue  # last stage is the sink, its return value is not used
+            if result is None:
+                stage.dropped += 1
+            else:
+                await output.put(result)
+
+    async def _run_group(self, workers, output, downstream_workers):
+        """Run all workers of one stage; once they are done, tell each downstream worker."""
+        await asyncio.gather(*workers)
+        if output is not None:
+            for _ in range(downstream_workers):
+                await output.put(_DONE)
+
+    async def run_async(self):
+        loop = asyncio.get_running_loop()
+        thread_workers = 1 + sum(s.workers for s in self.stages if s.mode == "thread")
+        self._thread_pool = concurrent.futures.ThreadPoolExecutor(thread_workers, thread_name_prefix="pipeline")
+        process_workers = sum(s.workers for s in self.stages if s.mode == "process")
+        if process_workers:
+            self._process_pool = concurrent.futures.ProcessPoolExecutor(process_workers)
+
+        queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        groups = [self._run_group([self._source_worker(queues[0], loop)], queues[0], self.stages[0].workers)]
+        for index, stage in enumerate(self.stages):
+            inbox = queues[index]
+            output = queues[index + 1] if index + 1 < len(queues) else None
+            downstream = self.stages[index + 1].workers if output is not None else 0
+            workers = [self._stage_worker(stage, inbox, output, loop) for _ in range(stage.workers)]
+            groups.append(self._run_group(workers, output, downstream))
+
+        self._tasks = [asyncio.ensure_future(group) for group in groups]
+        try:
+            await asyncio.gather(*self._tasks)
+        except BaseException:
+            self.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            raise
+        finally:
+            self._thread_pool.shutdown(wait=True)
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=True)
+
+    def run(self):
+        """Run the pipeline to completion on a new event loop (blocks the calling thread)."""
+        start = time.perf_counter()
+        try:
+            asyncio.run(self.run_async())
+        finally:
+            self.elapsed = time.perf_counter() - start
+
+    def report(self):
+        elapsed = getattr(self, "elapsed", 0.0) or float("nan")
+        lines = []
+        for stage in [self.source] + self.stages:
+            utilisation = stage.busy_seconds / (elapsed * stage.workers)
+            lines.append(f"{stage.name:>10}: {stage.processed} items, {stage.dropped} dropped, "
+                         f"{stage.mode} x{stage.workers}, utilisation {utilisation:.0%}")
+        return "\n".join(lines)
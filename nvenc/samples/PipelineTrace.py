@@ -0,0 +1,217 @@
+"""
+Timeline of a capture session in the Chrome trace event format, to open in https://ui.perfetto.dev
+(or chrome://tracing): one track per thread, one slice per grab / convert / encode / write / GUI
+update with its frame id, plus counters such as queue depths. Gaps between slices show where a
+thread waited (on the GIL, a queue or the camera), which print logs cannot show.
+
+Events go into a fixed size ring buffer shared by all threads (preallocated array.array columns,
+no allocation per event), so tracing can stay on for a whole session and the last `capacity`
+events are kept. Timestamps are perf_counter_ns, which is a system wide clock on Windows and
+Linux, so traces written by several processes (e.g. FrameBus subscribers) line up when merged.
+
+Usage:
+    tracer = Tracer()
+    for i in range(n):
+        t = time.perf_counter_ns()
+        image = cam.GetNextImage()
+        t = tracer.span("grab", t, frame=i)       # returns the end, i.e. the start of the next span
+        ...
+        tracer.counter("save queue", len(queue))
+    tracer.dump("session_trace.json")
+
+    merge(["camera_trace.json", "tracker_trace.json"], "session_trace.json")
+
+StageTimer(stages, tracer=tracer) turns every StageTimer.record() into a span as well.
+
+Run this file for a small two thread example trace and the cost of one span.
+"""
+
+import array
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+_SPAN, _INSTANT, _COUNTER = 0, 1, 2
+
+_perf_counter_ns = time.perf_counter_ns
+_native_id = threading.get_native_id
+
+
+class Tracer:
+    """
+    Ring buffer of trace events from every thread of this process.
+
+    Parameters:
+        - capacity (int): number of events kept; older events are overwritten
+        - process_name (str): name of this process's track group (default: the script name)
+    """
+
+    def __init__(self, capacity=1 << 16, process_name=None):
+        self.capacity = capacity
+        self.process_name = process_name or os.path.basename(sys.argv[0]) or "python"
+        self._kinds = array.array("b", bytes(capacity))
+        self._names = array.array("h", bytes(2 * capacity))
+        self._starts = array.array("q", bytes(8 * capacity))
+        self._values = array.array("d", bytes(8 * capacity))  # duration in ns, or the counter value
+        self._threads = array.array("q", bytes(8 * capacity))
+        self._frames = array.array("q", bytes(8 * capacity))
+        self._seqs = array.array("q", [-1]) * capacity  # sequence number of the event in each slot
+        self._next = itertools.count()  # next() is atomic, every event gets its own slot
+        self._name_ids = {}
+        self._name_list = []
+        self._thread_names = {}
+        self._lock = threading.Lock()
+
+    def _intern(self, name):
+        with self._lock:
+            if name not in self._name_ids:
+                self._name_ids[name] = len(self._name_list)
+                self._name_list.append(name)
+            return self._name_ids[name]
+
+    def _write(self, kind, name, start_ns, value, frame):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._intern(name)
+        tid = _native_id()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        index = next(self._next)
+        slot = index % self.capacity
+        self._kinds[slot] = kind
+        self._names[slot] = name_id
+        self._starts[slot] = start_ns
+        self._values[slot] = value
+        self._threads[slot] = tid
+        self._frames[slot] = frame
+        # written last: a slot whose sequence number is not set yet is still being filled; a shared
+        # "events written" counter would need a lock, threads finish their writes out of order
+        self._seqs[slot] = index
+
+    def span(self, name, start_ns, stop_ns=None, frame=-1):
+        """A slice from start_ns to stop_ns (default now) on this thread's track; returns stop_ns."""
+        if stop_ns is None:
+            stop_ns = _perf_counter_ns()
+        self._write(_SPAN, name, start_ns, stop_ns - start_ns, frame)
+        return stop_ns
+
+    def instant(self, name, frame=-1):
+        """A marker at the current time on this thread's track (e.g. a dropped frame)."""
+        self._write(_INSTANT, name, _perf_counter_ns(), 0.0, frame)
+
+    def counter(self, name, value):
+        """A sample of a process wide counter track (e.g. a queue depth)."""
+        self._write(_COUNTER, name, _perf_counter_ns(), value, -1)
+
+    def _written(self):
+        return max(self._seqs) + 1
+
+    @property
+    def dropped(self):
+        """Events overwritten because the ring buffer wrapped."""
+        return max(0, self._written() - self.capacity)
+
+    def events(self):
+        """Trace events currently in the ring buffer, oldest first, with track name metadata."""
+        written = self._written()
+        count = min(written, self.capacity)
+        pid = os.getpid()
+        names = list(self._name_list)
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": self.process_name}}]
+        events += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                   for tid, name in list(self._thread_names.items())]
+        timed = []
+        for index in range(written - count, written):
+            slot = index % self.capacity
+            if self._seqs[slot] != index:
+                continue  # still being written by another thread
+            kind, name = self._kinds[slot], names[self._names[slot]]
+            event = {"name": name, "pid": pid, "tid": self._threads[slot], "ts": self._starts[slot] / 1e3}
+            if kind == _SPAN:
+                event.update(ph="X", cat="stage", dur=self._values[slot] / 1e3)
+            elif kind == _INSTANT:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="C", args={name: self._values[slot]})
+            if self._frames[slot] >= 0:
+                event["args"] = {"frame": self._frames[slot]}
+            timed.append(event)
+        timed.sort(key=lambda event: event["ts"])
+        return events + timed
+
+    def dump(self, path):
+        """Write a Chrome trace JSON file; returns the number of events written."""
+        events = self.events()
+        with open(path, "w") as output:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"dropped_events": self.dropped}}, output)
+        return len(events)
+
+
+def merge(paths, output_path):
+    """Combine trace files of several processes into one; they share the perf_counter clock."""
+    events, dropped = [], 0
+    for path in paths:
+        with open(path) as trace:
+            data = json.load(trace)
+        events += data["traceEvents"]
+        dropped += data.get("otherData", {}).get("dropped_events", 0)
+    with open(output_path, "w") as output:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                   "otherData": {"dropped_events": dropped}}, output)
+    return len(events)
+
+
+def span_cost_ns(calls=20000):
+    """Cost of one span() call on this machine."""
+    tracer = Tracer(capacity=1024)
+    start = t = _perf_counter_ns()
+    for i in range(calls):
+        t = tracer.span("calibrate", t, frame=i)
+    return (_perf_counter_ns() - start) / calls
+
+
+if __name__ == "__main__":
+    import queue
+
+    import numpy as np
+
+    print(f"span(): {span_cost_ns():.0f} ns per call")
+    tracer = Tracer(process_name="PipelineTrace example")
+    frames = queue.Queue(maxsize=4)
+    source = np.random.default_rng(0).integers(0, 256, (720, 1280), np.uint8)
+
+    def producer():
+        for i in range(120):
+            t = _perf_counter_ns()
+            frame = source.copy()                 # "grab"
+            t = tracer.span("grab", t, frame=i)
+            checksum = sum(range(20000))          # pure Python work that holds the GIL
+            t = tracer.span("convert", t, frame=i)
+            frames.put((i, frame + checksum % 7))
+            tracer.span("enqueue", t, frame=i)    # long when the consumer falls behind
+            tracer.counter("queue", frames.qsize())
+        frames.put(None)
+
+    def consumer():
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            i, frame = item
+            t = _perf_counter_ns()
+            np.sort(frame, axis=1)                # "encode", releases the GIL
+            t = tracer.span("encode", t, frame=i)
+            time.sleep(0.002 if i % 30 else 0.05)  # "write", with an occasional stall
+            tracer.span("write", t, frame=i)
+
+    threads = [threading.Thread(target=producer, name="grab"), threading.Thread(target=consumer, name="save")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    count = tracer.dump("PipelineTrace_example.json")
+    print(f"{count} events written to PipelineTrace_example.json, open it in https://ui.perfetto.dev")
@@ -0,0 +1,115 @@
+"""
+Single source of truth for the memory layout of the raw surface formats accepted by NVENC.
+
+Every plane of a format is described once in PIXEL_FORMATS as
+(name, height divisor, width divisor, channels, bytes per sample). GetFrameLayout() turns that
+description into byte offsets, pitches and dtypes for a concrete width x height, which is all
+that AppFrame, the surface pool and the encode samples need to know about a format.
+
+    NV12 / YUV420   full resolution luma + chroma subsampled 2x2      width * height * 3 / 2 bytes
+    YUV444          three full resolution planes                       width * height * 3
+    ARGB / ABGR     one packed plane, 4 bytes per pixel                width * height * 4
+    P010            NV12 geometry, 10 bit samples in 16 bit words      width * height * 3 / 2 * 2
+    YUV444_16BIT    YUV444 geometry, 16 bit samples                    width * height * 3 * 2
+
+Example:
+    >>> layout = GetFrameLayout(1920, 1080, "NV12")
+    >>> layout.frame_size
+    3110400
+    >>> [(p.name, p.offset, p.shape) for p in layout.planes]
+    [('Y', 0, (1080, 1920, 1)), ('UV', 2073600, (540, 960, 2))]
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# (plane name, height divisor, width divisor, interleaved channels, bytes per sample)
+PlaneSpec = namedtuple("PlaneSpec", ["name", "height_div", "width_div", "channels", "bytes_per_sample"])
+
+PIXEL_FORMATS = {
+    "NV12": (PlaneSpec("Y", 1, 1, 1, 1), PlaneSpec("UV", 2, 2, 2, 1)),
+    "YUV420": (PlaneSpec("Y", 1, 1, 1, 1), PlaneSpec("U", 2, 2, 1, 1), PlaneSpec("V", 2, 2, 1, 1)),
+    "YUV444": (PlaneSpec("Y", 1, 1, 1, 1), PlaneSpec("U", 1, 1, 1, 1), PlaneSpec("V", 1, 1, 1, 1)),
+    "ARGB": (PlaneSpec("ARGB", 1, 1, 4, 1),),
+    "ABGR": (PlaneSpec("ABGR", 1, 1, 4, 1),),
+    "P010": (PlaneSpec("Y", 1, 1, 1, 2), PlaneSpec("UV", 2, 2, 2, 2)),
+    "YUV444_16BIT": (PlaneSpec("Y", 1, 1, 1, 2), PlaneSpec("U", 1, 1, 1, 2), PlaneSpec("V", 1, 1, 1, 2)),
+}
+
+# Plane of a concrete frame. offset and pitch are in bytes, shape is (rows, columns, channels)
+# and dtype is the numpy sample type (uint16 for the 10/16 bit formats).
+PlaneLayout = namedtuple("PlaneLayout", ["name", "offset", "shape", "pitch", "dtype"])
+
+
+class FrameLayout:
+    def __init__(self, width, height, fmt):
+        fmt = fmt.upper()
+        if fmt not in PIXEL_FORMATS:
+            raise ValueError(f"Unsupported surface format {fmt}, expected one of {sorted(PIXEL_FORMATS)}")
+        self.width = int(width)
+        self.height = int(height)
+        self.format = fmt
+
+        planes = []
+        offset = 0
+        for spec in PIXEL_FORMATS[fmt]:
+            if self.height % spec.height_div or self.width % spec.width_div:
+                raise ValueError(f"{fmt} needs width and height divisible by 2, got {self.width}x{self.height}")
+            rows = self.height // spec.height_div
+            cols = self.width // spec.width_div
+            pitch = cols * spec.channels * spec.bytes_per_sample
+            dtype = np.dtype(np.uint8) if spec.bytes_per_sample == 1 else np.dtype("<u2")
+            planes.append(PlaneLayout(spec.name, offset, (rows, cols, spec.channels), pitch, dtype))
+            offset += rows * pitch
+        self.planes = tuple(planes)
+        self.frame_size = offset
+
+    def plane_views(self, buffer, offset=0):
+        """
+        Wrap a host buffer (anything exposing the buffer protocol) in one numpy view per plane.
+        No data is copied; writing to a view writes into the buffer. Single channel planes are
+        returned as 2-D (rows, columns) arrays, interleaved planes as (rows, columns, channels).
+        """
+        views = []
+        for plane in self.planes:
+            rows, cols, channels = plane.shape
+            shape = (rows, cols) if channels == 1 else plane.shape
+            views.append(np.ndarray(shape, dtype=plane.dtype, buffer=buffer, offset=offset + plane.offset))
+        return views
+
+    def cuda_array_interfaces(self, base_address):
+        """
+        __cuda_array_interface__ dictionaries describing each plane of a frame in device memory
+        starting at base_address. Planes are exposed as bytes, which is what NVENC expects.
+        """
+        interfaces = []
+        for plane in self.planes:
+            rows, cols, channels = plane.shape
+            sample_bytes = plane.pitch // (cols * channels)
+            interfaces.append({"shape": plane.shape,
+                               "strides": (plane.pitch, channels * sample_bytes, 1),
+                               "data": (int(base_address) + plane.offset, False),
+                               "typestr": "|u1",
+                               "version": 3})
+        return interfaces
+
+    def __repr__(self):
+        return f"FrameLayout({self.width}x{self.height} {self.format}, {self.frame_size} bytes)"
+
+
+_layout_cache = {}
+
+
+def GetFrameLayout(width, height, surface_format):
+    """Cached FrameLayout for the given geometry; layouts are immutable so they are shared."""
+    key = (int(width), int(height), surface_format.upper())
+    layout = _layout_cache.get(key)
+    if layout is None:
+        layout = _layout_cache[key] = FrameLayout(*key)
+    return layout
+
+
+def GetFrameSize(width, height, surface_format):
+    """Size in bytes of one frame of surface_format, e.g. width * height * 3 / 2 for NV12."""
+    return GetFrameLayout(width, height, surface_format).frame_size
@@ -0,0 +1,139 @@
+"""
+Pre-trigger (pre-roll) recording: the last N seconds are always kept in memory and written out,
+followed by the live frames, as soon as a trigger fires.
+
+PreRollRecorder holds raw frames in one preallocated ring, so memory use is exact:
+(preroll + headroom) frames x frame bytes, see `nbytes`. Acquisition only ever copies the frame
+into the next slot and never waits:
+
+    - idle: the ring keeps the newest `preroll_seconds` of frames
+    - trigger(writer): a background thread starts writing from the oldest kept frame and follows
+      the live frames through the same ring without a gap; `headroom_seconds` is how far the
+      writer may fall behind before frames are dropped (counted in `dropped`)
+    - stop(): frames acquired up to now are still written, then the writer is handed to on_done
+
+`first_write_time` is the perf_counter() time the first frame after a trigger was written, for
+measuring trigger -> write latency.
+
+trigger() and stop() are thread safe, so they can be called from a GUI button, from software, or
+from a PySpin device event handler reacting to a hardware line.
+
+Usage:
+    preroll = PreRollRecorder((height, width), np.uint8, fps=30, preroll_seconds=5)
+    # acquisition loop
+    preroll.push(image_result.GetNDArray())
+    # on the event
+    preroll.trigger(cv2.VideoWriter(...), on_done=lambda writer: writer.release())
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+class PreRollRecorder:
+    """
+    Parameters:
+        - frame_shape (tuple): shape of one frame, e.g. (height, width) for Mono8
+        - dtype: numpy dtype of the frames
+        - fps (float): nominal frame rate, used to turn seconds into frame counts
+        - preroll_seconds (float): how much history is written when the trigger fires
+        - headroom_seconds (float): extra slots the writer may lag behind acquisition
+        - transform (callable): optional frame -> frame applied on the writer thread before
+          writer.write(), e.g. a colour conversion kept off the acquisition thread
+    """
+
+    def __init__(self, frame_shape, dtype, fps, preroll_seconds, headroom_seconds=1.0, transform=None):
+        self.preroll_frames = max(0, int(round(preroll_seconds * fps)))
+        self.capacity = self.preroll_frames + max(1, int(round(headroom_seconds * fps)))
+        self.frames = np.empty((self.capacity,) + tuple(frame_shape), dtype)
+        self.timestamps = np.zeros(self.capacity, np.int64)
+        self.transform = transform
+        self._write_seq = 0        # sequence number of the next frame pushed
+        self._read_seq = 0         # oldest frame still kept / not yet written
+        self._stop_seq = None      # first sequence number not to write after stop()
+        self._writer = None
+        self._on_done = None
+        self._thread = None
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self.written = 0
+        self.first_write_time = None
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes + self.timestamps.nbytes
+
+    @property
+    def recording(self):
+        return self._writer is not None
+
+    def push(self, frame, timestamp=None):
+        """Copy one frame into the ring. Never blocks; returns False if it had to be dropped."""
+        with self._cond:
+            seq = self._write_seq
+            if self._writer is None:
+                # idle: forget everything older than the pre-roll window
+                self._read_seq = max(self._read_seq, seq + 1 - self.preroll_frames)
+            elif seq - self._read_seq >= self.capacity:
+                self.dropped += 1
+                return False
+        slot = seq % self.capacity
+        np.copyto(self.frames[slot], frame)
+        self.timestamps[slot] = time.perf_counter_ns() if timestamp is None else timestamp
+        with self._cond:
+            self._write_seq = seq + 1
+            self._cond.notify()
+        return True
+
+    def trigger(self, writer, on_done=None):
+        """Start writing the pre-roll and then live frames to writer.write(frame) in the background."""
+        with self._cond:
+            if self._writer is not None:
+                raise RuntimeError("Pre-roll recording already active")
+            self._writer = writer
+            self._on_done = on_done
+            self._stop_seq = None
+            self.written = 0
+            self.dropped = 0
+            self.first_write_time = None
+            self.triggered_at = self._write_seq
+        self._thread = threading.Thread(target=self._drain, name="preroll-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=False):
+        """Stop after the frames acquired so far; optionally wait until they are written."""
+        with self._cond:
+            if self._writer is None:
+                return
+            self._stop_seq = self._write_seq
+            self._cond.notify()
+        if wait:
+            self._thread.join()
+
+    def _drain(self):
+        writer = self._writer
+        while True:
+            with self._cond:
+                while self._read_seq >= self._write_seq and (self._stop_seq is None or self._read_seq < self._stop_seq):
+                    self._cond.wait()
+                if self._stop_seq is not None and self._read_seq >= self._stop_seq:
+                    break
+                seq = self._read_seq
+            # the slot cannot be overwritten until _read_seq moves past it
+            frame = self.frames[seq % self.capacity]
+            writer.write(self.transform(frame) if self.transform is not None else frame)
+            if self.first_write_time is None:
+                self.first_write_time = time.perf_counter()
+            with self._cond:
+                self._read_seq = seq + 1
+                self.written += 1
+
+        with self._cond:
+            on_done, self._on_done = self._on_done, None
+            self._writer = None
+            self._stop_seq = None
+        if on_done is not None:
+            on_done(writer)
+
@@ -0,0 +1,357 @@
+"""
+Replay a recording as a virtual camera. The encode path is then load tested at the pace a live
+camera delivers frames, not as fast as the disk can be read.
+
+Sources (ReplayClip.open):
+    raw .yuv / .raw / ...         fixed size frames (width, height and surface format needed), paced
+                                  at fps; memory mapped, or read into RAM first with preload=True
+    indexed raw log               the same raw file plus <path>.timestamps.npy, an int64 array with
+                                  the capture time (ns) of every frame (save_timestamps() writes it);
+                                  frames keep their recorded spacing, gaps and jitter included
+    .mp4 / .avi / .mkv / .h264    decoded once with OpenCV into BGR frames, paced by their
+                                  presentation timestamps
+
+ReplayCamera delivers a clip like a camera with `buffers` stream buffers. A producer thread
+releases every frame at its due time into the buffers. The due time is the recorded time divided
+by rate, plus optional gaussian jitter. get_next() and readinto() take the oldest frame, as
+GetNextImage does with StreamBufferHandlingMode OldestFirst. When the consumer does not keep up,
+the buffers fill and new frames are lost, as on a real camera; the first loss and the recovery
+are logged. The report gives lost frames, how long frames waited in the buffers (lag), delivered
+vs. target fps, and whether the producer itself ran late. rate=None turns pacing off: frames
+come as fast as they are taken and none are lost, which is how the samples read files so far.
+
+readinto() behaves like file.readinto, so a camera can be passed wherever the samples read a raw
+file (EncodeFromCPUBuffer.FetchCPUFrame, Utils.FetchCPUFrame); open_raw() picks one or the other.
+
+Usage:
+    clip = ReplayClip.open("test_files/random_noise_video.yuv", 1920, 1080, "NV12", fps=60)
+    with ReplayCamera(clip, rate=1.0, jitter_ms=0.5) as cam:
+        while (frame := cam.get_next()) is not None:
+            encoder.Encode(frame.data)
+    print(cam.report())
+
+    cameras = virtual_cameras(clip, 4, rate=1.0)   # phases spread over one frame interval
+
+Run this file to replay a clip (synthetic by default) into consumers of a given speed.
+"""
+
+import argparse
+import array
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+from PixelFormats import GetFrameSize
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".h264", ".264", ".h265", ".265", ".hevc")
+TIMESTAMPS_SUFFIX = ".timestamps.npy"
+
+ReplayFrame = collections.namedtuple("ReplayFrame", "index timestamp_ns data")
+
+_perf_counter_ns = time.perf_counter_ns
+
+
+def save_timestamps(raw_path, timestamps_ns):
+    """Write the index that turns a raw file into an indexed raw log (capture times in ns)."""
+    np.save(raw_path + TIMESTAMPS_SUFFIX, np.asarray(timestamps_ns, np.int64))
+
+
+class ReplayClip:
+    """
+    Frames and their capture times, shared by any number of ReplayCameras.
+
+    Parameters:
+        - frames (sequence of numpy arrays): e.g. rows of a memory map, or decoded frames
+        - timestamps_ns (sequence of int): capture time of every frame, increasing
+    """
+
+    def __init__(self, frames, timestamps_ns):
+        self.frames = frames
+        self.timestamps_ns = np.asarray(timestamps_ns, np.int64) - int(timestamps_ns[0])
+        if len(self.timestamps_ns) != len(frames):
+            raise ValueError(f"{len(frames)} frames but {len(self.timestamps_ns)} timestamps")
+        intervals = np.diff(self.timestamps_ns)
+        if (intervals < 0).any():
+            raise ValueError("timestamps must not decrease")
+        self.interval_ns = int(np.median(intervals)) if len(intervals) else 33_333_333
+        # a looped clip restarts one frame interval after its last frame
+        self.loop_ns = int(self.timestamps_ns[-1]) + self.interval_ns
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def fps(self):
+        return 1e9 / self.interval_ns
+
+    @classmethod
+    def open(cls, path, width=None, height=None, fmt=None, fps=30.0, count=None, preload=False):
+        """Raw file (with or without timestamp index) or a video OpenCV can decode."""
+        if path.lower().endswith(VIDEO_EXTENSIONS):
+            return cls._open_video(path, fps, count)
+        if width is None or height is None or fmt is None:
+            raise ValueError(f"{path}: raw files need width, height and fmt")
+        frame_size = GetFrameSize(width, height, fmt)
+        data = np.memmap(path, np.uint8, "r")
+        frames = len(data) // frame_size if count is None else min(count, len(data) // frame_size)
+        if not frames:
+            raise ValueError(f"{path} holds no complete {width}x{height} {fmt} frame")
+        data = data[:frames * frame_size].reshape(frames, frame_size)
+        if preload:  # the replay then does not measure the disk
+            data = np.array(data)
+        if os.path.exists(path + TIMESTAMPS_SUFFIX):
+            timestamps = np.load(path + TIMESTAMPS_SUFFIX)
+            if len(timestamps) < frames:
+                raise ValueError(f"{path}{TIMESTAMPS_SUFFIX} has {len(timestamps)} entries for {frames} frames")
+            timestamps = timestamps[:frames]
+        else:
+            timestamps = np.arange(frames, dtype=np.int64) * round(1e9 / fps)
+        return cls(data, timestamps)
+
+    @classmethod
+    def _open_video(cls, path, fps, count):
+        import cv2
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise IOError(f"Could not open {path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or fps
+        frames, timestamps = [], []
+        try:
+            while count is None or len(frames) < count:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                frames.append(frame)
+                timestamps.append(round(capture.get(cv2.CAP_PROP_POS_MSEC) * 1e6))
+        finally:
+            capture.release()
+        if not frames:
+            raise IOError(f"No frames decoded from {path}")
+        if len(timestamps) > 1 and (np.diff(timestamps) <= 0).any():
+            # raw elementary streams have no usable timestamps
+            timestamps = np.arange(len(frames), dtype=np.int64) * round(1e9 / fps)
+        return cls(frames, timestamps)
+
+
+class ReplayCamera:
+    """
+    A clip played back in real time (or at rate x real time) through camera-like stream buffers.
+
+    Parameters:
+        - clip (ReplayClip): frames to play
+        - rate (float): playback speed, 2.0 delivers twice as fast; None: no pacing, nothing lost
+        - buffers (int): frames that can wait for the consumer before new ones are lost
+        - count (int): frames to deliver (default: the clip once, or forever when looping)
+        - loop (bool): start the clip again after its last frame
+        - jitter_ms (float): standard deviation of gaussian jitter added to every due time
+        - start_offset_s (float): delay of the first frame after start()
+        - seed (int): seed of the jitter
+        - name (str): used in logs and the report
+        - log (callable): receives the fell-behind / caught-up messages
+    """
+
+    def __init__(self, clip, rate=1.0, buffers=10, count=None, loop=False, jitter_ms=0.0, start_offset_s=0.0,
+                 seed=0, name="replay", log=print):
+        self.clip = clip
+        self.rate = rate
+        self.buffers = buffers
+        self.count = count if count is not None else (None if loop else len(clip))
+        self.jitter_ns = jitter_ms * 1e6
+        self.start_offset_ns = int(start_offset_s * 1e9)
+        self.seed = seed
+        self.name = name
+        self.log = log
+        self.stats = {"delivered": 0, "lost": 0, "source_late": 0}
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._done = False
+        self._behind = False
+        self._lags_ns = array.array("q")
+        self._thread = None
+        self._t0_ns = None
+        self._last_get_ns = None
+
+    def start(self):
+        running, go = threading.Event(), threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(running, go), name=f"{self.name}-producer", daemon=True)
+        self._thread.start()
+        running.wait()  # starting a thread can take milliseconds; the schedule begins once it runs
+        self._t0_ns = _perf_counter_ns() + self.start_offset_ns
+        go.set()
+        return self
+
+    def _run(self, running, go):
+        clip, rate, queue, cond = self.clip, self.rate, self._queue, self._cond
+        rng = np.random.default_rng(self.seed)
+        running.set()
+        go.wait()
+        frames = len(clip)
+        previous_due = 0
+        i = 0
+        while (self.count is None or i < self.count) and not self._stop.is_set():
+            loop, j = divmod(i, frames)
+            data = clip.frames[j]
+            if rate is None:
+                due = _perf_counter_ns()
+            else:
+                due = self._t0_ns + int((int(clip.timestamps_ns[j]) + loop * clip.loop_ns) / rate)
+                if self.jitter_ns:
+                    due += int(rng.normal(0.0, self.jitter_ns))
+                due = max(due, previous_due)  # jitter delays frames, it does not reorder them
+                previous_due = due
+                wait_ns = due - _perf_counter_ns()
+                if wait_ns > 0:
+                    if self._stop.wait(wait_ns / 1e9):
+                        break
+                elif -wait_ns > clip.interval_ns / rate:
+                    self.stats["source_late"] += 1  # this thread could not produce the frame in time
+            with cond:
+                if rate is None:
+                    while len(queue) >= self.buffers and not self._stop.is_set():
+                        cond.wait(0.1)
+                if len(queue) >= self.buffers:
+                    self.stats["lost"] += 1
+                    if not self._behind:
+                        self._behind = True
+                        self.log(f"{self.name}: consumer fell behind at frame {i}, "
+                                 f"all {self.buffers} buffers full, frames are being lost")
+                else:
+                    queue.append(ReplayFrame(i, due, data))
+                    cond.notify()
+            i += 1
+        with cond:
+            self._done = True
+            cond.notify_all()
+
+    def get_next(self, timeout=None):
+        """The oldest buffered frame; None once the replay has ended. Raises TimeoutError."""
+        with self._cond:
+            while not self._queue:
+                if self._done:
+                    return None
+                if not self._cond.wait(timeout):
+                    raise TimeoutError(f"{self.name}: no frame within {timeout} s")
+            frame = self._queue.popleft()
+            if self.rate is None:
+                self._cond.notify()
+            last = self.count is not None and frame.index == self.count - 1
+            if self._behind and not self._queue and not last:  # drained at the end is not catching up
+                self._behind = False
+                self.log(f"{self.name}: caught up at frame {frame.index}, {self.stats['lost']} frames lost so far")
+        now = _perf_counter_ns()
+        self._lags_ns.append(now - frame.timestamp_ns)
+        self._last_get_ns = now
+        self.stats["delivered"] += 1
+        return frame
+
+    def readinto(self, out):
+        """Copy the next frame into out (like file.readinto); returns its size, 0 at the end."""
+        frame = self.get_next()
+        if frame is None:
+            return 0
+        source = frame.data.reshape(-1)
+        destination = np.frombuffer(out, np.uint8)
+        if source.nbytes > destination.nbytes:
+            raise ValueError(f"{self.name}: frame of {source.nbytes} bytes does not fit in {destination.nbytes}")
+        destination[:source.nbytes] = source.view(np.uint8)
+        return source.nbytes
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def snapshot(self):
+        lags = np.frombuffer(self._lags_ns, np.int64) / 1e6 if len(self._lags_ns) else np.zeros(1)
+        elapsed_ns = (self._last_get_ns or _perf_counter_ns()) - self._t0_ns if self._t0_ns else 0
+        delivered = self.stats["delivered"]
+        return dict(self.stats, name=self.name,
+                    target_fps=None if self.rate is None else self.clip.fps * self.rate,
+                    delivered_fps=(delivered - 1) * 1e9 / elapsed_ns if delivered > 1 and elapsed_ns > 0 else 0.0,
+                    lag_p50_ms=float(np.percentile(lags, 50)), lag_p99_ms=float(np.percentile(lags, 99)),
+                    lag_max_ms=float(lags.max()), real_time=self.stats["lost"] == 0)
+
+    def report(self):
+        s = self.snapshot()
+        target = "unpaced" if s["target_fps"] is None else f"nominal {s['target_fps']:.1f} fps"
+        line = (f"{s['name']}: {s['delivered']} delivered, {s['lost']} lost, {s['delivered_fps']:.1f} fps ({target}), "
+                f"lag p50 {s['lag_p50_ms']:.1f} / p99 {s['lag_p99_ms']:.1f} / max {s['lag_max_ms']:.1f} ms")
+        if s["source_late"]:
+            line += f", replay itself late {s['source_late']} times (results understate the consumer)"
+        return line + (" - kept real-time pace" if s["real_time"] else " - did NOT keep real-time pace")
+
+
+def open_raw(path, width, height, fmt, replay_rate=None, fps=30.0, count=None):
+    """
+    A raw (or indexed raw) file for readinto(): the file itself when replay_rate is None, else a
+    ReplayCamera delivering it at replay_rate x real time (started by the with statement).
+    """
+    if replay_rate is None:
+        return open(path, "rb")
+    clip = ReplayClip.open(path, width, height, fmt, fps=fps, count=count, preload=True)
+    return ReplayCamera(clip, rate=replay_rate, name=os.path.basename(path))
+
+
+def virtual_cameras(clip, cameras, rate=1.0, stagger=True, **options):
+    """ReplayCameras on one clip, each with its own jitter seed; stagger spreads their phases."""
+    interval_s = clip.interval_ns / 1e9 / (rate or 1.0)
+    return [ReplayCamera(clip, rate=rate, seed=i, name=f"replay{i}",
+                         start_offset_s=i * interval_s / cameras if stagger else 0.0, **options)
+            for i in range(cameras)]
+
+
+def _consume(camera, work_ms):
+    while camera.get_next() is not None:
+        deadline = _perf_counter_ns() + work_ms * 1e6
+        while _perf_counter_ns() < deadline:  # stands in for convert / encode / write
+            time.sleep(0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Replay a clip in real time into consumers that take --work_ms per frame")
+    parser.add_argument("-i", "--path", type=str, default=None, help="raw, indexed raw or video file (default synthetic)")
+    parser.add_argument("-s", "--size", type=str, default="640x480", help="widthxheight of raw frames")
+    parser.add_argument("-if", "--format", type=str, default="NV12", help="surface format of raw frames")
+    parser.add_argument("--fps", type=float, default=60.0, help="frame rate of raw files without timestamps")
+    parser.add_argument("--rate", type=float, default=1.0, help="playback speed multiplier")
+    parser.add_argument("--cameras", type=int, default=2, help="simultaneous virtual cameras")
+    parser.add_argument("--frames", type=int, default=120, help="frames per camera")
+    parser.add_argument("--jitter_ms", type=float, default=0.5)
+    parser.add_argument("--work_ms", type=float, nargs="+", default=[8.0, 25.0],
+                        help="consumer time per frame; one run per value")
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.size.split("x"))
+    if args.path is None:
+        from SyntheticVideo import SyntheticVideo
+        video = SyntheticVideo(width, height, args.format.upper(), fps=args.fps)
+        frames = min(args.frames, 60)  # looped
+        clip = ReplayClip(video.clip(frames), np.arange(frames) * round(1e9 / args.fps))
+        video.close()
+    else:
+        clip = ReplayClip.open(args.path, width, height, args.format.upper(), fps=args.fps, preload=True)
+    print(f"clip: {len(clip)} frames at {clip.fps:.1f} fps, replayed at {args.rate:g}x by {args.cameras} camera(s)")
+    for work_ms in args.work_ms:
+        print(f"consumer taking {work_ms:g} ms per frame:")
+        cameras = virtual_cameras(clip, args.cameras, rate=args.rate, count=args.frames, loop=True,
+                                  jitter_ms=args.jitter_ms, log=lambda message: print("  " + message))
+        consumers = [threading.Thread(target=_consume, args=(camera, work_ms)) for camera in cameras]
+        for camera, consumer in zip(cameras, consumers):
+            camera.start()
+            consumer.start()
+        for consumer in consumers:
+            consumer.join()
+        for camera in cameras:
+            camera.stop()
+            print("  " + camera.report())
@@ -0,0 +1,153 @@
+"""
+Keeps a video writer opened ahead of time so that recording can start on the very next frame.
+
+Opening a writer (cv2.VideoWriter, an ffmpeg process, an NVENC session) takes tens to hundreds of
+milliseconds, which used to be lost at the start of every trial. StandbyWriter always holds one
+writer that is already open on a hidden file in the output directory:
+
+    - start(name) swaps the standby writer in (no I/O on the caller's thread) and immediately
+      begins opening the next standby writer in the background
+    - stop() hands the active writer to a background thread, which releases it and atomically
+      renames the hidden file to the final name given at start()
+
+Usage:
+    standby = StandbyWriter(lambda path: cv2.VideoWriter(path, fourcc, fps, size), "videos")
+    writer = standby.start("trial_001.mp4")   # ready immediately
+    writer.write(frame)
+    standby.stop()                            # finalised in the background
+    standby.close()
+"""
+
+import itertools
+import os
+import threading
+
+
+class StandbyWriter:
+    """
+    Parameters:
+        - open_func (callable): path -> writer object with a release() method (or close())
+        - directory (str): where output files are written
+        - suffix (str): extension of the hidden standby files, e.g. ".mp4"
+        - is_opened (callable): optional writer -> bool check, e.g. cv2.VideoWriter.isOpened
+    """
+
+    def __init__(self, open_func, directory=".", suffix=".mp4", is_opened=None):
+        self.open_func = open_func
+        self.directory = directory
+        self.suffix = suffix
+        self.is_opened = is_opened
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._standby = None          # (writer, hidden path)
+        self._active = None           # (writer, hidden path, final path)
+        self._generation = 0          # bumped by reconfigure() so stale standby writers are discarded
+        self._finalisers = []
+        self.error = None
+        self._prepare()
+
+    def _hidden_path(self):
+        return os.path.join(self.directory, f".standby_{os.getpid()}_{next(self._counter)}{self.suffix}")
+
+    def _prepare(self):
+        self._ready.clear()
+        generation = self._generation
+        thread = threading.Thread(target=self._open_standby, args=(generation,), daemon=True)
+        thread.start()
+
+    def _open_standby(self, generation):
+        path = self._hidden_path()
+        try:
+            writer = self.open_func(path)
+            if self.is_opened is not None and not self.is_opened(writer):
+                raise IOError(f"Could not open video file {path} for writing")
+        except Exception as e:
+            self.error = e
+            self._ready.set()
+            return
+        with self._lock:
+            stale = generation != self._generation
+            if not stale:
+                self._standby = (writer, path)
+                self.error = None
+        if stale:
+            self._discard(writer, path)
+        else:
+            self._ready.set()
+
+    @staticmethod
+    def _release(writer):
+        (getattr(writer, "release", None) or writer.close)()
+
+    def _discard(self, writer, path):
+        self._release(writer)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def ready(self):
+        """True when a standby writer is open and start() will not have to wait."""
+        return self._ready.is_set() and self._standby is not None
+
+    def start(self, name, timeout=5.0):
+        """
+        Swap the standby writer in as the active writer for the output file `name` (relative to
+        directory) and return it. Only waits if the previous standby writer is still opening.
+        """
+        if self._active is not None:
+            raise RuntimeError("Recording already active, call stop() first")
+        if not self._ready.wait(timeout):
+            raise TimeoutError("Standby writer did not open in time")
+        with self._lock:
+            standby, self._standby = self._standby, None
+        if standby is None:
+            error, self.error = self.error, None
+            self._prepare()
+            raise IOError(f"Standby writer failed to open: {error}")
+        writer, path = standby
+        self._active = (writer, path, os.path.join(self.directory, name))
+        self._prepare()
+        return writer
+
+    @property
+    def writer(self):
+        return self._active[0] if self._active is not None else None
+
+    def stop(self):
+        """Finalise the active file in the background; returns its final path."""
+        if self._active is None:
+            return None
+        writer, path, final_path = self._active
+        self._active = None
+        thread = threading.Thread(target=self._finalise, args=(writer, path, final_path))
+        thread.start()
+        self._finalisers = [t for t in self._finalisers if t.is_alive()] + [thread]
+        return final_path
+
+    def _finalise(self, writer, path, final_path):
+        self._release(writer)
+        os.replace(path, final_path)
+
+    def reconfigure(self, open_func):
+        """Use a new open function (e.g. a different frame rate) for the next standby writer."""
+        with self._lock:
+            self.open_func = open_func
+            self._generation += 1
+            standby, self._standby = self._standby, None
+        if standby is not None:
+            threading.Thread(target=self._discard, args=standby, daemon=True).start()
+        self._prepare()
+
+    def close(self):
+        """Finalise the active file, discard the standby writer and wait for background work."""
+        self.stop()
+        self._ready.wait()
+        with self._lock:
+            self._generation += 1
+            standby, self._standby = self._standby, None
+        if standby is not None:
+            self._discard(*standby)
+        for thread in self._finalisers:
+            thread.join()
@@ -0,0 +1,318 @@
+"""
+Adaptive sizing of the Spinnaker stream buffers (StreamBufferCountManual) from the consumer lag
+and the transport layer statistics actually observed, instead of the driver default.
+
+With StreamBufferHandlingMode = OldestFirst every frame the application has not taken yet
+(GetNextImage ... Release) holds one stream buffer; when a stall of the grab loop (GUI update,
+garbage collection, a slow disk) lasts longer than the free buffers cover, the camera's frames
+are lost. The buffer count can only be changed while the camera is not streaming, so the
+controller works per session:
+
+    configure(cam)       before BeginAcquisition: OldestFirst, manual count, the current size
+    observe_frame(ts)    after every GetNextImage: the queueing delay of that frame, estimated as
+                         (host time - camera timestamp) minus the smallest such difference seen,
+                         which cancels the unknown offset between the two clocks; the largest
+                         delay is tracked exactly, the p99 from a fixed size uniform sample, so
+                         memory does not grow with the session length
+    poll(cam)            now and then: lost / dropped / underrun counters of the TL stream
+    end_session()        after EndAcquisition: decide the size for the next session, save it
+
+Decisions: any lost frame grows the count to at least twice the current size (and at least the
+largest observed lag in frames times the headroom). After `stable_sessions` sessions without
+losses the count shrinks gradually towards that target, giving host memory back. The count always
+stays within [min_buffers, max_memory_bytes / frame_bytes]. State and a short history per camera
+serial are kept in a JSON file next to the camera profiles, and every decision is logged.
+
+SimulatedCamera reproduces the buffer behaviour (frames at a fixed rate, a consumer with random
+stalls, frames lost when every buffer is held) so the controller can be tested without hardware:
+
+    python StreamBuffers.py          # a few simulated sessions and the decisions taken
+
+Usage:
+    controller = StreamBufferController(frame_bytes=width * height, fps=frame_rate, serial=serial)
+    controller.configure(cam)
+    cam.BeginAcquisition()
+    for i in range(n):
+        image = cam.GetNextImage()
+        controller.observe_frame(image.GetTimeStamp())
+        ...
+        if i % 100 == 0: controller.poll(cam)
+    controller.poll(cam)
+    cam.EndAcquisition()
+    print(controller.end_session())
+"""
+
+import json
+import math
+import os
+import random
+import time
+from collections import deque
+
+import numpy as np
+
+from CameraStartup import PROFILE_CACHE_PATH, set_node
+
+STREAM_STATE_PATH = os.path.join(os.path.dirname(PROFILE_CACHE_PATH), "stream_buffers.json")
+
+# TL stream counters that mean a frame never reached the application
+LOSS_COUNTERS = ("StreamLostFrameCount", "StreamDroppedFrameCount", "StreamBufferUnderrunCount")
+STREAM_COUNTERS = LOSS_COUNTERS + ("StreamIncompleteFrameCount", "StreamFailedBufferCount")
+_HISTORY_LENGTH = 20
+
+
+def read_stream_statistics(cam):
+    """Current TL stream counters of a PySpin camera (or a SimulatedCamera) as a dict."""
+    if not hasattr(cam, "GetTLStreamNodeMap"):
+        return cam.stream_statistics()
+    import PySpin
+    nodemap = cam.GetTLStreamNodeMap()
+    stats = {}
+    for name in STREAM_COUNTERS:
+        node = PySpin.CIntegerPtr(nodemap.GetNode(name))
+        if PySpin.IsAvailable(node) and PySpin.IsReadable(node):
+            stats[name] = node.GetValue()
+    return stats
+
+
+def _load_state(path):
+    try:
+        with open(path) as jsonFile:
+            return json.load(jsonFile)
+    except (OSError, ValueError):
+        return {}
+
+
+class StreamBufferController:
+    """
+    Parameters:
+        - frame_bytes (int): size of one image in the stream buffers
+        - fps (float): acquisition frame rate
+        - serial (str): camera serial number, key of the saved state
+        - min_buffers (int): never fewer stream buffers than this
+        - max_memory_bytes (int): never more buffer memory than this
+        - headroom (float): buffers per frame of the largest lag observed
+        - initial_stall_seconds (float): stall to cover before anything was observed
+        - stable_sessions (int): sessions without losses before the count shrinks
+        - lag_samples (int): frames kept (uniformly sampled) for the lag percentiles of a session
+        - state_path (str): JSON file with the per camera state, None to keep nothing
+        - log (callable): receives every decision as a line of text
+    """
+
+    def __init__(self, frame_bytes, fps, serial="", min_buffers=10, max_memory_bytes=1 << 30, headroom=1.5,
+                 initial_stall_seconds=0.5, stable_sessions=3, lag_samples=8192, state_path=STREAM_STATE_PATH,
+                 log=print):
+        self.frame_bytes = frame_bytes
+        self.fps = fps
+        self.serial = serial or "default"
+        self.min_buffers = min_buffers
+        self.max_buffers = max(min_buffers, int(max_memory_bytes // frame_bytes))
+        self.headroom = headroom
+        self.stable_sessions = stable_sessions
+        self.lag_samples = lag_samples
+        self._samples = np.empty(lag_samples, np.int64)
+        self._random = random.Random(0).random
+        self.state_path = state_path
+        self.log = log
+        self.state = _load_state(state_path).get(self.serial, {}) if state_path else {}
+        if "buffer_count" in self.state:
+            self.buffer_count = self._clamp(self.state["buffer_count"])
+            self.log(f"stream buffers: {self.buffer_count} from the last session of camera {self.serial}")
+        else:
+            self.buffer_count = self._clamp(math.ceil(initial_stall_seconds * fps * headroom))
+            self.log(f"stream buffers: {self.buffer_count} to cover a {initial_stall_seconds * 1000:.0f} ms stall "
+                     f"at {fps:.0f} fps (no history for camera {self.serial})")
+        self._reset_session()
+
+    def _clamp(self, count):
+        return int(min(self.max_buffers, max(self.min_buffers, count)))
+
+    def _reset_session(self):
+        self.frames = 0
+        self._max_difference = None
+        self._offset = None
+        self._baseline = None
+        self.stats = {}
+
+    @property
+    def memory_bytes(self):
+        return self.buffer_count * self.frame_bytes
+
+    def configure(self, cam):
+        """Write the stream buffer settings; the camera must not be streaming."""
+        self._reset_session()
+        if not hasattr(cam, "GetTLStreamNodeMap"):
+            cam.buffer_count = self.buffer_count
+        else:
+            import PySpin
+            nodemap = cam.GetTLStreamNodeMap()
+            set_node(nodemap, "StreamBufferHandlingMode", "OldestFirst")
+            set_node(nodemap, "StreamBufferCountMode", "Manual")
+            node = PySpin.CIntegerPtr(nodemap.GetNode("StreamBufferCountManual"))
+            if PySpin.IsReadable(node) and node.GetMax() < self.buffer_count:
+                self.log(f"stream buffers: camera allows at most {node.GetMax()}, not {self.buffer_count}")
+                self.buffer_count = self.max_buffers = int(node.GetMax())
+            set_node(nodemap, "StreamBufferCountManual", self.buffer_count)
+        self.log(f"stream buffers: {self.buffer_count} x {self.frame_bytes / 1e6:.2f} MB = "
+                 f"{self.memory_bytes / 1e6:.0f} MB, {self.buffer_count / self.fps * 1000:.0f} ms of frames")
+
+    def observe_frame(self, camera_timestamp_ns, host_ns=None):
+        """Record the queueing delay of a frame the application just received."""
+        host_ns = time.perf_counter_ns() if host_ns is None else host_ns
+        difference = host_ns - camera_timestamp_ns
+        if self._offset is None or difference < self._offset:
+            self._offset = difference
+        if self._max_difference is None or difference > self._max_difference:
+            self._max_difference = difference
+        # reservoir sampling: every frame of the session is kept with the same probability
+        frames = self.frames
+        if frames < self.lag_samples:
+            self._samples[frames] = difference
+        else:
+            slot = int(self._random() * (frames + 1))
+            if slot < self.lag_samples:
+                self._samples[slot] = difference
+        self.frames = frames + 1
+
+    def poll(self, cam):
+        """Read the TL stream counters; losses are counted from the first poll of the session."""
+        stats = read_stream_statistics(cam)
+        if self._baseline is None:
+            self._baseline = dict(stats)
+        self.stats = {name: value - self._baseline.get(name, 0) for name, value in stats.items()}
+        return self.stats
+
+    @property
+    def lost_frames(self):
+        return sum(self.stats.get(name, 0) for name in LOSS_COUNTERS)
+
+    def lag_seconds(self):
+        """Queueing delay in seconds of the sampled frames (every frame up to lag_samples)."""
+        if not self.frames:
+            return np.zeros(0)
+        return (self._samples[:min(self.frames, self.lag_samples)].astype(np.float64) - self._offset) / 1e9
+
+    @property
+    def max_lag_seconds(self):
+        """Largest queueing delay of the session, over every frame."""
+        return (self._max_difference - self._offset) / 1e9 if self.frames else 0.0
+
+    def end_session(self):
+        """Choose and save the buffer count for the next session; returns the decision as text."""
+        frames = self.frames
+        max_lag = self.max_lag_seconds
+        p99_lag = float(np.percentile(self.lag_seconds(), 99)) if frames else 0.0
+        # frames held at the worst moment, plus the one being delivered and the one being filled
+        needed = math.ceil(max_lag * self.fps) + 2
+        target = self._clamp(math.ceil(needed * self.headroom))
+        lost = self.lost_frames
+        clean = self.state.get("clean_sessions", 0)
+        previous = self.buffer_count
+
+        if lost:
+            clean = 0
+            count = self._clamp(max(target, 2 * previous))
+            reason = f"{lost} frames lost"
+        else:
+            clean += 1
+            if target < previous and clean >= self.stable_sessions:
+                count = self._clamp(max(target, math.floor(previous * 0.75)))
+                reason = f"{clean} sessions without losses, largest lag needs {needed} buffers"
+            elif target > previous:
+                count = target
+                reason = f"largest lag needs {needed} buffers"
+            else:
+                count = previous
+                reason = "no losses"
+        if count == self.max_buffers and lost:
+            reason += f", capped by the memory budget ({self.max_buffers} buffers)"
+
+        decision = (f"stream buffers: {previous} -> {count} ({reason}; {frames} frames, "
+                    f"lag p99 {p99_lag * 1000:.1f} ms, max {max_lag * 1000:.1f} ms)")
+        self.log(decision)
+        self.buffer_count = count
+        history = self.state.get("history", [])[-(_HISTORY_LENGTH - 1):]
+        history.append({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "buffers": previous, "frames": frames,
+                        "lost": lost, "p99_lag_ms": round(p99_lag * 1000, 2), "max_lag_ms": round(max_lag * 1000, 2),
+                        "next_buffers": count})
+        self.state = {"buffer_count": count, "clean_sessions": clean, "history": history}
+        if self.state_path:
+            state = _load_state(self.state_path)
+            state[self.serial] = self.state
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(self.state_path, "w") as jsonFile:
+                json.dump(state, jsonFile, indent=2)
+        self._reset_session()
+        return decision
+
+
+class SimulatedCamera:
+    """
+    Frames at a fixed rate into buffer_count stream buffers (OldestFirst); a consumer that takes
+    service_seconds per frame plus, with probability stall_probability, a stall of stall_seconds.
+    A frame arriving while every buffer is held is lost (StreamLostFrameCount).
+
+    Parameters:
+        - fps (float): frame rate
+        - service_seconds (float): consumer time per frame
+        - stall_probability (float): chance of a stall per frame
+        - stall_seconds (float or (low, high)): stall length, fixed or uniform in a range
+        - seed (int): random seed
+    """
+
+    def __init__(self, fps, service_seconds=0.001, stall_probability=0.002, stall_seconds=(0.05, 0.3), seed=0):
+        self.fps = fps
+        self.service_seconds = service_seconds
+        self.stall_probability = stall_probability
+        self.stall_seconds = stall_seconds if isinstance(stall_seconds, tuple) else (stall_seconds, stall_seconds)
+        self.rng = np.random.default_rng(seed)
+        self.buffer_count = 10
+        self._stats = {"StreamLostFrameCount": 0, "StreamBufferUnderrunCount": 0}
+
+    def stream_statistics(self):
+        return dict(self._stats)
+
+    def run(self, frames):
+        """Generator of (camera timestamp ns, host ns) of every frame the consumer receives."""
+        host_offset_ns = 123_456_789_000  # the clocks do not share an origin
+        held = deque()    # release times of the frames holding a buffer
+        consumer_free = 0.0
+        for i in range(frames):
+            arrival = i / self.fps
+            while held and held[0] <= arrival:
+                held.popleft()
+            if len(held) >= self.buffer_count:
+                self._stats["StreamLostFrameCount"] += 1
+                continue
+            start = max(consumer_free, arrival)
+            service = self.service_seconds
+            if self.rng.random() < self.stall_probability:
+                service += self.rng.uniform(*self.stall_seconds)
+            consumer_free = start + service
+            held.append(consumer_free)
+            yield int(arrival * 1e9), int(start * 1e9) + host_offset_ns
+
+
+def simulate(controller, camera, sessions=6, frames=20000):
+    """Run sessions on a simulated camera; returns (buffer count, lost frames) of every session."""
+    results = []
+    for _ in range(sessions):
+        controller.configure(camera)
+        controller.poll(camera)
+        for camera_ns, host_ns in camera.run(frames):
+            controller.observe_frame(camera_ns, host_ns)
+        controller.poll(camera)
+        results.append((controller.buffer_count, controller.lost_frames))
+        controller.end_session()
+    return results
+
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as folder:
+        state_path = os.path.join(folder, "stream_buffers.json")
+        camera = SimulatedCamera(fps=200, stall_probability=0.001, stall_seconds=(0.05, 0.4), seed=1)
+        controller = StreamBufferController(720 * 540, 200, serial="simulated", min_buffers=10,
+                                            initial_stall_seconds=0.05, state_path=state_path)
+        for count, lost in simulate(controller, camera, sessions=8):
+            print(f"  session with {count:4d} buffers: {lost} frames lost")
@@ -0,0 +1,123 @@
+"""
+Preallocated pool of raw frame surfaces for the encode paths.
+
+All surfaces of a pool live in one allocation made up front, either on the host (numpy, optionally
+page-locked so that host to device copies can run at full PCIe speed) or on the device (CUDA).
+Surfaces are handed out again and again, so nothing is allocated per frame:
+
+    pool = SurfacePool(1920, 1080, "NV12", count=4)
+    surface = pool.acquire()
+    dec_file.readinto(surface.data)      # fill in place
+    bitstream = nvenc.Encode(surface.data)
+    pool.release(surface)
+
+Host surfaces expose `data` (1-D uint8 view of the whole frame, accepted by nvenc.Encode when the
+encoder was created with use_cpu_memory) and `planes` (zero-copy numpy views of each plane).
+Device surfaces expose `gpuAlloc`, `frameSize` and `cuda()` like Utils.AppFrame, so they can be
+passed to nvenc.Encode and Utils.FetchGPUFrame unchanged.
+"""
+
+import queue
+
+import numpy as np
+
+from PixelFormats import GetFrameLayout
+
+
+class _CAI:
+    def __init__(self, interface):
+        self.__cuda_array_interface__ = interface
+
+
+class HostSurface:
+    def __init__(self, pool, index, data):
+        self.pool = pool
+        self.index = index
+        self.layout = pool.layout
+        self.data = data
+        self.planes = self.layout.plane_views(data)
+        self.frameSize = self.layout.frame_size
+
+    def __repr__(self):
+        return f"HostSurface({self.index}, {self.layout!r})"
+
+
+class DeviceSurface:
+    def __init__(self, pool, index, address):
+        self.pool = pool
+        self.index = index
+        self.layout = pool.layout
+        self.gpuAlloc = address
+        self.frameSize = self.layout.frame_size
+        cai = [_CAI(interface) for interface in self.layout.cuda_array_interfaces(address)]
+        # NVENC expects a single interface for packed formats and a list for planar ones
+        self.cai = cai[0] if len(cai) == 1 else cai
+
+    def cuda(self):
+        return self.cai
+
+    def __repr__(self):
+        return f"DeviceSurface({self.index}, {self.layout!r})"
+
+
+class SurfacePool:
+    """
+    Parameters:
+        - width, height (int): frame geometry in pixels
+        - fmt (str): surface format, any key of PixelFormats.PIXEL_FORMATS
+        - count (int): number of surfaces to preallocate
+        - device (str): "host" for numpy buffers or "cuda" for device memory
+        - pinned (bool): allocate host surfaces in page-locked memory (needs pycuda)
+    """
+
+    def __init__(self, width, height, fmt, count=4, device="host", pinned=False):
+        if count < 1:
+            raise ValueError("A surface pool needs at least one surface")
+        if device not in ("host", "cuda"):
+            raise ValueError(f"Unknown surface device {device}, expected 'host' or 'cuda'")
+        self.layout = GetFrameLayout(width, height, fmt)
+        self.device = device
+        size = self.layout.frame_size
+
+        if device == "host":
+            if pinned:
+                import pycuda.autoinit  # noqa: F401  (creates the context page-locked memory belongs to)
+                import pycuda.driver as cuda
+                self.buffer = cuda.pagelocked_empty((count, size), np.uint8)
+            else:
+                self.buffer = np.empty((count, size), np.uint8)
+            self.surfaces = [HostSurface(self, i, self.buffer[i]) for i in range(count)]
+        else:
+            import pycuda.autoinit  # noqa: F401
+            import pycuda.driver as cuda
+            self.buffer = cuda.mem_alloc(count * size)
+            self.surfaces = [DeviceSurface(self, i, int(self.buffer) + i * size) for i in range(count)]
+
+        self._free = queue.Queue()
+        for surface in self.surfaces:
+            self._free.put(surface)
+
+    def acquire(self, timeout=None):
+        """Take a free surface, blocking until one is released. Raises queue.Empty on timeout."""
+        return self._free.get(timeout=timeout)
+
+    def release(self, surface):
+        """Hand a surface back to the pool once the encoder is done with it."""
+        if surface.pool is not self:
+            raise ValueError("Surface does not belong to this pool")
+        self._free.put(surface)
+
+    def available(self):
+        return self._free.qsize()
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    def __getitem__(self, index):
+        return self.surfaces[index]
+
+    def __iter__(self):
+        return iter(self.surfaces)
+
+    def __repr__(self):
+        return f"SurfacePool({len(self)} x {self.layout!r}, {self.device})"
@@ -0,0 +1,359 @@
+"""
+Synthetic but realistic test video for encoder and I/O benchmarks, instead of the uniform random
+noise of test_files/createRandomYUV.py, which no encoder can compress and which therefore says
+nothing about the bitrates or encode speeds of real recordings.
+
+Every frame is a static background (lighting gradient, walls / shelves, fine texture) with a
+number of textured objects moving across it, lighting flicker from the mains frequency aliasing
+against the frame rate, and Gaussian sensor noise at a configurable SNR:
+
+    snr_db = 20 * log10(mean background level / noise sigma)      (about 30-40 dB for our cameras)
+
+Frame i depends only on (seed, i), so clips are reproducible and frames can be rendered in any
+order. Rendering is vectorised and allocates nothing per frame: the background and object
+sprites are drawn once, each frame only restores the rectangles the objects covered in the
+previous one, converts with ColorConverter, applies the flicker as a lookup table and adds noise
+from a precomputed bank (two independent noise fields at random offsets, so the noise never
+repeats in a way an encoder's motion search could exploit).
+
+    formats  NV12, YUV420 (I420), P010 (10 bit noise in the MSBs), Mono8,
+             BayerRG8, BayerBG8, BayerGB8, BayerGR8 (PySpin names, top left pixel first)
+
+NV12 / YUV420 / P010 frames are returned as flat buffers of GetFrameSize(width, height, fmt)
+bytes, like encoder surfaces; Mono8 and Bayer frames as (height, width) arrays like camera images.
+
+Usage:
+    video = SyntheticVideo(1920, 1080, "NV12", fps=30, seed=1, snr_db=34)
+    frame = video.render(0)                      # reused buffer, copy it to keep it
+    for frame in video.frames(300): encoder.Encode(frame)
+    video.write("test_files/synthetic_1080p.yuv", 300)
+    clip = SyntheticVideo(1280, 720, "Mono8").clip(300)       # (300, 720, 1280) for EncoderSweep
+
+    python SyntheticVideo.py 1920 1080 -f NV12 -n 300 -o test_files/synthetic_1080p.yuv
+    python SyntheticVideo.py 1920 1080 -n 0 -o - | ffmpeg -f rawvideo -pix_fmt nv12 -s 1920x1080 -i - ...
+"""
+
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from ColorConvert import ColorConverter
+from PixelFormats import GetFrameLayout
+
+FORMATS = ("NV12", "YUV420", "P010", "Mono8", "BayerRG8", "BayerBG8", "BayerGB8", "BayerGR8")
+
+# BGR channel of the pixels (0, 0), (0, 1), (1, 0), (1, 1) of every 2x2 Bayer cell
+_BAYER_CHANNELS = {"BayerRG8": (2, 1, 1, 0), "BayerBG8": (0, 1, 1, 2),
+                   "BayerGB8": (1, 0, 2, 1), "BayerGR8": (1, 2, 0, 1)}
+_NOISE_PAD = 64          # noise fields are this much larger than a plane, for the random offsets
+_P010_NOISE_LIMIT = 15   # 8 bit units; keeps 235 << 8 plus noise below 65535 so the low 6 bits stay zero
+
+
+def _bounce(position, length):
+    """Triangle wave: position folded back and forth into [0, length]."""
+    if length <= 0:
+        return 0
+    position %= 2 * length
+    return int(2 * length - position if position > length else position)
+
+
+class _Sprite:
+    def __init__(self, image, mask, start, velocity):
+        self.image = image
+        self.mask = mask
+        self.start = start          # (y, x) at frame 0
+        self.velocity = velocity    # (dy, dx) in pixels per frame
+
+    def position(self, index, height, width):
+        rows, cols = self.mask.shape[:2]
+        return (_bounce(self.start[0] + self.velocity[0] * index, height - rows),
+                _bounce(self.start[1] + self.velocity[1] * index, width - cols))
+
+
+class SyntheticVideo:
+    """
+    Parameters:
+        - width, height (int): frame size (even)
+        - pixel_format (str): one of FORMATS
+        - fps (float): frame rate, sets the flicker beat and the real-time factor of write()
+        - seed (int): everything (scene, motion, flicker, noise) is derived from it
+        - objects (int): number of moving objects
+        - snr_db (float): sensor noise, see above; None for no noise
+        - flicker (float): relative amplitude of the lighting flicker (0 for none)
+        - flicker_hz (float): flicker frequency, twice the mains frequency
+        - speed (float): object speed in frame widths per second (objects vary around it)
+        - threads (int): ColorConverter threads
+    """
+
+    def __init__(self, width, height, pixel_format="NV12", fps=30.0, seed=0, objects=6, snr_db=34.0,
+                 flicker=0.03, flicker_hz=100.0, speed=0.15, threads=None):
+        if pixel_format.upper() in ("NV12", "YUV420", "P010", "I420"):
+            pixel_format = "YUV420" if pixel_format.upper() == "I420" else pixel_format.upper()
+        if pixel_format not in FORMATS:
+            raise ValueError(f"Unsupported pixel format {pixel_format}, expected one of {FORMATS}")
+        if width % 2 or height % 2:
+            raise ValueError(f"Width and height must be even, got {width}x{height}")
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.fps = fps
+        self.seed = seed
+        self.flicker = flicker
+        self.flicker_hz = flicker_hz
+        self.mono = pixel_format == "Mono8"
+        self.bayer = pixel_format.startswith("Bayer")
+
+        rng = np.random.default_rng(seed)
+        self.background = self._draw_background(rng)
+        self.sprites = [self._draw_sprite(rng, speed) for _ in range(objects)]
+        self._flicker_phase = rng.uniform(0, 2 * np.pi)
+        self._scene = self.background.copy()
+        self._dirty = []
+
+        self.layout = None
+        self._converter = None
+        self._nv12 = None
+        if self.mono or self.bayer:
+            self.frame_size = width * height
+            self.output = np.empty((height, width), np.uint8)
+        else:
+            self.layout = GetFrameLayout(width, height, pixel_format)
+            self.frame_size = self.layout.frame_size
+            self.output = np.empty(self.frame_size, np.uint8)
+            self._converter = ColorConverter("BGR", "NV12" if pixel_format == "P010" else pixel_format,
+                                             width, height, threads)
+            if pixel_format == "P010":
+                self._nv12 = np.empty(self._converter.layout.frame_size, np.uint8)
+
+        self.noise_sigma = None
+        self._luma_noise = self._chroma_noise = None
+        if snr_db is not None:
+            mean = float(self.background.mean())
+            self.noise_sigma = mean / 10 ** (snr_db / 20)
+            self._luma_noise = self._noise_bank(rng, height, width, self.noise_sigma)
+            if not (self.mono or self.bayer):
+                # 2x2 chroma subsampling averages the noise of four pixels
+                self._chroma_noise = self._noise_bank(rng, height // 2, width, self.noise_sigma / 2)
+
+    # scene, drawn once ########################################################################
+
+    def _draw_background(self, rng):
+        h, w = self.height, self.width
+        rows = np.linspace(0.0, 1.0, h, dtype=np.float32)[:, None]
+        cols = np.linspace(-1.0, 1.0, w, dtype=np.float32)[None, :]
+        # ceiling light: bright near the top centre, darker towards the corners
+        light = 0.55 + 0.45 * np.exp(-(cols ** 2) * 1.5 - rows * 1.2)
+        # a neutral room with a slight, slowly varying tint
+        tint = rng.uniform(-20, 20, (4, 6, 3)) + rng.uniform(90, 160, (4, 6, 1))
+        colour = cv2.resize(tint.astype(np.float32), (w, h), interpolation=cv2.INTER_CUBIC)
+        # walls, shelves, the floor: flat regions with sharp edges
+        for _ in range(8):
+            y0, x0 = int(rng.integers(0, h - h // 8)), int(rng.integers(0, w - w // 8))
+            y1, x1 = y0 + int(rng.integers(h // 16, h // 2)), x0 + int(rng.integers(w // 16, w // 2))
+            colour[y0:y1, x0:x1] = rng.uniform(50, 200) + rng.uniform(-25, 25, 3)
+        texture = cv2.GaussianBlur(rng.normal(0, 6, (h, w)).astype(np.float32), (0, 0), 1.2)
+        image = colour * light[:, :, None] + texture[:, :, None]
+        bgr = np.clip(image, 16, 235).astype(np.uint8)
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY) if self.mono else bgr
+
+    def _draw_sprite(self, rng, speed):
+        h, w = self.height, self.width
+        size = min(h, w)
+        rows, cols = int(size * rng.uniform(0.08, 0.25)), int(size * rng.uniform(0.08, 0.25))
+        y, x = np.mgrid[0:rows, 0:cols].astype(np.float32)
+        kind = rng.integers(0, 3)
+        if kind == 0:      # grating at a random angle
+            angle, period = rng.uniform(0, np.pi), rng.uniform(6, 24)
+            pattern = 0.5 + 0.5 * np.sin((x * np.cos(angle) + y * np.sin(angle)) * 2 * np.pi / period)
+        elif kind == 1:    # checkerboard
+            square = int(rng.integers(4, 16))
+            pattern = ((y // square + x // square) % 2).astype(np.float32)
+        else:              # blotches
+            pattern = cv2.resize(rng.uniform(0, 1, (6, 6)).astype(np.float32), (cols, rows),
+                                 interpolation=cv2.INTER_CUBIC)
+        pattern = 0.35 + 0.65 * np.clip(pattern, 0, 1)
+        image = np.clip(pattern[:, :, None] * rng.uniform(50, 235, 3), 16, 235).astype(np.uint8)
+        if self.mono:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        mask = np.zeros((rows, cols), np.uint8)
+        cv2.ellipse(mask, (cols // 2, rows // 2), (cols // 2 - 1, rows // 2 - 1), 0, 0, 360, 1, -1)
+        mask = mask.astype(bool)
+        if not self.mono:
+            mask = mask[:, :, None]
+        pixels_per_frame = speed * w / self.fps * rng.uniform(0.3, 1.7)
+        direction = rng.uniform(0, 2 * np.pi)
+        return _Sprite(image, mask, (rng.uniform(0, h), rng.uniform(0, w)),
+                       (pixels_per_frame * np.sin(direction), pixels_per_frame * np.cos(direction)))
+
+    def _noise_bank(self, rng, rows, cols, sigma):
+        """Two independent noise fields, split into saturating add and subtract parts."""
+        p010 = self.pixel_format == "P010"
+        bank = []
+        for _ in range(2):
+            noise = rng.normal(0, sigma / np.sqrt(2), (rows + _NOISE_PAD, cols + _NOISE_PAD)).astype(np.float32)
+            if p010:
+                # in 10 bit steps, shifted into the MSBs of the 16 bit words
+                noise = np.round(np.clip(noise, -_P010_NOISE_LIMIT, _P010_NOISE_LIMIT) * 4) * 64
+                bank.append((np.maximum(noise, 0).astype(np.uint16), np.maximum(-noise, 0).astype(np.uint16)))
+            else:
+                noise = np.round(noise)
+                bank.append((np.clip(noise, 0, 255).astype(np.uint8), np.clip(-noise, 0, 255).astype(np.uint8)))
+        return bank
+
+    # per frame ################################################################################
+
+    def _paste_objects(self, index):
+        scene = self._scene
+        for y0, y1, x0, x1 in self._dirty:
+            scene[y0:y1, x0:x1] = self.background[y0:y1, x0:x1]
+        self._dirty = []
+        for sprite in self.sprites:
+            y, x = sprite.position(index, self.height, self.width)
+            rows, cols = sprite.mask.shape[:2]
+            rows, cols = min(rows, self.height - y), min(cols, self.width - x)
+            np.copyto(scene[y:y + rows, x:x + cols], sprite.image[:rows, :cols], where=sprite.mask[:rows, :cols])
+            self._dirty.append((y, y + rows, x, x + cols))
+        return scene
+
+    def gain(self, index):
+        """Lighting gain of frame index."""
+        return 1.0 + self.flicker * np.sin(2 * np.pi * self.flicker_hz * index / self.fps + self._flicker_phase)
+
+    @staticmethod
+    def _add_noise(plane, bank, rng):
+        rows, cols = plane.shape
+        for positive, negative in bank:
+            dy, dx = rng.integers(0, _NOISE_PAD, 2)
+            cv2.add(plane, positive[dy:dy + rows, dx:dx + cols], dst=plane)
+            cv2.subtract(plane, negative[dy:dy + rows, dx:dx + cols], dst=plane)
+
+    def render(self, index, out=None):
+        """Frame index into out (default a buffer reused by every call); returns out."""
+        if out is None:
+            out = self.output
+        rng = np.random.default_rng([self.seed, index])
+        scene = self._paste_objects(index)
+        gain = self.gain(index)
+        levels = np.arange(256, dtype=np.float32)
+
+        if self.mono or self.bayer:
+            frame = out.reshape(self.height, self.width)
+            if self.mono:
+                np.copyto(frame, scene)
+            else:
+                for (dy, dx), channel in zip(((0, 0), (0, 1), (1, 0), (1, 1)), _BAYER_CHANNELS[self.pixel_format]):
+                    frame[dy::2, dx::2] = scene[dy::2, dx::2, channel]
+            lut = np.clip(levels * gain + 0.5, 0, 255).astype(np.uint8)
+            cv2.LUT(frame, lut, dst=frame)
+            if self._luma_noise is not None:
+                self._add_noise(frame, self._luma_noise, rng)
+            return out
+
+        surface = self._nv12 if self._nv12 is not None else out
+        self._converter.convert(scene, surface)
+        planes = self._converter.layout.plane_views(surface)
+        luma_lut = np.clip(16 + (levels - 16) * gain + 0.5, 0, 255).astype(np.uint8)
+        chroma_lut = np.clip(128 + (levels - 128) * gain + 0.5, 0, 255).astype(np.uint8)
+        cv2.LUT(planes[0], luma_lut, dst=planes[0])
+        chroma = [plane.reshape(plane.shape[0], -1) for plane in planes[1:]]
+        for plane in chroma:
+            cv2.LUT(plane, chroma_lut, dst=plane)
+
+        if self._nv12 is not None:
+            # NV12 and P010 store their samples in the same order, so one shift widens the frame
+            words = out.view("<u2")
+            np.left_shift(surface, 8, out=words, dtype=np.uint16)
+            planes = self.layout.plane_views(out)
+            chroma = [planes[1].reshape(planes[1].shape[0], -1)]
+        if self._luma_noise is not None:
+            self._add_noise(planes[0], self._luma_noise, rng)
+            for plane in chroma:
+                self._add_noise(plane, self._chroma_noise, rng)
+        return out
+
+    __getitem__ = render
+
+    def frames(self, count, start=0):
+        """Generator over frames start .. start + count - 1 (count 0: endless), all in one reused buffer."""
+        index = start
+        while not count or index < start + count:
+            yield self.render(index)
+            index += 1
+
+    def clip(self, count, start=0):
+        """count frames as one (count, ...) array, e.g. a reference clip for EncoderSweep."""
+        shape = (self.height, self.width) if self.mono or self.bayer else (self.frame_size,)
+        clip = np.empty((count,) + shape, np.uint8)
+        for i in range(count):
+            self.render(start + i, clip[i])
+        return clip
+
+    def write(self, destination, count, start=0):
+        """
+        Write count raw frames (0: until the reader goes away) to a path, "-" for stdout or an open
+        binary file. Returns frames, seconds, fps and the real-time factor at self.fps.
+        """
+        if destination == "-":
+            f, close = sys.stdout.buffer, False
+        elif isinstance(destination, str):
+            f, close = open(destination, "wb"), True
+        else:
+            f, close = destination, False
+        written = 0
+        started = time.perf_counter()
+        try:
+            for frame in self.frames(count, start):
+                f.write(memoryview(frame).cast("B"))
+                written += 1
+        except BrokenPipeError:
+            pass  # e.g. ffmpeg stopped reading
+        finally:
+            if close:
+                f.close()
+        seconds = time.perf_counter() - started
+        fps = written / seconds if seconds else 0.0
+        return {"frames": written, "seconds": seconds, "fps": fps, "realtime": fps / self.fps}
+
+    def close(self):
+        if self._converter is not None:
+            self._converter.close()
+
+
+def benchmark(width=1920, height=1080, pixel_format="NV12", frames=120, **options):
+    """Rendering speed in frames per second (nothing written)."""
+    video = SyntheticVideo(width, height, pixel_format, **options)
+    video.render(0)
+    start = time.perf_counter()
+    for i in range(1, frames + 1):
+        video.render(i)
+    fps = frames / (time.perf_counter() - start)
+    video.close()
+    return fps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Write reproducible synthetic test video as raw frames.")
+    parser.add_argument("width", type=int)
+    parser.add_argument("height", type=int)
+    parser.add_argument("-f", "--format", type=str, default="NV12", help=", ".join(FORMATS), )
+    parser.add_argument("-n", "--frames", type=int, default=300, help="Number of frames, 0 for endless", )
+    parser.add_argument("-r", "--fps", type=float, default=30.0, help="Frame rate of the content", )
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Random seed", )
+    parser.add_argument("--objects", type=int, default=6, help="Number of moving objects", )
+    parser.add_argument("--snr", type=float, default=34.0, help="Sensor noise SNR in dB, negative for none", )
+    parser.add_argument("--flicker", type=float, default=0.03, help="Relative lighting flicker amplitude", )
+    parser.add_argument("-o", "--output", type=str, default="", help="Output file, - for stdout", )
+    args = parser.parse_args()
+
+    video = SyntheticVideo(args.width, args.height, args.format, fps=args.fps, seed=args.seed,
+                           objects=args.objects, snr_db=None if args.snr < 0 else args.snr, flicker=args.flicker)
+    extension = "raw" if video.mono or video.bayer else "yuv"
+    output = args.output or f"synthetic_{args.width}x{args.height}_{args.format.lower()}_seed{args.seed}.{extension}"
+    stats = video.write(output, args.frames)
+    video.close()
+    print(f"{stats['frames']} frames of {args.width}x{args.height} {video.pixel_format} "
+          f"({video.frame_size} bytes each) to {output}: {stats['fps']:.0f} fps, "
+          f"{stats['realtime']:.1f}x real time", file=sys.stderr)
@@ -22,7 +22,6 @@
 # DEALINGS IN THE SOFTWARE.
 
 import sys
-import logging
 
 from struct import pack
 import sys
@@ -45,6 +44,9 @@ from contextlib import contextmanager
 import io
 import tempfile
 
+from PixelFormats import GetFrameLayout
+import AsyncLog
+
 SERVICE_LOGGING_FORMAT = (
         "[{filename:s}][{funcName:s}:{lineno:d}]" + "[{levelname:s}] {message:s}"
 )
@@ -52,18 +54,9 @@ SERVICE_LOGGING_STREAM = sys.stdout
 
 
 def get_logger(logger_name, log_level="info"):
-    SERVICE_LOGGING_LEVEL = getattr(logging, log_level.upper(), None)
-
-    logger = logging.getLogger(logger_name)
-    logger.setLevel(SERVICE_LOGGING_LEVEL)
-    ch = logging.StreamHandler(SERVICE_LOGGING_STREAM)
-    formatter = logging.Formatter(SERVICE_LOGGING_FORMAT, style="{")
-    ch.setFormatter(formatter)
-    ch.setLevel(SERVICE_LOGGING_LEVEL)
-    logger.addHandler(ch)
-    logger.propagate = False
-
-    return logger
+    # records are formatted and written by a background thread, off the encode path
+    return AsyncLog.get_logger(logger_name, log_level, stream=SERVICE_LOGGING_STREAM,
+                               fmt=SERVICE_LOGGING_FORMAT)
 
 
 logger = get_logger(__file__)
@@ -88,52 +81,19 @@ class AppCAI:
                                          "typestr": typestr, "version": 3}
 
 
+def _layout_cai(layout, base_address):
+    cai = [AppCAI(i["shape"], i["strides"], i["typestr"], i["data"][0])
+           for i in layout.cuda_array_interfaces(base_address)]
+    # packed formats (ARGB/ABGR) are described by a single interface, planar ones by a list
+    return cai[0] if len(cai) == 1 else cai
+
+
 class AppFrame:
     def __init__(self, width, height, format):
-        if format == "NV12":
-            nv12_frame_size = int(width * height * 3 / 2)
-            self.gpuAlloc = cuda.mem_alloc(nv12_frame_size)
-            self.cai = []
-            self.cai.append(AppCAI((height, width, 1), (width, 1, 1), "|u1", self.gpuAlloc))
-            chroma_alloc = int(self.gpuAlloc) + width * height
-            self.cai.append(AppCAI((int(height / 2), int(width / 2), 2), (width, 2, 1), "|u1", chroma_alloc))
-            self.frameSize = nv12_frame_size
-        if format == "ARGB" or format == "ABGR":
-            self.frameSize = width * height * 4
-            self.gpuAlloc = cuda.mem_alloc(self.frameSize)
-            self.cai = AppCAI((height, width, 4), (4 * width, 4, 1), "|u1", self.gpuAlloc)
-        if format == "YUV444":
-            self.frameSize = width * height * 3
-            self.gpuAlloc = cuda.mem_alloc(self.frameSize)
-            self.cai = []
-            self.cai.append(AppCAI((height, width, 1), (width, 1, 1), "|u1", self.gpuAlloc))
-            self.cai.append(AppCAI((height, width, 1), (width, 1, 1), "|u1", int(self.gpuAlloc) + width * height))
-            self.cai.append(AppCAI((height, width, 1), (width, 1, 1), "|u1", int(self.gpuAlloc) + 2 * width * height))
-        if format == "YUV420":
-            self.frameSize = int(width * height * 3 / 2)
-            self.gpuAlloc = cuda.mem_alloc(self.frameSize)
-            self.cai = []
-            self.cai.append(AppCAI((height, width, 1), (width, 1, 1), "|u1", self.gpuAlloc))
-            self.cai.append(
-                AppCAI((height / 2, width / 2, 1), (width / 2, 1, 1), "|u1", int(self.gpuAlloc) + width * height))
-            self.cai.append(AppCAI((height / 2, width / 2, 1), (width / 2, 1, 1), "|u1",
-                                   int(self.gpuAlloc) + width * height + width / 2 * height / 2))
-        if format == "P010":
-            self.frameSize = int(width * height * 3 / 2 * 2)
-            self.gpuAlloc = cuda.mem_alloc(self.frameSize)
-            self.cai = []
-            self.cai.append(AppCAI((height, width, 1), (width * 2, 2, 1), "|u1", self.gpuAlloc))
-            self.cai.append(
-                AppCAI((height / 2, width / 2, 2), (width * 2, 2, 1), "|u1", int(self.gpuAlloc) + width * height * 2))
-        if format == "YUV444_16BIT":
-            self.frameSize = int(width * height * 3 * 2)
-            self.gpuAlloc = cuda.mem_alloc(self.frameSize)
-            self.cai = []
-            self.cai.append(AppCAI((height, width, 1), (width * 2, 2, 1), "|u1", self.gpuAlloc))
-            self.cai.append(
-                AppCAI((height, width, 1), (width * 2, 2, 1), "|u1", int(self.gpuAlloc) + width * height * 2))
-            self.cai.append(
-                AppCAI((height, width, 1), (width * 2, 2, 1), "|u1", int(self.gpuAlloc) + width * height * 4))
+        layout = GetFrameLayout(width, height, format)
+        self.frameSize = layout.frame_size
+        self.gpuAlloc = cuda.mem_alloc(self.frameSize)
+        self.cai = _layout_cai(layout, self.gpuAlloc)
 
     def cuda(self):
         return self.cai
@@ -141,51 +101,10 @@ class AppFrame:
 
 class AppFramePerf:
     def __init__(self, width, height, format, dataptr, frame_idx):
-
-        if format == "NV12":
-            nv12_frame_size = int(width * height * 3 / 2)
-            self.gpuAlloc = int(dataptr) + (frame_idx * nv12_frame_size)
-            self.cai = []
-            self.cai.append(AppCAI((height, width, 1), (width, 1, 1), "|u1", self.gpuAlloc))
-            chroma_alloc = int(self.gpuAlloc) + width * height
-            self.cai.append(AppCAI((int(height / 2), int(width / 2), 2), (width, 2, 1), "|u1", chroma_alloc))
-            self.frameSize = nv12_frame_size
-        if format == "ARGB" or format == "ABGR":
-            self.frameSize = width * height * 4
-            self.gpuAlloc = int(dataptr) + (frame_idx * self.frameSize)
-            self.cai = AppCAI((height, width, 4), (4 * width, 4, 1), "|u1", self.gpuAlloc)
-        if format == "YUV444":
-            self.frameSize = width * height * 3
-            self.gpuAlloc = int(dataptr) + (frame_idx * self.frameSize)
-            self.cai = []
-            self.cai.append(AppCAI((height, width, 1), (width, 1, 1), "|u1", self.gpuAlloc))
-            self.cai.append(AppCAI((height, width, 1), (width, 1, 1), "|u1", int(self.gpuAlloc) + width * height))
-            self.cai.append(AppCAI((height, width, 1), (width, 1, 1), "|u1", int(self.gpuAlloc) + 2 * width * height))
-        if format == "YUV420":
-            self.frameSize = int(width * height * 3 / 2)
-            self.gpuAlloc = int(dataptr) + (frame_idx * self.frameSize)
-            self.cai = []
-            self.cai.append(AppCAI((height, width, 1), (width, 1, 1), "|u1", self.gpuAlloc))
-            self.cai.append(
-                AppCAI((height / 2, width / 2, 1), (width / 2, 1, 1), "|u1", int(self.gpuAlloc) + width * height))
-            self.cai.append(AppCAI((height / 2, width / 2, 1), (width / 2, 1, 1), "|u1",
-                                   int(self.gpuAlloc) + width * height + width / 2 * height / 2))
-        if format == "P010":
-            self.frameSize = int(width * height * 3 / 2 * 2)
-            self.gpuAlloc = int(dataptr) + (frame_idx * self.frameSize)
-            self.cai = []
-            self.cai.append(AppCAI((height, width, 1), (width * 2, 2, 1), "|u1", self.gpuAlloc))
-            self.cai.append(
-                AppCAI((height / 2, width / 2, 2), (width * 2, 2, 1), "|u1", int(self.gpuAlloc) + width * height * 2))
-        if format == "YUV444_16BIT":
-            self.frameSize = int(width * height * 3 * 2)
-            self.gpuAlloc = int(dataptr) + (frame_idx * self.frameSize)
-            self.cai = []
-            self.cai.append(AppCAI((height, width, 1), (width * 2, 2, 1), "|u1", self.gpuAlloc))
-            self.cai.append(
-                AppCAI((height, width, 1), (width * 2, 2, 1), "|u1", int(self.gpuAlloc) + width * height * 2))
-            self.cai.append(
-                AppCAI((height, width, 1), (width * 2, 2, 1), "|u1", int(self.gpuAlloc) + width * height * 4))
+        layout = GetFrameLayout(width, height, format)
+        self.frameSize = layout.frame_size
+        self.gpuAlloc = int(dataptr) + (frame_idx * self.frameSize)
+        self.cai = _layout_cai(layout, self.gpuAlloc)
 
     def cuda(self):
         return self.cai
@@ -202,7 +121,10 @@ def FetchGPUFrame(input_frame_list, GetCPUFrameFunc, num_frames):
 
 
 def FetchCPUFrame(dec_file, frame_size):
+    # one staging buffer reused for every frame; FetchGPUFrame copies it to the device synchronously
+    staging = np.empty(frame_size, np.uint8)
+
     def InnerFunc():
-        return np.fromfile(dec_file, np.uint8, count=frame_size)
+        return staging[:dec_file.readinto(staging)]
 
     return InnerFunc
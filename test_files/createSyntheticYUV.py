@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "nvenc", "samples"))
+from SyntheticVideo import SyntheticVideo
+
+# Video settings
+width, height = 1280, 720  # Width and height of the video
+fps = 30  # Frames per second
+duration = 2  # Duration of the video in seconds
+pixel_format = 'YUV420'  # Same planar I420 layout as createRandomYUV.py (also NV12, P010, Mono8, BayerRG8, ...)
+seed = 0  # Same seed, same video
+snr_db = 34  # Sensor noise
+output_file = 'synthetic_video.yuv'  # Output file name
+
+# Static background, moving textured objects, lighting flicker and sensor noise,
+# so encoders see something like a real recording instead of incompressible noise
+video = SyntheticVideo(width, height, pixel_format, fps=fps, seed=seed, snr_db=snr_db)
+stats = video.write(output_file, fps * duration)
+video.close()
+
+print(f'YUV video saved as {output_file} ({stats["realtime"]:.1f}x real time)')